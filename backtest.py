@@ -0,0 +1,267 @@
+# -*- encoding: utf-8 -*-
+"""
+双低/封基策略回测与参数扫描
+把快照历史整理为 [日期 x 代码] 的日频面板，每组参数的选券、调仓和净值计算都以数组运算完成，
+参数组合分发到进程池并行计算，面板保存为 .npy 文件由各进程以内存映射只读共享
+用法: python backtest.py [convert_bonds|closed_funds]
+"""
+
+import os
+import sys
+import json
+import shutil
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import config
+from screener import CONVERT_BOND_MAX_PRICE
+
+TRADING_DAYS = 252
+
+
+class Panel(object):
+    """
+    日频面板数据
+    :param days: 日期列表
+    :param symbols: 代码列表
+    :param fields: {字段: [len(days) x len(symbols)] 的 float 数组}，缺失为 nan
+    """
+
+    def __init__(self, days, symbols, fields):
+        self.days = list(days)
+        self.symbols = list(symbols)
+        self.fields = fields
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    @property
+    def shape(self):
+        return len(self.days), len(self.symbols)
+
+    def save(self, path):
+        """
+        每个字段保存为一个 .npy 文件，供 load(mmap=True) 只读共享
+        """
+        os.makedirs(path, exist_ok=True)
+        for field, values in self.fields.items():
+            np.save(os.path.join(path, '%s.npy' % field), values)
+        with open(os.path.join(path, 'panel.json'), 'w', encoding='utf-8') as f:
+            json.dump({'days': self.days, 'symbols': self.symbols, 'fields': list(self.fields)}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, 'panel.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        fields = {field: np.load(os.path.join(path, '%s.npy' % field), mmap_mode=mode) for field in meta['fields']}
+        return cls(meta['days'], meta['symbols'], fields)
+
+
+def load_panel(store, fields=None, start=None, end=None):
+    """
+    从快照历史生成日频面板，每天取每个代码当天最后一次快照的值
+    :param store: history.HistoryStore
+    :param fields: 需要的字段，默认为 store 记录的全部字段
+    :param start/end: 日期区间，如 '2022-01-04'
+    """
+    fields = list(fields or store.fields)
+    days, bounds = store.day_index()
+    lo = 0 if start is None else np.searchsorted(days, start, 'left')
+    hi = len(days) if end is None else np.searchsorted(days, end, 'right')
+    days = days[lo:hi]
+
+    columns = store.columns()
+    data = {field: np.full((len(days), len(store.symbols)), np.nan, dtype=np.float32) for field in fields}
+    for d, i in enumerate(range(lo, hi)):
+        # 倒序后 unique 取到的是当天最后一次快照
+        symbols = np.asarray(columns['symbol'][bounds[i]:bounds[i + 1]])[::-1]
+        symbols, last = np.unique(symbols, return_index=True)
+        for field in fields:
+            data[field][d, symbols] = np.asarray(columns[field][bounds[i]:bounds[i + 1]])[::-1][last]
+    return Panel(days, store.symbols, data)
+
+
+def ffill(values):
+    """
+    沿日期方向用前一个有效值填充 nan
+    """
+    mask = np.isnan(values)
+    index = np.where(~mask, np.arange(values.shape[0])[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return values[index, np.arange(values.shape[1])]
+
+
+def double_low_score(panel, params):
+    """
+    双低策略得分，越小越好：价格 + premium_weight * 溢价率，排除价格高于 max_price 的转债
+    快照历史只记录数值字段，没有强赎日期和上市日期，不能像 screener 一样排除已公告强赎和待上市的转债，
+    回测结果会包含这些转债
+    """
+    price = panel['price']
+    score = price + params.get('premium_weight', 1.0) * panel['premium_rt']
+    score[~(price <= params.get('max_price', CONVERT_BOND_MAX_PRICE))] = np.nan
+    return score
+
+
+def closed_fund_score(panel, params):
+    """
+    封基得分，越小越好：-(折价率 - discount_offset) / 剩余年限，排除剩余年限不足 min_left_year 的封基
+    """
+    left_year = panel['left_year']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = -(panel['discount_rt'] - params.get('discount_offset', 1.5)) / left_year
+    score[~(left_year >= params.get('min_left_year', 0.05))] = np.nan
+    return score
+
+
+STRATEGIES = {
+    'double_low': double_low_score,
+    'closed_fund': closed_fund_score,
+}
+
+
+def backtest(panel, params, strategy='double_low', prices=None):
+    """
+    回测一组参数：每 rebalance 天按得分选出前 topk 个等权买入，持有期间不再调整权重
+    :param params: 策略参数，另外包含 topk、rebalance(调仓间隔天数)、fee(单边交易费率)
+    :param prices: 前向填充后的价格，批量回测时传入避免重复计算
+    :return: dict {params, total_return, annual_return, max_drawdown, sharpe, turnover, nav}，
+        面板不足两天或没有代码时没有可计算的收益，各项指标为 0，净值为空
+    """
+    if params.get('topk', 30) < 1:
+        raise ValueError("topk must be >= 1: %s" % params)
+    days, size = panel.shape
+    if days < 2 or not size:
+        return {'params': params, 'total_return': 0.0, 'annual_return': 0.0, 'max_drawdown': 0.0,
+                'sharpe': 0.0, 'turnover': 0.0, 'nav': np.ones(0)}
+    topk = min(params.get('topk', 30), size)
+    rebalance = max(1, params.get('rebalance', 1))
+    fee = params.get('fee', config.BACKTEST_FEE)
+    if prices is None:
+        prices = ffill(panel['price'])
+
+    score = STRATEGIES[strategy](panel, params)
+    # 没有价格的不能买入
+    score[np.isnan(score) | np.isnan(panel['price'])] = np.inf
+    rebalance_days = np.arange(0, days, rebalance)
+    scores = score[rebalance_days]
+    picks = np.argpartition(scores, topk - 1, axis=1)[:, :topk]
+    valid = np.isfinite(np.take_along_axis(scores, picks, axis=1))
+
+    # 第 t 天的收益由第 t-1 天所在调仓周期的持仓决定: 等权买入后的组合净值正比于持仓价格相对买入价的均值
+    period = (np.arange(1, days) - 1) // rebalance
+    held = picks[period]
+    weight = valid[period].astype(np.float64)
+    base = prices[rebalance_days][period[:, None], held]
+    today = np.take_along_axis(prices[1:], held, axis=1) / base
+    yesterday = np.take_along_axis(prices[:-1], held, axis=1) / base
+    count = weight.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.nansum(today * weight, axis=1) / np.nansum(yesterday * weight, axis=1)
+    returns = np.where(count > 0, growth - 1, 0.0)
+
+    # 调仓换手: 相邻两期持仓中换掉的比例，首次建仓为 1
+    holdings = np.zeros((len(rebalance_days), size), dtype=bool)
+    np.put_along_axis(holdings, picks, valid, axis=1)
+    held_count = np.maximum(holdings.sum(axis=1), 1)
+    kept = np.concatenate([[0], (holdings[1:] & holdings[:-1]).sum(axis=1)])
+    turnover = 1 - kept / held_count
+    # 调仓日收盘交易，费用计入下一天的收益
+    returns[rebalance_days[rebalance_days < days - 1]] -= turnover[rebalance_days < days - 1] * fee * 2
+    returns = np.nan_to_num(returns)
+
+    nav = np.cumprod(1 + returns)
+    total = nav[-1] - 1 if len(nav) else 0.0
+    std = returns.std()
+    return {
+        'params': params,
+        'total_return': float(total),
+        'annual_return': float((1 + total) ** (TRADING_DAYS / max(len(returns), 1)) - 1),
+        'max_drawdown': float(np.max(1 - nav / np.maximum.accumulate(nav))) if len(nav) else 0.0,
+        'sharpe': float(returns.mean() / std * np.sqrt(TRADING_DAYS)) if std > 0 else 0.0,
+        'turnover': float(turnover.mean()),
+        'nav': nav,
+    }
+
+
+def param_grid(**choices):
+    """
+    参数网格，如 param_grid(topk=[10, 20], max_price=[130, 150]) 生成 4 组参数
+    """
+    names = list(choices)
+    return [dict(zip(names, values)) for values in itertools.product(*(choices[name] for name in names))]
+
+
+# 进程池中每个进程加载一次的面板和前向填充后的价格
+_worker = {}
+
+
+def _init_worker(path, strategy):
+    panel = Panel.load(path, mmap=True)
+    _worker.update(panel=panel, strategy=strategy, prices=ffill(panel['price']))
+
+
+def _run_worker(params):
+    ret = backtest(_worker['panel'], params, _worker['strategy'], _worker['prices'])
+    # 净值曲线不传回主进程
+    ret.pop('nav')
+    return ret
+
+
+def sweep(panel, grid, strategy='double_low', processes=config.BACKTEST_PROCESSES, sort_by='sharpe'):
+    """
+    并行回测参数网格中的每组参数
+    :param processes: 进程数，0 为 CPU 核数，1 为在当前进程中计算
+    :param sort_by: 结果按该指标从大到小排序
+    :return: list of dict，不包含净值曲线
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        prices = ffill(panel['price'])
+        results = []
+        for params in grid:
+            ret = backtest(panel, params, strategy, prices)
+            ret.pop('nav')
+            results.append(ret)
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='backtest_')
+        try:
+            panel.save(tmp_dir)
+            with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(tmp_dir, strategy)) as executor:
+                chunksize = max(1, len(grid) // (processes * 4))
+                results = list(executor.map(_run_worker, grid, chunksize=chunksize))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return sorted(results, key=lambda ret: ret[sort_by], reverse=True)
+
+
+def format_result(ret):
+    return "%s total=%.2f%% annual=%.2f%% mdd=%.2f%% sharpe=%.2f turnover=%.2f" % (
+        ret['params'], ret['total_return'] * 100, ret['annual_return'] * 100, ret['max_drawdown'] * 100,
+        ret['sharpe'], ret['turnover'])
+
+
+CONVERT_BOND_GRID = param_grid(topk=[10, 20, 30, 50], max_price=[120, 130, 150, 200],
+                               premium_weight=[0.5, 1.0, 2.0], rebalance=[1, 5, 20])
+CLOSED_FUND_GRID = param_grid(topk=[5, 10, 20], discount_offset=[0, 1.5, 3], min_left_year=[0.05, 0.5],
+                              rebalance=[5, 20])
+
+
+if __name__ == '__main__':
+    from history import convert_bond_history, closed_fund_history
+
+    kind = sys.argv[1] if len(sys.argv) > 1 else 'convert_bonds'
+    if kind == 'closed_funds':
+        store, strategy, grid = closed_fund_history(), 'closed_fund', CLOSED_FUND_GRID
+    else:
+        store, strategy, grid = convert_bond_history(), 'double_low', CONVERT_BOND_GRID
+    panel = load_panel(store)
+    print("%s days x %s symbols, %s variants" % (panel.shape[0], panel.shape[1], len(grid)))
+    if panel.shape[0] < 2:
+        sys.exit("not enough history in %s" % store.path)
+    for ret in sweep(panel, grid, strategy)[:10]:
+        print(format_result(ret))
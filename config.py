@@ -6,6 +6,67 @@ headers = {'User-Agent': user_agent}
 ths_xiadan_path = r"C:\同花顺软件\同花顺\xiadan.exe"
 jisilu_cookie = "xxx"
 
+# 东方财富接口请求超时时间(秒)：(连接超时, 读取超时)
+EAST_REQUEST_TIMEOUT = (3, 5)
+# 东方财富接口并发请求的连接池大小
+EAST_POOL_SIZE = 4
+
+# HTTP 响应磁盘缓存，东方财富和集思录的请求共用
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_DIR = "../cache/http"
+HTTP_CACHE_MAX_BYTES = 50 * 1024 * 1024
+# {url 片段: 缓存秒数}，按顺序匹配，未匹配的 url 不缓存
+HTTP_CACHE_TTL = {
+    "reportName=RPT_BOND_CB_LIST": 600,
+    "reportName=RPTA_APP_IPOAPPLY": 600,
+    "jisilu.cn/webapi/cb/list_new": 60,
+    "jisilu.cn/data/cf/cf_list": 60,
+}
+# 集思录登录后返回的最少数据行数，少于该值视为未登录或数据不完整
+JISILU_MIN_ROWS = 50
+# {url 片段: 最少数据行数}，响应的 result.data/data/rows 少于该行数时不缓存(如东方财富 {"result": null}、集思录未登录)，
+# 未匹配的 url 至少要有 1 行
+HTTP_CACHE_MIN_ROWS = {
+    "jisilu.cn/webapi/cb/list_new": JISILU_MIN_ROWS,
+    "jisilu.cn/data/cf/cf_list": JISILU_MIN_ROWS,
+}
+# 需要登录的 url 片段，缓存 key 带上 cookie 的指纹，不同登录状态的响应互不复用
+HTTP_CACHE_AUTH_URLS = ["jisilu.cn"]
+# 计算缓存 key 时忽略的 url 片段(正则)，如集思录的毫秒时间戳
+HTTP_CACHE_IGNORE_PATTERNS = [r"___t=\d+"]
+# 离线回放：只读缓存，不访问网络
+HTTP_CACHE_OFFLINE = False
+
+# 集思录快照历史：是否记录每次拉取的可转债/封基数据(命中 HTTP 缓存的不重复记录)，存储目录
+HISTORY_ENABLED = True
+HISTORY_DIR = "../cache/history"
+# 封基轮动调仓：目标持有数量，持仓排名在该值以内时继续持有，单笔调整的最小金额，
+# 与目标市值偏差小于该比例时不调整，委托价格相对参考价的滑点，每手数量
+REBALANCE_TOPK = 10
+REBALANCE_KEEP_RANK = 15
+REBALANCE_MIN_TRADE_VALUE = 1000
+REBALANCE_DRIFT_TOLERANCE = 0.2
+REBALANCE_SLIPPAGE = 0.002
+REBALANCE_LOT = 100
+
+# 集思录盘中监控：交易时段，交易时段内的轮询间隔，开盘/收盘前后 WATCH_EDGE_MINUTES 分钟内
+# 或前 WATCH_TOPK 名/关注的转债 WATCH_EVENT_DAYS 天内强赎时的轮询间隔，非交易时段最长等待时间(秒)
+WATCH_SESSIONS = [("09:30", "11:30"), ("13:00", "15:00")]
+WATCH_TRADING_INTERVAL = 120
+WATCH_EVENT_INTERVAL = 60
+WATCH_IDLE_INTERVAL = 1800
+WATCH_EDGE_MINUTES = 10
+WATCH_EVENT_DAYS = 3
+# 监控的排名边界，溢价率低于/折价率高于阈值时通知
+WATCH_TOPK = 30
+WATCH_FUND_TOPK = 10
+WATCH_PREMIUM_THRESHOLD = 0
+WATCH_DISCOUNT_THRESHOLD = 5
+
+# 回测：单边交易费率，参数扫描的进程数(0 为 CPU 核数)
+BACKTEST_FEE = 0.0002
+BACKTEST_PROCESSES = 0
+
 # 请在理解pywin32操作窗口逻辑后，在下面自行适配你的同花顺交易客户端句柄ID
 DEFAULT_EXE_PATH: str = ""
 TITLE = "网上股票交易系统5.0"
@@ -39,12 +100,31 @@ BALANCE_CONTROL_ID_GROUP = {
 }
 
 POP_DIALOD_TITLE_CONTROL_ID = 1365
+# 弹窗监视线程的轮询间隔(秒)
+POP_DIALOG_WATCH_INTERVAL = 0.02
+# 提交委托后等待弹窗出现的超时时间，以及确认后等待后续弹窗的超时时间(秒)
+POP_DIALOG_TIMEOUT = 2
+POP_DIALOG_FOLLOWUP_TIMEOUT = 0.5
+# 一次委托最多处理的弹窗数量
+POP_DIALOG_MAX_COUNT = 3
+# 一次委托正常会弹出的窗口数量(委托确认 + 委托结果)，批量下单时处理完即开始下一笔
+TRADE_POP_DIALOG_COUNT = 2
+# 弹窗内容包含以下关键字时视为委托失败
+POP_DIALOG_ERROR_KEYWORDS = ["失败", "错误", "不足", "超过", "不能", "无效", "拒绝", "非交易时间"]
+
+# 等待客户端界面状态变化的默认超时时间和轮询间隔(秒)
+WAIT_TIMEOUT = 3
+WAIT_INTERVAL = 0.02
+WAIT_MAX_INTERVAL = 0.05
+# 可申购数量/可买数量所在的 Static 控件
+TRADE_AMOUNT_LIMIT_CONTROL_ID = 0x3FA
 
 GRID_DTYPE = {
     "操作日期": str,
     "委托编号": str,
     "申请编号": str,
     "合同编号": str,
+    "成交编号": str,
     "证券代码": str,
     "股东代码": str,
     "资金帐号": str,
@@ -52,6 +132,15 @@ GRID_DTYPE = {
     "发生日期": str,
 }
 
+# 表格数据获取方式: copy 复制到剪贴板(失败时退回 save), save 保存为文件
+GRID_STRATEGY = "copy"
+# 复制表格后等待剪贴板数据的超时时间(秒)
+GRID_COPY_TIMEOUT = 2
+# 增量读取当日委托/成交时行的唯一标识列，以及等待委托出现在当日委托中的轮询间隔(秒)
+TODAY_ENTRUSTS_KEY = "合同编号"
+TODAY_TRADES_KEY = "成交编号"
+GRID_POLL_INTERVAL = 0.5
+
 CANCEL_ENTRUST_ENTRUST_FIELD = "合同编号"
 CANCEL_ENTRUST_GRID_LEFT_MARGIN = 50
 CANCEL_ENTRUST_GRID_FIRST_ROW_HEIGHT = 30
@@ -63,4 +152,55 @@ AUTO_IPO_MENU_PATH = ["新股申购", "新股申购"]
 AUTO_IPO_NUMBER = '申购数量'
 
 # 账户数量
-ACCOUNT_COUNT = 3
\ No newline at end of file
+ACCOUNT_COUNT = 3
+# 定时申购时间(交易日 时:分)，以及提前多少分钟预热：连接客户端、检查控件、拉取当日新股新债、确认账户可切换
+AUTO_IPO_TIME = (9, 40)
+PREWARM_LEAD_MINUTES = 5
+# 申购时间后多少分钟关闭没有被申购任务使用的预热连接
+PREWARM_RELEASE_MINUTES = 30
+# 启动耗时预算(毫秒)：导入 main.py 的耗时上限，由 python benchmark.py startup 检查
+STARTUP_BUDGET_MS = 50
+
+# 本地验证码识别模型(数字模板)，不随代码发布，用 python -m utils.captcha <截图目录> 训练生成，
+# 文件不存在时本地识别不启用，退回 tesseract/远程识别
+CAPTCHA_MODEL_PATH = "../cache/captcha_digits.npz"
+# 客户端验证码位数
+CAPTCHA_LENGTH = 4
+
+# 验证码识别结果缓存：最多缓存的验证码数量，是否持久化客户端接受过的结果及文件路径
+CAPTCHA_CACHE_MAX_SIZE = 1000
+CAPTCHA_CACHE_PERSIST = True
+CAPTCHA_CACHE_PATH = "../cache/captcha_results.json"
+
+# 日志文件，按时间(LOG_ROTATE_WHEN，见 TimedRotatingFileHandler)和大小轮转，最多保留 LOG_BACKUP_COUNT 个备份
+LOG_FILE = "../logs/auto_make_money.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = "midnight"
+LOG_BACKUP_COUNT = 7
+# 日志文件格式: text 或 json(每行一条 JSON 日志)
+LOG_FORMAT = "text"
+# 后台写日志线程每批最多处理的日志条数，以及每批之间的间隔(秒)
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_INTERVAL = 0.05
+# 各子系统的日志级别，"" 为全局级别，如 {"": "INFO", "spider": "WARNING"}
+LOG_LEVELS = {
+    "": "DEBUG",
+}
+
+# 耗时统计：是否记录，推送消息中是否附带耗时摘要，报告中列出最慢的执行次数，历史记录文件(为空时不记录)，
+# 以及最多保留的最近执行次数(盘中监控等长时间运行不会 reset，超过后丢弃最早的记录)
+PERF_ENABLED = True
+PERF_PUSH_SUMMARY = True
+PERF_SLOWEST = 5
+PERF_HISTORY_PATH = "../logs/perf_history.jsonl"
+PERF_MAX_SPANS = 10000
+
+# Server酱 推送地址，%s 为 SCKey，以及推送请求超时时间(秒)：(连接超时, 读取超时)
+PUSH_URL = "http://sc.ftqq.com/%s.send"
+PUSH_TIMEOUT = (3, 10)
+# 推送发件箱：sqlite 文件，失败重试的初始间隔和最大间隔(秒)，最多发送次数，进程退出前等待发送的时间(秒)
+OUTBOX_PATH = "../cache/outbox.sqlite3"
+OUTBOX_RETRY_INTERVAL = 5
+OUTBOX_MAX_RETRY_INTERVAL = 600
+OUTBOX_MAX_ATTEMPTS = 20
+OUTBOX_FLUSH_TIMEOUT = 15
@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+"""
+交易客户端驱动
+THSTrader 通过驱动连接客户端、发送按键、操作剪贴板，
+默认使用 pywinauto 驱动 Windows 上的真实客户端，sim_xiadan 提供了进程内的模拟客户端
+"""
+
+from utils.log import get_logger
+
+logger = get_logger('trade')
+
+
+class PywinautoDriver(object):
+    """
+    基于 pywinauto 的 Windows 客户端驱动，pywinauto 在创建驱动时才导入
+    """
+
+    def __init__(self):
+        import pywinauto
+        import pywinauto.clipboard
+        import pywinauto.keyboard
+        from pywinauto import findwindows, timings
+
+        self._pywinauto = pywinauto
+        # 查找控件失败时 pywinauto 抛出的异常
+        self.control_errors = (findwindows.ElementNotFoundError, timings.TimeoutError, RuntimeError)
+
+    def connect(self, exe_path):
+        """
+        连接已启动的客户端，连接失败时启动客户端
+        :return: pywinauto Application
+        """
+        try:
+            return self._pywinauto.Application().connect(path=exe_path, timeout=3)
+        except Exception as e:
+            logger.warning("try connect exe_path: %s failed, err: %s, try start it" % (exe_path, e))
+            return self._pywinauto.Application().start(exe_path)
+
+    def send_keys(self, keys):
+        self._pywinauto.keyboard.send_keys(keys)
+
+    def set_foreground(self, window):
+        from pywinauto import win32defines
+        from pywinauto.win32functions import SetForegroundWindow, ShowWindow
+
+        if window.has_style(win32defines.WS_MINIMIZE):  # if minimized
+            ShowWindow(window.wrapper_object(), 9)  # restore window state
+        else:
+            SetForegroundWindow(window.wrapper_object())  # bring to front
+
+    def get_clipboard_text(self):
+        return self._pywinauto.clipboard.GetData()
+
+    def empty_clipboard(self):
+        self._pywinauto.clipboard.EmptyClipboard()
@@ -0,0 +1,229 @@
+# -*- encoding: utf-8 -*-
+"""
+集思录快照历史
+每次拉取的可转债/封基数据追加写入列式存储，每个字段一个定长二进制文件，读取时内存映射为 numpy 数组:
+- time.u4: 拉取时间(unix 秒)，symbol.u2: 代码在 symbols.json 中的序号，其余字段为 float32，无法转换的值记为 nan
+- days.bin: 每天第一行的行号，同一天的数据在文件中连续
+- 只追加不修改，进程中断导致各列长度不一致时，打开时截断到最短的列
+用法:
+    store = convert_bond_history()
+    store.append(rows)
+    store.load_symbol('113050')  # {'time': ..., 'dblow': ...}
+    store.load_day('2022-01-05')  # {'time': ..., 'symbol': ..., 'dblow': ...}
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+import config
+from screener import to_float_array
+
+TIME_DTYPE = np.dtype('<u4')
+SYMBOL_DTYPE = np.dtype('<u2')
+VALUE_DTYPE = np.dtype('<f4')
+# day: 日期 YYYYMMDD，start: 当天第一行的行号
+DAY_DTYPE = np.dtype([('day', '<u4'), ('start', '<u8')])
+
+
+def day_of(timestamp):
+    """
+    unix 时间戳对应的本地日期，如 20220105
+    """
+    t = time.localtime(timestamp)
+    return t.tm_year * 10000 + t.tm_mon * 100 + t.tm_mday
+
+
+def parse_day(day):
+    """
+    '2022-01-05' / '20220105' / 20220105 -> 20220105
+    """
+    return int(str(day).replace('-', ''))
+
+
+class HistoryStore(object):
+    """
+    只追加的列式快照历史
+    :param path: 存储目录
+    :param key: 代码字段，如 bond_id/fund_id
+    :param fields: 记录的数值字段
+    """
+
+    def __init__(self, path, key, fields):
+        self.path = path
+        self.key = key
+        self.fields = list(fields)
+        self._dtypes = dict({'time': TIME_DTYPE, 'symbol': SYMBOL_DTYPE}, **{f: VALUE_DTYPE for f in self.fields})
+        os.makedirs(path, exist_ok=True)
+        self.symbols = self._load_symbols()
+        self._symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.size = self._recover()
+        self._days = self._load_days()
+        self._maps = {}
+        self._mapped_size = 0
+
+    def _column_path(self, name):
+        return os.path.join(self.path, '%s.%s' % (name, self._dtypes[name].str[1:]))
+
+    def _load_symbols(self):
+        try:
+            with open(os.path.join(self.path, 'symbols.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _save_symbols(self):
+        path = os.path.join(self.path, 'symbols.json')
+        tmp_path = path + '.%s.tmp' % os.getpid()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.symbols, f)
+        os.replace(tmp_path, path)
+
+    def _recover(self):
+        """
+        各列截断到相同的行数
+        :return: 行数
+        """
+        sizes = {}
+        for name, dtype in self._dtypes.items():
+            path = self._column_path(name)
+            sizes[name] = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        size = min(sizes.values())
+        for name, n in sizes.items():
+            if n != size:
+                with open(self._column_path(name), 'ab') as f:
+                    f.truncate(size * self._dtypes[name].itemsize)
+        return size
+
+    def _load_days(self):
+        path = os.path.join(self.path, 'days.bin')
+        if not os.path.exists(path):
+            return np.empty(0, dtype=DAY_DTYPE)
+        days = np.fromfile(path, dtype=DAY_DTYPE)
+        # 丢弃指向未写入行的索引
+        return days[days['start'] < self.size]
+
+    def __len__(self):
+        return self.size
+
+    def _symbol_id(self, symbol):
+        sid = self._symbol_ids.get(symbol)
+        if sid is None:
+            sid = len(self.symbols)
+            if sid > np.iinfo(SYMBOL_DTYPE).max:
+                raise ValueError("too many symbols in %s" % self.path)
+            self.symbols.append(symbol)
+            self._symbol_ids[symbol] = sid
+        return sid
+
+    def append(self, rows, timestamp=None):
+        """
+        追加一次拉取的数据
+        :param rows: list of dict
+        :param timestamp: 拉取时间(unix 秒)，默认为当前时间
+        :return: 写入的行数
+        """
+        rows = [row for row in rows if row.get(self.key)]
+        if not rows:
+            return 0
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        symbol_count = len(self.symbols)
+        columns = {
+            'time': np.full(len(rows), timestamp, dtype=TIME_DTYPE),
+            'symbol': np.array([self._symbol_id(row[self.key]) for row in rows], dtype=SYMBOL_DTYPE),
+        }
+        for field in self.fields:
+            columns[field] = to_float_array([row.get(field) for row in rows]).astype(VALUE_DTYPE)
+
+        # 先保存新代码，再写数据列
+        if len(self.symbols) != symbol_count:
+            self._save_symbols()
+        day = day_of(timestamp)
+        if not len(self._days) or self._days['day'][-1] != day:
+            entry = np.array([(day, self.size)], dtype=DAY_DTYPE)
+            with open(os.path.join(self.path, 'days.bin'), 'ab') as f:
+                f.write(entry.tobytes())
+            self._days = np.concatenate([self._days, entry])
+        for name, values in columns.items():
+            with open(self._column_path(name), 'ab') as f:
+                f.write(values.tobytes())
+        self.size += len(rows)
+        return len(rows)
+
+    def columns(self):
+        """
+        全部数据的内存映射列，{字段: 只读数组}
+        """
+        if self._mapped_size != self.size:
+            self._maps = {}
+            if self.size:
+                self._maps = {name: np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(self.size,))
+                              for name, dtype in self._dtypes.items()}
+            self._mapped_size = self.size
+        if not self._maps:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in self._dtypes.items()}
+        return self._maps
+
+    def days(self):
+        """
+        有数据的日期，如 ['2022-01-04', '2022-01-05']
+        """
+        return ['%04d-%02d-%02d' % (d // 10000, d // 100 % 100, d % 100) for d in self._days['day'].tolist()]
+
+    def day_index(self):
+        """
+        :return: (日期列表, 行号边界)，第 i 天的数据为 [bounds[i], bounds[i + 1]) 行
+        """
+        bounds = np.append(self._days['start'].astype(np.int64), self.size)
+        return self.days(), bounds
+
+    def _day_range(self, start=None, end=None):
+        """
+        日期区间 [start, end] 对应的行号区间
+        """
+        days = self._days['day']
+        lo = 0 if start is None else int(np.searchsorted(days, parse_day(start), 'left'))
+        hi = len(days) if end is None else int(np.searchsorted(days, parse_day(end), 'right'))
+        if lo >= hi:
+            return 0, 0
+        stop = self._days['start'][hi] if hi < len(days) else self.size
+        return int(self._days['start'][lo]), int(stop)
+
+    def load_day(self, day):
+        """
+        某一天的全部数据
+        :return: {'time': 数组, 'symbol': 代码数组, 字段: 数组}
+        """
+        lo, hi = self._day_range(day, day)
+        ret = {name: np.array(column[lo:hi]) for name, column in self.columns().items()}
+        ret['symbol'] = np.array(self.symbols, dtype=object)[ret['symbol']] if self.symbols else ret['symbol']
+        return ret
+
+    def load_symbol(self, symbol, start=None, end=None):
+        """
+        某个代码在日期区间 [start, end] 内的全部数据，按时间排序
+        :return: {'time': 数组, 字段: 数组}，没有数据时为空数组
+        """
+        sid = self._symbol_ids.get(symbol)
+        lo, hi = self._day_range(start, end) if sid is not None else (0, 0)
+        columns = self.columns()
+        indices = np.flatnonzero(columns['symbol'][lo:hi] == sid) + lo
+        return {name: column[indices] for name, column in columns.items() if name != 'symbol'}
+
+
+# 可转债记录的字段
+CONVERT_BOND_HISTORY_FIELDS = ('price', 'dblow', 'premium_rt', 'convert_value')
+# 封基记录的字段
+CLOSED_FUND_HISTORY_FIELDS = ('price', 'discount_rt', 'left_year')
+
+
+def convert_bond_history(path=None):
+    return HistoryStore(path or os.path.join(config.HISTORY_DIR, 'convert_bonds'), 'bond_id',
+                        CONVERT_BOND_HISTORY_FIELDS)
+
+
+def closed_fund_history(path=None):
+    return HistoryStore(path or os.path.join(config.HISTORY_DIR, 'closed_funds'), 'fund_id',
+                        CLOSED_FUND_HISTORY_FIELDS)
@@ -3,12 +3,18 @@
 import time
 import requests
 import config
+from screener import (convert_bond_screener, closed_fund_screener, CONVERT_BOND_FILTERS,
+                      CONVERT_BOND_FACTORS, CLOSED_FUND_FACTORS, CLOSED_FUND_FIELDS)
+from snapshot import convert_bond_store, closed_fund_store
+from history import convert_bond_history, closed_fund_history
+from utils.http_cache import install_cache
+from utils.perf import timed
 
 class Jisilu(object):
 
     def __init__(self):
         self.max_line = 30
-        self.session = requests.session()
+        self.session = install_cache(requests.session())
         self.session.headers = {
             "Host": "www.jisilu.cn",
             "Init": "1",
@@ -16,6 +22,10 @@ class Jisilu(object):
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36"}
         self.cookies = config.jisilu_cookie
         self.set_cookies()
+        self.bond_snapshot = convert_bond_store()
+        self.fund_snapshot = closed_fund_store()
+        self.bond_history = convert_bond_history() if config.HISTORY_ENABLED else None
+        self.fund_history = closed_fund_history() if config.HISTORY_ENABLED else None
 
     def set_cookies(self):
         """
@@ -27,38 +37,51 @@ class Jisilu(object):
         for k, v in cookies.items():
             self.session.cookies.set(k, v)
 
-    def get_convert_bonds_data(self):
+    @staticmethod
+    def record_history(store, resp, rows):
         """
-        获取可转载数据
+        把拉取的数据追加到快照历史，命中 HTTP 缓存的响应不重复记录
+        """
+        if store is None or getattr(resp, 'from_cache', False):
+            return
+        try:
+            store.append(rows)
+        except (OSError, ValueError) as e:
+            print("记录快照历史失败: %s" % e)
+
+    @timed('jisilu.convert_bonds')
+    def fetch_convert_bonds(self):
+        """
+        拉取可转债列表原始数据
         :return:
         """
         url = "https://www.jisilu.cn/webapi/cb/list_new/"
-        datas = self.session.get(url).json()
-        datas = sorted(datas["data"], key=lambda x: x["dblow"])
-        if len(datas) < 50:
+        resp = self.session.get(url)
+        datas = resp.json()["data"]
+        if len(datas) < config.JISILU_MIN_ROWS:
             print("未登录")
+        else:
+            self.record_history(self.bond_history, resp, datas)
+        return datas
 
-        cnt = 0
-        res = []
-        for data in datas:
-            # 排除未上市
-            if data.get('price_tips') == '待上市':
-                continue
-
-            # 存在强赎日期
-            if data['redeem_dt']:
-                continue
-
-            # 转债价格>150,跳过
-            if data['price'] > 150:
-                continue
+    @timed('jisilu.screen_convert_bonds')
+    def get_convert_bonds_data(self):
+        """
+        获取可转载数据
+        :return:
+        """
+        datas = self.fetch_convert_bonds()
+        screener = convert_bond_screener(datas)
+        return screener.top(CONVERT_BOND_FILTERS, CONVERT_BOND_FACTORS, self.max_line)
 
-            cnt += 1
-            res.append(data)
-            if cnt >= self.max_line:
-                break
+    def convert_bond_repricer(self):
+        """
+        拉取一次可转债数据，之后用正股/转债行情在本地重算转股价值、溢价率、双低和排名
+        :return: repricer.Repricer
+        """
+        from repricer import Repricer
 
-        return res
+        return Repricer(self.fetch_convert_bonds())
 
     def print_convert_bonds_data(self):
         """
@@ -91,6 +114,7 @@ class Jisilu(object):
             print("强赎日期: %s" % bond['redeem_dt'])
 
 
+    @timed('jisilu.closed_funds')
     def get_closed_fund_data(self):
         """
         获取封基列表
@@ -98,15 +122,59 @@ class Jisilu(object):
         """
         timestrip = int(time.time() * 1000)
         url = "https://www.jisilu.cn/data/cf/cf_list/?___jsl=LST___t=%s" % timestrip
-        data = self.session.get(url)
+        resp = self.session.get(url)
 
-        data = data.json()
+        data = resp.json()
         ret = []
         for item in data['rows']:
             ret.append(item['cell'])
 
+        if len(ret) < config.JISILU_MIN_ROWS:
+            print("未登录")
+        else:
+            self.record_history(self.fund_history, resp, ret)
         return ret
 
+    @staticmethod
+    def check_complete(rows, name):
+        """
+        数据行数少于 config.JISILU_MIN_ROWS 时(未登录或数据不完整)抛出 ValueError，不用于更新快照
+        """
+        if len(rows) < config.JISILU_MIN_ROWS:
+            raise ValueError("%s 只返回 %s 行，少于 %s 行，可能未登录" % (name, len(rows), config.JISILU_MIN_ROWS))
+        return rows
+
+    def update_convert_bonds(self):
+        """
+        拉取可转债数据并与上一次的快照比对，排名视图见 self.bond_snapshot.ranked()
+        数据不完整时抛出 ValueError，快照保持不变
+        :return: SnapshotDelta
+        """
+        return self.bond_snapshot.update(self.check_complete(self.fetch_convert_bonds(), '可转债'))
+
+    def update_closed_funds(self):
+        """
+        拉取封基数据并与上一次的快照比对，排名视图见 self.fund_snapshot.ranked()
+        数据不完整时抛出 ValueError，快照保持不变
+        :return: SnapshotDelta
+        """
+        return self.fund_snapshot.update(self.check_complete(self.get_closed_fund_data(), '封基'))
+
+    def watch(self, callback=None, **kwargs):
+        """
+        盘中监控，阻塞运行，只在排名边界、阈值、强赎等变化时调用 callback(events)
+        :param kwargs: 见 watcher.JisiluWatcher
+        """
+        from watcher import JisiluWatcher
+
+        watcher = JisiluWatcher(self, **kwargs)
+        if callback is not None:
+            watcher.subscribe(callback)
+        try:
+            watcher.run()
+        finally:
+            print(watcher.format_stats())
+
     def format_closed_fund(self, item):
         """
         格式化输出封基信息
@@ -128,28 +196,10 @@ class Jisilu(object):
         :return:
         """
         data = self.get_closed_fund_data()
-        funds = []
-        for item in data:
-            try:
-                discount_rt = float(item['discount_rt'])
-                left_year = float(item['left_year'])
-                funds.append({
-                    'fund_id': item['fund_id'],
-                    'fund_nm': item['fund_nm'],
-                    'discount_rt': discount_rt,
-                    'left_year': left_year,
-                    'maturity_dt': item['maturity_dt'],
-                    'discount_factor': (discount_rt - 1.5) / left_year
-                })
-            except ValueError:
-                pass
-
-        funds.sort(key=lambda x: x['discount_factor'], reverse=True)
+        screener = closed_fund_screener(data)
+        indices = screener.select(factors=CLOSED_FUND_FACTORS, topk=topk)
+        funds = screener.records(indices, CLOSED_FUND_FIELDS)
         res = []
-
-        if topk > 0:
-            funds = funds[:topk]
-
         for item in funds:
             res.append(item)
             print(self.format_closed_fund(item))
@@ -158,5 +208,10 @@ class Jisilu(object):
 
 
 if __name__ == '__main__':
+    import sys
+
     jsl = Jisilu()
-    print(jsl.filter_closed_fund(10))
+    if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        jsl.watch(lambda events: print('\n'.join(event.message for event in events)))
+    else:
+        print(jsl.filter_closed_fund(10))
@@ -1,11 +1,19 @@
 # -*- encoding: utf-8 -*-
+"""
+定时申购新股新债
+启动时只导入标准库和配置，交易客户端、requests、apscheduler 在用到时才导入，
+推送消息经发件箱由后台线程发送，
+定时运行时提前 config.PREWARM_LEAD_MINUTES 分钟预热，申购时只做下单，
+用法: python main.py [test|cron|prewarm|watch]
+"""
 
+import os
 import sys
-import requests
+import atexit
 
-from apscheduler.schedulers.blocking import BlockingScheduler
+import config
+from utils import perf
 from utils.log import logger
-from ths_trader import THSTrader
 from config import ths_xiadan_path, SCKey
 
 
@@ -15,33 +23,171 @@ def is_test():
     return True
 
 
+_outbox = None
+
+
+def outbox():
+    """
+    Server酱 推送的发件箱，创建时开始发送上次运行遗留的消息，进程退出前最多等待 config.OUTBOX_FLUSH_TIMEOUT 秒
+    """
+    global _outbox
+    if _outbox is None:
+        from utils.outbox import Outbox, serverchan_sender
+
+        _outbox = Outbox(config.OUTBOX_PATH, serverchan_sender(config.PUSH_URL % SCKey))
+        atexit.register(_outbox.flush, config.OUTBOX_FLUSH_TIMEOUT)
+    return _outbox
+
+
+def push(title, message):
+    """
+    通过 Server酱 推送消息，消息写入发件箱后立即返回，由后台线程发送
+    """
+    outbox().put(title, message)
+    logger.info("push message queued: %s" % title)
+
+
+def perf_report():
+    """
+    记录本次运行的耗时报告并写入历史文件
+    :return: 附加到推送消息的耗时摘要，config.PERF_PUSH_SUMMARY 为 False 时为空
+    """
+    if not config.PERF_ENABLED:
+        return ''
+    report = perf.recorder.report()
+    logger.info(perf.format_report(report))
+    if config.PERF_HISTORY_PATH:
+        try:
+            perf.export_history(report, config.PERF_HISTORY_PATH, label='auto_ipo')
+        except OSError as e:
+            logger.warning("export perf history failed, err: %s" % e)
+    return perf.summary(report) if config.PERF_PUSH_SUMMARY else ''
+
+
+def check_captcha_model():
+    """
+    本地验证码识别模型不存在时在启动时提示，此时验证码退回 tesseract/远程识别
+    """
+    if not os.path.exists(config.CAPTCHA_MODEL_PATH):
+        logger.warning("captcha model %s not found, local captcha recognition is disabled; "
+                       "train it with: python -m utils.captcha <labelled captcha dir>" % config.CAPTCHA_MODEL_PATH)
+
+
+_trader = None
+
+
+def release_trader():
+    """
+    关闭预热后没有被申购任务使用的客户端连接，停止其弹窗监视线程
+    """
+    global _trader
+    if _trader is not None:
+        logger.info("close unused prewarmed trader")
+        _trader.close()
+        _trader = None
+
+
+def prewarm():
+    """
+    申购前预热：连接客户端，检查下单控件，拉取当日新股新债，确认所有账户都能切换到，
+    发现问题立即推送，不等到申购时才失败
+    :return: THSTrader.prewarm 返回的就绪状态
+    """
+    global _trader
+    release_trader()
+
+    perf.recorder.reset()
+    try:
+        from ths_trader import THSTrader
+
+        _trader = THSTrader(ths_xiadan_path)
+        status = _trader.prewarm()
+    except Exception as e:
+        logger.error("prewarm failed, err: %s" % e)
+        status = {'ok': False, 'problems': ["连接交易客户端失败: %s" % e]}
+
+    if not status['ok']:
+        message = '\n'.join(status['problems'])
+        if not is_test():
+            push('新股新债申购预热失败', message)
+        else:
+            logger.warning(message)
+    return status
+
+
 def buy_convert_bond():
     """
-    申购可转债
+    申购可转债，已预热时沿用预热的客户端连接和当日数据
     """
+    global _trader
     push_message = ''
+    perf.recorder.reset()
 
+    ths_trader, _trader = _trader, None
     try:
-        ths_trader = THSTrader(ths_xiadan_path)
+        if ths_trader is None:
+            from ths_trader import THSTrader
+
+            ths_trader = THSTrader(ths_xiadan_path)
         res = ths_trader.auto_ipo()
         push_message += str(res) + '\n'
     except Exception as e:
         logger.error("auto_ipo failed, err: %s" % e)
-        push_message += str(e)
+        push_message += str(e) + '\n'
     finally:
+        # 每次连接都会启动弹窗监视线程，申购结束后关闭，避免定时任务每天遗留一个
+        if ths_trader is not None:
+            ths_trader.close()
+        push_message += perf_report()
         if not is_test():
-            push_url = 'http://sc.ftqq.com/' + SCKey + '.send'
-            data = {'text': '今日新股新债申购通知', 'desp': push_message}
-            resp = requests.post(push_url, data=data).json()
-            logger.info("requests, resp: %s" % resp)
+            push('今日新股新债申购通知', push_message)
         else:
             logger.info(push_message)
 
 
+def cron():
+    """
+    每个交易日 config.AUTO_IPO_TIME 申购，提前 config.PREWARM_LEAD_MINUTES 分钟预热，
+    申购时间后 config.PREWARM_RELEASE_MINUTES 分钟关闭没有被使用的预热连接
+    """
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    outbox()  # 发送上次运行遗留的消息
+    check_captcha_model()
+    hour, minute = config.AUTO_IPO_TIME
+    scheduler = BlockingScheduler(timezone="Asia/Shanghai")
+    if config.PREWARM_LEAD_MINUTES > 0:
+        prewarm_at = hour * 60 + minute - config.PREWARM_LEAD_MINUTES
+        scheduler.add_job(prewarm, 'cron', day_of_week='0-4', hour=prewarm_at // 60, minute=prewarm_at % 60)
+        # 申购任务没有运行(如错过触发时间)时，关闭预热的客户端连接
+        release_at = hour * 60 + minute + config.PREWARM_RELEASE_MINUTES
+        scheduler.add_job(release_trader, 'cron', day_of_week='0-4', hour=release_at // 60, minute=release_at % 60)
+    scheduler.add_job(buy_convert_bond, 'cron', day_of_week='0-4', hour=hour, minute=minute)
+    scheduler.start()
+
+
+def watch():
+    """
+    集思录盘中监控，排名边界、阈值、强赎等变化时推送
+    """
+    from jisilu import Jisilu
+
+    outbox()
+
+    def notify(events):
+        push('集思录监控: %s条变化' % len(events), '\n\n'.join(event.message for event in events))
+
+    Jisilu().watch(notify)
+
+
 if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1] == 'cron':
-        scheduler = BlockingScheduler(timezone="Asia/Shanghai")
-        scheduler.add_job(buy_convert_bond, 'cron', day_of_week='0-4', hour=9, minute=40)
-        scheduler.start()
+        cron()
+    if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        watch()
+    if len(sys.argv) > 1 and sys.argv[1] == 'prewarm':
+        prewarm()
+        buy_convert_bond()
     if is_test():
+        check_captcha_model()
         buy_convert_bond()
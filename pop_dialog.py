@@ -0,0 +1,128 @@
+# -*- encoding: utf-8 -*-
+"""
+交易客户端弹窗监视
+后台线程持续跟踪客户端最前窗口的变化，读取弹窗标题和内容并分类，
+下单流程可以立即得知弹窗状态，不必固定等待
+"""
+
+import threading
+from collections import namedtuple
+
+import config
+from utils.log import get_logger
+
+logger = get_logger('dialog')
+
+# 弹窗类型
+DIALOG_CONFIRM = 'confirm'
+DIALOG_ERROR = 'error'
+DIALOG_CAPTCHA = 'captcha'
+
+DialogState = namedtuple('DialogState', ['kind', 'title', 'text', 'handle'])
+
+
+def classify_dialog(title, text):
+    """
+    根据弹窗标题和内容判断弹窗类型
+    """
+    content = "%s %s" % (title, text)
+    if '验证码' in content:
+        return DIALOG_CAPTCHA
+    for keyword in config.POP_DIALOG_ERROR_KEYWORDS:
+        if keyword in content:
+            return DIALOG_ERROR
+    return DIALOG_CONFIRM
+
+
+class PopDialogWatcher(threading.Thread):
+    """
+    弹窗监视线程
+    :param app: pywinauto Application
+    :param main: 主窗口
+    :param interval: 轮询最前窗口的间隔(秒)
+    """
+
+    def __init__(self, app, main, interval=config.POP_DIALOG_WATCH_INTERVAL):
+        super().__init__(name="PopDialogWatcher", daemon=True)
+        self._app = app
+        self._main = main
+        self._interval = interval
+        self._state = None
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+
+    @property
+    def state(self):
+        """
+        当前弹窗状态，没有弹窗时为 None
+        """
+        return self._state
+
+    def _read_dialog(self, top):
+        title = top.window_text()
+        try:
+            title = top.child_window(control_id=config.POP_DIALOD_TITLE_CONTROL_ID).window_text() or title
+        except Exception:
+            pass
+
+        texts = []
+        for child in top.children():
+            if child.class_name() == "Static" and child.control_id() != config.POP_DIALOD_TITLE_CONTROL_ID:
+                text = child.window_text()
+                if text:
+                    texts.append(text)
+        text = '\n'.join(texts)
+        return DialogState(classify_dialog(title, text), title, text, top.handle)
+
+    def poll(self):
+        """
+        检查一次最前窗口，返回当前弹窗状态
+        """
+        main_handle = self._main.wrapper_object().handle
+        top = self._app.top_window().wrapper_object()
+        if top.handle == main_handle:
+            return None
+        if self._state is not None and self._state.handle == top.handle:
+            return self._state
+        return self._read_dialog(top)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                state = self.poll()
+            except Exception as e:  # 窗口切换过程中可能短暂找不到窗口
+                logger.debug("poll pop dialog failed, err: %s" % e)
+                state = self._state
+
+            if state != self._state:
+                with self._cond:
+                    self._state = state
+                    self._cond.notify_all()
+                if state is not None:
+                    logger.info("pop dialog: %s, title: %s, text: %s" % (state.kind, state.title, state.text))
+            self._stopped.wait(self._interval)
+
+    def stop(self):
+        self._stopped.set()
+
+    def wait_dialog(self, timeout, exclude=None):
+        """
+        等待弹窗出现
+        :param exclude: 忽略该句柄的弹窗(已经处理过的弹窗)
+        :return: DialogState，超时返回 None
+        """
+        def ready():
+            return self._state is not None and self._state.handle != exclude
+
+        with self._cond:
+            if self._cond.wait_for(ready, timeout):
+                return self._state
+        return None
+
+    def wait_closed(self, handle, timeout):
+        """
+        等待指定弹窗关闭
+        :return: bool 是否已关闭
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._state is None or self._state.handle != handle, timeout)
@@ -0,0 +1,145 @@
+# -*- encoding: utf-8 -*-
+"""
+封基轮动调仓
+根据持仓对账结果和折价因子排名计算目标组合(前 topk 名等权)，只生成必要的委托:
+- 持仓排名仍在 keep_rank 以内的不卖出，空出的名额由排名最靠前的未持有封基补上
+- 与目标市值的偏差小于 min_trade_value 或目标市值的 drift_tolerance 时不调整
+- 同一代码的多条持仓合并后只生成一笔净买入或净卖出，数量按 lot 取整
+- 卖出数量不超过可用余额(T+1 下当日买入的不可卖)
+- 先卖后买，买入金额不超过 现金 + 卖出金额；提交时只计入委托成功的卖出，卖出失败时相应减少买入
+委托通过 sell_batch/buy_batch 各在一个下单界面批量提交
+"""
+
+from collections import namedtuple, OrderedDict
+
+import config
+from ths_trader import round_price_by_code
+from utils.log import get_logger
+
+logger = get_logger('trade')
+
+# side: buy/sell，price: 委托价格字符串，value: 按参考价计算的金额
+Order = namedtuple('Order', ['side', 'code', 'name', 'price', 'amount', 'value', 'reason'])
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _lots(amount, lot):
+    return int(amount // lot) * lot
+
+
+def plan_rebalance(table, topk=config.REBALANCE_TOPK, cash=0.0, keep_rank=config.REBALANCE_KEEP_RANK,
+                   min_trade_value=config.REBALANCE_MIN_TRADE_VALUE,
+                   drift_tolerance=config.REBALANCE_DRIFT_TOLERANCE, slippage=config.REBALANCE_SLIPPAGE,
+                   lot=config.REBALANCE_LOT):
+    """
+    计算调仓委托
+    :param table: reconcile.Reconciliation，只有在排名中的持仓参与调仓
+    :param topk: 目标持有数量
+    :param cash: 可用于买入的现金
+    :param keep_rank: 持仓排名小于该值时继续持有
+    :return: list of Order，卖出在前
+    """
+    # 合并同一代码的持仓
+    holdings = OrderedDict()
+    for row in table.matched():
+        holding = holdings.setdefault(row['code'], dict(row, amount=0.0, available=0.0, market_value=0.0))
+        holding['amount'] += row['amount']
+        holding['available'] += row.get('available', row['amount'])
+        holding['market_value'] += row['market_value']
+
+    keep = [code for code, row in holdings.items() if row['rank'] < max(keep_rank, topk)]
+    keep = sorted(keep, key=lambda code: holdings[code]['rank'])[:topk]
+    candidates = [record for record in table.index.records(table.index.top(topk + len(holdings)))
+                  if record['fund_id'] not in holdings]
+    targets = OrderedDict((code, holdings[code]) for code in keep)
+    for record in candidates[:topk - len(targets)]:
+        targets[record['fund_id']] = record
+
+    investable = cash + sum(row['market_value'] for row in holdings.values())
+    target_value = investable / topk if topk else 0.0
+
+    sells, buys = [], []
+    for code, row in holdings.items():
+        price = row['price']
+        if code not in targets:
+            amount = int(row['available'])
+            if amount < row['amount']:
+                logger.info("%s only %s of %s sellable today" % (code, amount, int(row['amount'])))
+            if amount:
+                sells.append(Order('sell', code, row['name'], price, amount, amount * price,
+                                   'rank %s' % row['rank']))
+            continue
+        excess = row['market_value'] - target_value
+        if excess > max(min_trade_value, target_value * drift_tolerance) and price > 0:
+            amount = min(_lots(excess / price, lot), _lots(row['available'], lot))
+            if amount:
+                sells.append(Order('sell', code, row['name'], price, amount, amount * price, 'overweight'))
+
+    available = cash + sum(order.value for order in sells)
+    for code, target in targets.items():
+        holding = holdings.get(code)
+        current = holding['market_value'] if holding else 0.0
+        price = holding['price'] if holding else _float(target.get('price'))
+        shortfall = min(target_value - current, available)
+        if price <= 0 or shortfall < max(min_trade_value, target_value * drift_tolerance):
+            continue
+        amount = _lots(shortfall / (price * (1 + slippage)), lot)
+        if not amount:
+            continue
+        name = holding['name'] if holding else target.get('fund_nm')
+        buys.append(Order('buy', code, name, price, amount, amount * price,
+                          'underweight' if holding else 'rank %s' % target['rank']))
+        available -= amount * price * (1 + slippage)
+
+    # 卖出价下调、买入价上调 slippage，提高成交概率
+    return [order._replace(price=round_price_by_code(order.price * (1 - slippage), order.code)) for order in sells] + \
+           [order._replace(price=round_price_by_code(order.price * (1 + slippage), order.code)) for order in buys]
+
+
+def _fit_buys(buys, budget, lot):
+    """
+    按委托价格依次保留买入委托，超出 budget 的部分按 lot 减少数量或放弃
+    """
+    ret = []
+    for order in buys:
+        price = float(order.price)
+        amount = order.amount if price * order.amount <= budget else _lots(budget / price, lot)
+        if amount < order.amount:
+            logger.warning("rebalance buy %s reduced from %s to %s, budget %.2f"
+                           % (order.code, order.amount, amount, budget))
+        if amount <= 0:
+            continue
+        ret.append(order._replace(amount=amount, value=order.value / order.amount * amount))
+        budget -= price * amount
+    return ret
+
+
+def execute_rebalance(trader, orders, cash=0.0, lot=config.REBALANCE_LOT):
+    """
+    先批量卖出，再批量买入；买入金额不超过 cash + 委托成功的卖出金额
+    :param trader: THSTrader
+    :param cash: 可用于买入的现金，与 plan_rebalance 的 cash 相同
+    :return: list 每笔委托的结果，见 THSTrader.trade_batch
+    """
+    sells = [order for order in orders if order.side == 'sell']
+    results = trader.sell_batch([(order.code, order.price, order.amount) for order in sells])
+    budget = cash + sum(float(order.price) * order.amount for order, result in zip(sells, results)
+                        if result['success'])
+    buys = _fit_buys([order for order in orders if order.side == 'buy'], budget, lot)
+    results += trader.buy_batch([(order.code, order.price, order.amount) for order in buys])
+    for result in results:
+        if not result['success']:
+            logger.warning("rebalance order %s failed: %s" % (result['code'], result['message']))
+    return results
+
+
+def format_orders(orders):
+    return '\n'.join("%s %s %s 价格: %s 数量: %s 金额: %.2f (%s)" % (
+        '买入' if order.side == 'buy' else '卖出', order.code, order.name, order.price, order.amount, order.value,
+        order.reason) for order in orders)
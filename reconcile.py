@@ -0,0 +1,174 @@
+# -*- encoding: utf-8 -*-
+"""
+持仓与排名对账
+集思录数据排序一次后建立 代码 -> 排名 的索引，持仓表按代码与索引做一次哈希连接，
+得到每个持仓的排名、市值、仓位和相对上一次的排名变化，
+前 k 名、持仓中掉出前 k 名、前 k 名中未持有等查询都在同一份结果上完成，不需要重新导出持仓或拉取数据
+"""
+
+from screener import closed_fund_screener, CLOSED_FUND_FACTORS, CLOSED_FUND_FIELDS
+
+# 持仓表格的列名
+POSITION_CODE = '证券代码'
+POSITION_NAME = '证券名称'
+POSITION_AMOUNT = '股份余额'
+# 可卖数量，T+1 下当日买入的不可卖
+POSITION_AVAILABLE = '可用余额'
+POSITION_PRICE = '参考市价'
+POSITION_VALUE = '参考市值'
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RankIndex(object):
+    """
+    排名索引
+    :param screener: Screener
+    :param indices: screener.select 返回的按得分排好序的行下标
+    :param key: 代码字段
+    :param fields: 连接到持仓上的字段
+    """
+
+    def __init__(self, screener, indices, key, fields):
+        self.screener = screener
+        self.key = key
+        self.fields = fields
+        codes = screener[key]
+        self.order = [codes[i] for i in indices.tolist()]
+        self.ranks = {code: rank for rank, code in enumerate(self.order)}
+        self._rows = dict(zip(self.order, indices.tolist()))
+
+    def __len__(self):
+        return len(self.order)
+
+    def rank(self, code):
+        """
+        排名(从0开始)，不在排名中返回 None
+        """
+        return self.ranks.get(code)
+
+    def top(self, k):
+        """
+        前 k 名的代码
+        """
+        return self.order[:k]
+
+    def records(self, codes):
+        """
+        按代码取数据行，带上 rank 字段
+        """
+        codes = [code for code in codes if code in self._rows]
+        records = self.screener.records([self._rows[code] for code in codes], self.fields)
+        for code, record in zip(codes, records):
+            record['rank'] = self.ranks[code]
+        return records
+
+
+def closed_fund_rank_index(rows):
+    """
+    封基按 (折价率 - 1.5) / 剩余年限 排名
+    """
+    screener = closed_fund_screener(rows)
+    indices = screener.select(factors=CLOSED_FUND_FACTORS)
+    return RankIndex(screener, indices, 'fund_id', CLOSED_FUND_FIELDS + ['price'])
+
+
+class Reconciliation(object):
+    """
+    一次对账的结果
+    rows: 每个持仓一行，包含 code/name/amount/available/price/market_value/weight/rank/prev_rank/rank_drift
+          以及排名数据的字段，不在排名中的持仓 rank 为 None
+    """
+
+    def __init__(self, index, rows, total_value):
+        self.index = index
+        self.rows = rows
+        self.total_value = total_value
+        self._by_code = {row['code']: row for row in rows}
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, code):
+        return self._by_code.get(code)
+
+    def matched(self):
+        """
+        在排名中的持仓，按排名排序
+        """
+        return sorted((row for row in self.rows if row['rank'] is not None), key=lambda row: row['rank'])
+
+    def outside_top(self, k):
+        """
+        不在前 k 名的持仓(包括不在排名中的)
+        """
+        return [row for row in self.rows if row['rank'] is None or row['rank'] >= k]
+
+    def missing_top(self, k):
+        """
+        前 k 名中未持有的
+        """
+        return self.index.records([code for code in self.index.top(k) if code not in self._by_code])
+
+    def weight_in_top(self, k):
+        """
+        前 k 名的持仓占总市值的比例
+        """
+        return sum(row['weight'] for row in self.rows if row['rank'] is not None and row['rank'] < k)
+
+
+class PositionReconciler(object):
+    """
+    持仓对账，保留上一次的排名用于计算排名变化
+    """
+
+    def __init__(self):
+        self.previous = None
+
+    def reconcile(self, index, positions):
+        """
+        :param index: RankIndex
+        :param positions: get_position() 返回的持仓表格数据
+        :return: Reconciliation
+        """
+        rows = []
+        total_value = 0.0
+        for position in positions:
+            code = str(position.get(POSITION_CODE, ''))
+            amount = _number(position.get(POSITION_AMOUNT))
+            available = position.get(POSITION_AVAILABLE)
+            available = amount if available is None else _number(available)
+            price = _number(position.get(POSITION_PRICE))
+            market_value = _number(position.get(POSITION_VALUE)) or amount * price
+            total_value += market_value
+            rank = index.rank(code)
+            prev_rank = self.previous.rank(code) if self.previous is not None else None
+            rows.append({
+                'code': code,
+                'name': position.get(POSITION_NAME),
+                'amount': amount,
+                'available': available,
+                'price': price,
+                'market_value': market_value,
+                'rank': rank,
+                'prev_rank': prev_rank,
+                # 正数表示排名上升
+                'rank_drift': prev_rank - rank if rank is not None and prev_rank is not None else None,
+            })
+
+        matched = {record[index.key]: record for record in index.records(row['code'] for row in rows)}
+        for row in rows:
+            row['weight'] = row['market_value'] / total_value if total_value else 0.0
+            for field, value in matched.get(row['code'], {}).items():
+                row.setdefault(field, value)
+
+        self.previous = index
+        return Reconciliation(index, rows, total_value)
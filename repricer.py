@@ -0,0 +1,152 @@
+# -*- encoding: utf-8 -*-
+"""
+可转债盘中本地重算
+转股价值、溢价率、双低都由 转债价格(price)、正股价格(sprice)、转股价(convert_price) 计算得到，
+拉取一次 list_new 后把全部转债保存为数组，之后收到一批正股/转债行情时一次向量运算重算全部转债并更新排名，
+不必为了新的溢价率和双低重新拉取集思录:
+    转股价值 = 正股价格 / 转股价 * 100
+    溢价率 = (转债价格 / 转股价值 - 1) * 100
+    双低 = 转债价格 + 溢价率
+"""
+
+import random
+
+import numpy as np
+
+from screener import convert_bond_screener, CONVERT_BOND_STATIC_FILTERS, CONVERT_BOND_MAX_PRICE
+
+
+def _lookup(index, prices):
+    """
+    {代码: 价格} -> (下标数组, 价格数组)，忽略未知代码
+    """
+    positions, values = [], []
+    for code, price in prices.items():
+        i = index.get(code)
+        if i is not None:
+            positions.append(i)
+            values.append(price)
+    return np.asarray(positions, dtype=np.intp), np.asarray(values, dtype=np.float64)
+
+
+class Repricer(object):
+    """
+    转债行情重算引擎
+    :param rows: 集思录 list_new 数据
+    :param max_price: 参与排名的转债价格上限
+    """
+
+    def __init__(self, rows, max_price=CONVERT_BOND_MAX_PRICE):
+        screener = convert_bond_screener(rows)
+        self.rows = rows
+        self.max_price = max_price
+        self.size = screener.size
+        self.price = screener['price'].copy()
+        self.sprice = screener['sprice'].copy()
+        self.convert_price = screener['convert_price'].copy()
+        self.convert_value = np.empty(self.size)
+        self.premium_rt = np.empty(self.size)
+        self.dblow = np.empty(self.size)
+        # 待上市、已公告强赎的转债不参与排名，与价格无关
+        self.static_mask = screener.mask(CONVERT_BOND_STATIC_FILTERS)
+        # ranks: 每个转债的排名(从0开始)，不参与排名为 -1；order: 按排名排列的下标，前 ranked 个有效
+        self.ranks = np.full(self.size, -1, dtype=np.intp)
+        self.order = np.arange(self.size)
+        self.ranked = 0
+        self._bond_index = {row['bond_id']: i for i, row in enumerate(rows)}
+        # 一只正股可能对应多只转债
+        self._stock_index = {}
+        for i, row in enumerate(rows):
+            self._stock_index.setdefault(row.get('stock_id'), []).append(i)
+        self._recompute()
+
+    def _recompute(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.multiply(np.divide(self.sprice, self.convert_price), 100, out=self.convert_value)
+            np.multiply(np.divide(self.price, self.convert_value) - 1, 100, out=self.premium_rt)
+        np.add(self.price, self.premium_rt, out=self.dblow)
+
+        score = np.where(self.static_mask & (self.price <= self.max_price) & np.isfinite(self.dblow),
+                         self.dblow, np.inf)
+        self.order[:] = np.argsort(score, kind='stable')
+        self.ranked = int(np.isfinite(score).sum())
+        self.ranks.fill(-1)
+        self.ranks[self.order[:self.ranked]] = np.arange(self.ranked)
+
+    def update(self, stock_prices=None, bond_prices=None):
+        """
+        收到一批行情后重算
+        :param stock_prices: {正股代码: 价格}
+        :param bond_prices: {转债代码: 价格}
+        :return: 排名发生变化的转债下标数组
+        """
+        if stock_prices:
+            stock_positions, values = [], []
+            for code, price in stock_prices.items():
+                for i in self._stock_index.get(code, ()):
+                    stock_positions.append(i)
+                    values.append(price)
+            self.sprice[np.asarray(stock_positions, dtype=np.intp)] = values
+        if bond_prices:
+            positions, values = _lookup(self._bond_index, bond_prices)
+            self.price[positions] = values
+
+        old_ranks = self.ranks.copy()
+        self._recompute()
+        return np.flatnonzero(old_ranks != self.ranks)
+
+    def record(self, i):
+        """
+        第 i 个转债的最新数据，字段与 list_new 相同
+        """
+        return dict(self.rows[i], price=float(self.price[i]), sprice=float(self.sprice[i]),
+                    convert_value=float(self.convert_value[i]), premium_rt=float(self.premium_rt[i]),
+                    dblow=float(self.dblow[i]))
+
+    def top(self, topk=0):
+        """
+        按双低从小到大的前 topk 个转债，0 表示全部参与排名的
+        """
+        count = self.ranked if topk <= 0 else min(topk, self.ranked)
+        return [self.record(i) for i in self.order[:count].tolist()]
+
+    def rank(self, bond_id):
+        """
+        排名(从0开始)，不参与排名返回 None
+        """
+        i = self._bond_index.get(bond_id)
+        if i is None or self.ranks[i] < 0:
+            return None
+        return int(self.ranks[i])
+
+
+class StubPriceFeed(object):
+    """
+    本地模拟行情，正股和转债价格随机游走，用于测试和演示
+    :param rows: 集思录 list_new 数据，作为初始价格
+    :param ratio: 每批行情中价格变化的比例
+    """
+
+    def __init__(self, rows, ratio=0.2, volatility=0.005, seed=0):
+        self.rnd = random.Random(seed)
+        self.ratio = ratio
+        self.volatility = volatility
+        self.stocks = {row['stock_id']: float(row['sprice']) for row in rows if row.get('stock_id')}
+        self.bonds = {row['bond_id']: float(row['price']) for row in rows}
+
+    def _tick(self, prices):
+        batch = {}
+        for code in self.rnd.sample(list(prices), int(len(prices) * self.ratio)):
+            prices[code] = round(prices[code] * (1 + self.rnd.gauss(0, self.volatility)), 3)
+            batch[code] = prices[code]
+        return batch
+
+    def next_batch(self):
+        """
+        :return: (正股行情 {代码: 价格}, 转债行情 {代码: 价格})
+        """
+        return self._tick(self.stocks), self._tick(self.bonds)
+
+    def __iter__(self):
+        while True:
+            yield self.next_batch()
@@ -0,0 +1,219 @@
+# -*- encoding: utf-8 -*-
+"""
+列式多因子筛选引擎
+把集思录的可转债/封基数据一次性转换为 numpy 列数组，
+之后的过滤条件和排序因子都以向量运算完成，top-k 使用 argpartition 部分选择，
+同一份数据可以反复执行不同参数的筛选
+"""
+
+import math
+import operator
+import numpy as np
+
+
+def _is_empty(values, _):
+    return (values == None) | (values == '')  # noqa: E711 逐元素比较
+
+
+def _is_in(values, choices):
+    return np.isin(values, list(choices))
+
+
+FILTER_OPS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    'in': _is_in,
+    # np.logical_not 对数组和单个值(score_row 逐行判断时为 bool)都正确，~True 为 -2
+    'not in': lambda values, choices: np.logical_not(_is_in(values, choices)),
+    'empty': _is_empty,
+    'not empty': lambda values, _: np.logical_not(_is_empty(values, _)),
+}
+
+
+def to_float_array(values):
+    """
+    转换为浮点数组，无法转换的值(None, '-', '' 等)记为 nan
+    """
+    ret = np.empty(len(values), dtype=np.float64)
+    for i, v in enumerate(values):
+        try:
+            ret[i] = float(v)
+        except (TypeError, ValueError):
+            ret[i] = np.nan
+    return ret
+
+
+def score_row(row, filters=(), factors=(), numeric=()):
+    """
+    单行数据的筛选和得分，判断与 Screener.select 一致，用于逐行增量更新的场景
+    过滤条件和排序因子只支持 (字段, ...) 形式，不支持函数
+    :return: 得分，越高越靠前；不满足过滤条件或得分无效时返回 None
+    """
+    def value(field):
+        v = row.get(field)
+        if field not in numeric:
+            return v
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return math.nan
+
+    for field, op, target in filters:
+        if not FILTER_OPS[op](value(field), target):
+            return None
+    score = sum(weight * value(field) for field, weight in factors)
+    return score if math.isfinite(score) else None
+
+
+class Screener(object):
+    """
+    筛选引擎
+    :param rows: 原始数据，list of dict
+    :param numeric: 需要按浮点数处理的字段
+    """
+
+    def __init__(self, rows, numeric=()):
+        self.rows = rows
+        self.size = len(rows)
+        self.numeric = set(numeric)
+        self._columns = {}
+        self._masks = {}
+
+    def __getitem__(self, field):
+        """
+        按需把字段转换为列数组，转换结果会被缓存
+        """
+        column = self._columns.get(field)
+        if column is None:
+            values = [row.get(field) for row in self.rows]
+            if field in self.numeric:
+                column = to_float_array(values)
+            else:
+                column = np.empty(self.size, dtype=object)
+                column[:] = values
+            self._columns[field] = column
+        return column
+
+    def derive(self, field, func):
+        """
+        增加衍生列
+        :param func: 接收 Screener 返回列数组的函数
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._columns[field] = np.asarray(func(self), dtype=np.float64)
+        self.numeric.add(field)
+        self._masks = {k: v for k, v in self._masks.items() if k[0] != field}
+        return self._columns[field]
+
+    def mask(self, filters=()):
+        """
+        计算满足全部过滤条件的掩码
+        :param filters: 过滤条件列表，每项为 (字段, 操作符, 值) 或接收 Screener 返回布尔数组的函数
+        """
+        ret = np.ones(self.size, dtype=bool)
+        for item in filters:
+            if callable(item):
+                ret &= np.asarray(item(self), dtype=bool)
+            else:
+                ret &= self._filter_mask(*item)
+        return ret
+
+    def _filter_mask(self, field, op, value):
+        """
+        单个 (字段, 操作符, 值) 条件的掩码，同一快照上的多次筛选共用
+        """
+        try:
+            key = (field, op, value)
+            mask = self._masks.get(key)
+        except TypeError:  # value 不可 hash，如 list
+            key, mask = None, None
+
+        if mask is None:
+            with np.errstate(invalid='ignore'):
+                mask = np.asarray(FILTER_OPS[op](self[field], value), dtype=bool)
+            if key is not None:
+                self._masks[key] = mask
+        return mask
+
+    def score(self, factors):
+        """
+        计算加权得分，得分越高越靠前
+        :param factors: 排序因子列表，每项为 (字段或函数, 权重)，权重为负表示越小越好
+        """
+        ret = np.zeros(self.size, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for factor, weight in factors:
+                values = factor(self) if callable(factor) else self[factor]
+                ret += weight * np.asarray(values, dtype=np.float64)
+        return ret
+
+    def select(self, filters=(), factors=(), topk=0):
+        """
+        筛选并排序
+        :param topk: 只取前 topk 个，0 表示全部
+        :return: 按得分从高到低排列的行下标数组，得分为 nan/inf 的行被排除
+        """
+        scores = self.score(factors)
+        candidates = np.flatnonzero(self.mask(filters) & np.isfinite(scores))
+        candidate_scores = -scores[candidates]
+
+        if 0 < topk < len(candidates):
+            part = np.argpartition(candidate_scores, topk - 1)[:topk]
+            candidates, candidate_scores = candidates[part], candidate_scores[part]
+
+        order = np.lexsort((candidates, candidate_scores))
+        return candidates[order]
+
+    def top(self, filters=(), factors=(), topk=0):
+        """
+        筛选并返回原始数据行
+        """
+        return [self.rows[i] for i in self.select(filters, factors, topk)]
+
+    def records(self, indices, fields):
+        """
+        按列数组组装数据行，数值字段为 float
+        """
+        columns = [(field, self[field], field in self.numeric) for field in fields]
+        ret = []
+        for i in indices:
+            ret.append({
+                field: float(column[i]) if is_numeric else column[i]
+                for field, column, is_numeric in columns
+            })
+        return ret
+
+
+# 可转债：排除待上市、已公告强赎、价格大于150的转债，按双低值从小到大排序
+CONVERT_BOND_NUMERIC = ('price', 'dblow', 'premium_rt', 'convert_value', 'sprice', 'convert_price')
+# 不随行情变化的条件
+CONVERT_BOND_STATIC_FILTERS = [
+    ('price_tips', '!=', '待上市'),
+    ('redeem_dt', 'empty', None),
+]
+CONVERT_BOND_MAX_PRICE = 150
+CONVERT_BOND_FILTERS = CONVERT_BOND_STATIC_FILTERS + [('price', '<=', CONVERT_BOND_MAX_PRICE)]
+CONVERT_BOND_FACTORS = [('dblow', -1)]
+
+# 封基：按 (折价率 - 1.5) / 剩余年限 从大到小排序
+CLOSED_FUND_NUMERIC = ('discount_rt', 'left_year')
+CLOSED_FUND_FIELDS = ['fund_id', 'fund_nm', 'discount_rt', 'left_year', 'maturity_dt', 'discount_factor']
+CLOSED_FUND_FACTORS = [('discount_factor', 1)]
+
+
+def discount_factor(screener):
+    return (screener['discount_rt'] - 1.5) / screener['left_year']
+
+
+def convert_bond_screener(rows):
+    return Screener(rows, CONVERT_BOND_NUMERIC)
+
+
+def closed_fund_screener(rows):
+    screener = Screener(rows, CLOSED_FUND_NUMERIC)
+    screener.derive('discount_factor', discount_factor)
+    return screener
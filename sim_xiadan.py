@@ -0,0 +1,390 @@
+# -*- encoding: utf-8 -*-
+"""
+进程内模拟的同花顺下单客户端(xiadan)
+按 config.py 中的控件ID模拟主窗口、左侧菜单、下单输入框、弹窗、表格和多账户切换，
+各步骤的响应延迟可配置，用于在非 Windows 环境下运行和测量 THSTrader 的完整流程
+用法:
+    sim = SimXiadan(accounts=['账户1', '账户2'])
+    trader = THSTrader('xiadan.exe', driver=SimDriver(sim))
+"""
+
+import re
+import time
+import itertools
+import threading
+from collections import namedtuple
+
+import config
+
+# 各步骤的响应延迟(秒)
+# lookup: 输入证券代码后刷新可买数量; dialog: 弹窗出现; account_switch: 切换账户; copy: 表格复制到剪贴板;
+# connect: 连接客户端
+SimLatency = namedtuple('SimLatency', ['lookup', 'dialog', 'account_switch', 'copy', 'connect'],
+                        defaults=[0.05, 0.05, 0.2, 0.05, 0])
+
+ENTRUST_COLUMNS = ['委托时间', '证券代码', '证券名称', '操作', '委托数量', '委托价格', '成交数量', '合同编号', '备注']
+TRADE_COLUMNS = ['成交时间', '证券代码', '证券名称', '操作', '成交数量', '成交价格', '成交金额', '合同编号', '成交编号']
+POSITION_COLUMNS = ['证券代码', '证券名称', '股份余额', '可用余额', '参考成本价', '参考市价', '参考市值']
+
+
+class _Delayed(object):
+    """
+    经过一段延迟后才生效的值
+    """
+
+    def __init__(self, value=''):
+        self._value = value
+        self._pending = None
+
+    def get(self):
+        if self._pending is not None and time.perf_counter() >= self._pending[0]:
+            self._value = self._pending[1]
+            self._pending = None
+        return self._value
+
+    def set(self, value, delay=0):
+        if delay <= 0:
+            self._value, self._pending = value, None
+        else:
+            self._pending = (time.perf_counter() + delay, value)
+
+
+class SimMissing(object):
+    """
+    未找到的窗口，exists() 返回 False，其他操作抛出 LookupError
+    """
+
+    def __init__(self, criteria):
+        self._criteria = criteria
+
+    def exists(self, timeout=None):
+        return False
+
+    def __getattr__(self, name):
+        raise LookupError("window not found: %s" % self._criteria)
+
+
+class SimWindow(object):
+    """
+    模拟窗口/控件，同时提供 pywinauto WindowSpecification 和 wrapper 中 THSTrader 用到的接口
+    """
+
+    def __init__(self, sim, class_name, control_id=0, text='', children=()):
+        self.sim = sim
+        self.handle = next(sim.handles)
+        self._class_name = class_name
+        self._control_id = control_id
+        self._text = _Delayed(text)
+        self._children = list(children)
+        self.closed = False
+
+    def __repr__(self):
+        return "<SimWindow %s %s %r>" % (self._class_name, self._control_id, self.window_text())
+
+    def wrapper_object(self):
+        return self
+
+    def window_text(self):
+        return self._text.get()
+
+    def set_text(self, text, delay=0):
+        self._text.set(text, delay)
+
+    def class_name(self):
+        return self._class_name
+
+    def control_id(self):
+        return self._control_id
+
+    def children(self):
+        return list(self._children)
+
+    def descendants(self):
+        for child in self._children:
+            yield child
+            yield from child.descendants()
+
+    def _match(self, class_name=None, control_id=None, title=None, title_re=None, **kwargs):
+        if class_name is not None and self._class_name != class_name:
+            return False
+        if control_id is not None and self._control_id != control_id:
+            return False
+        if title is not None and self.window_text() != title:
+            return False
+        if title_re is not None and not re.match(title_re, self.window_text()):
+            return False
+        return True
+
+    def child_window(self, **criteria):
+        for child in self.descendants():
+            if child._match(**criteria):
+                return child
+        return SimMissing(criteria)
+
+    window = child_window
+
+    def __getattr__(self, name):
+        # pywinauto 的属性访问方式，如 Edit1、Button2
+        match = re.match(r'([A-Za-z]+)(\d+)$', name)
+        if match:
+            found = [c for c in self.descendants() if c._class_name == match.group(1)]
+            index = int(match.group(2)) - 1
+            if index < len(found):
+                return found[index]
+        raise AttributeError(name)
+
+    def exists(self, timeout=None):
+        return not self.closed
+
+    def wait(self, *args, **kwargs):
+        return self
+
+    def is_enabled(self):
+        return True
+
+    def is_active(self):
+        return self.sim.top_window() is self
+
+    def has_style(self, style):
+        return False
+
+    def set_focus(self):
+        return self
+
+    def select(self, *args):
+        return self
+
+    def click(self):
+        self.sim.on_click(self)
+
+    def type_keys(self, keys, **kwargs):
+        self.sim.on_type(self, keys)
+
+    def set_edit_text(self, text):
+        self.set_text(text)
+
+    def close(self):
+        self.sim.close_window(self)
+
+    def get_item(self, path):
+        sim = self.sim
+
+        class Item(object):
+            def click(self):
+                sim.menu_path = tuple(path)
+
+        return Item()
+
+
+class SimApp(object):
+    """
+    模拟 pywinauto Application
+    """
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def top_window(self):
+        return self.sim.top_window()
+
+    def windows(self, class_name=None, visible_only=True):
+        return [w for w in self.sim.visible_windows() if class_name is None or w.class_name() == class_name]
+
+    def window(self, **criteria):
+        for w in self.sim.visible_windows():
+            if w._match(**criteria):
+                return w
+        return SimMissing(criteria)
+
+
+class SimXiadan(object):
+    """
+    模拟客户端
+    :param accounts: 账户名列表，alt+N 切换到第 N 个账户
+    :param latency: SimLatency
+    :param amount_limits: {证券代码: 可申购数量}，未配置的代码为 10000
+    :param positions: 持仓表格数据，list of dict
+    :param prompt_windows: 启动时弹出的提示窗口数量
+    """
+
+    def __init__(self, accounts=('模拟账户',), latency=None, amount_limits=None, positions=None, prompt_windows=1):
+        self.handles = itertools.count(1)
+        self.latency = latency or SimLatency()
+        self.accounts = list(accounts)
+        self.amount_limits = amount_limits or {}
+        self.positions = positions or []
+        self.orders = []
+        self.menu_path = ()
+        self.clipboard = _Delayed('')
+        self.app = SimApp(self)
+        self._lock = threading.RLock()
+        self._contract_no = itertools.count(1001)
+        self._current_order = None
+        self._pending_order = None
+        self._dialogs = []
+
+        self.account_combo = SimWindow(self, 'ComboBox', 0x912, self.accounts[0])
+        self.toolbar = SimWindow(self, 'ToolbarWindow32', children=[self.account_combo])
+        self.edits = {control_id: SimWindow(self, 'Edit', control_id) for control_id in (
+            config.TRADE_SECURITY_CONTROL_ID, config.TRADE_PRICE_CONTROL_ID, config.TRADE_AMOUNT_CONTROL_ID)}
+        self.amount_limit = SimWindow(self, 'Static', config.TRADE_AMOUNT_LIMIT_CONTROL_ID)
+        self.submit = SimWindow(self, 'Button', config.TRADE_SUBMIT_CONTROL_ID, '买入')
+        self.refill = SimWindow(self, 'Button', config.TRADE_REFILL_CONTRON_ID, '重填')
+        self.grid = SimWindow(self, 'CVirtualGridCtrl', config.COMMON_GRID_CONTROL_ID)
+        self.main = SimWindow(self, '#32770', text=config.TITLE, children=[
+            self.toolbar, SimWindow(self, 'SysTreeView32', 0x81), self.amount_limit, self.submit, self.refill,
+            self.grid,
+        ] + list(self.edits.values()))
+        self._windows = [self.main] + [SimWindow(self, '#32770', text='公告%s' % i) for i in range(prompt_windows)]
+
+    @property
+    def account(self):
+        return self.account_combo.window_text()
+
+    def visible_windows(self):
+        now = time.perf_counter()
+        with self._lock:
+            dialogs = [w for appear_at, w in self._dialogs if appear_at <= now]
+            return [w for w in self._windows if not w.closed] + dialogs
+
+    def top_window(self):
+        return self.visible_windows()[-1]
+
+    def close_window(self, window):
+        with self._lock:
+            window.closed = True
+            self._dialogs = [(t, w) for t, w in self._dialogs if w is not window]
+
+    def _pop_dialog(self, title, text, kind):
+        dialog = SimWindow(self, '#32770', text=title, children=[
+            SimWindow(self, 'Static', config.POP_DIALOD_TITLE_CONTROL_ID, title),
+            SimWindow(self, 'Static', 1004, text),
+        ])
+        dialog.kind = kind
+        with self._lock:
+            self._dialogs.append((time.perf_counter() + self.latency.dialog, dialog))
+
+    def on_type(self, window, keys):
+        if window is self.grid:
+            if keys.upper() == '^A^C':
+                self.clipboard.set(self._grid_text(), self.latency.copy)
+            return
+
+        window.set_text(keys)
+        if window is self.edits[config.TRADE_SECURITY_CONTROL_ID] and keys:
+            if self._current_order is None:
+                self._current_order = {'started': time.perf_counter()}
+            # 查询证券期间可买数量为空
+            self.amount_limit.set_text('')
+            self.amount_limit.set_text(str(self.amount_limits.get(keys, 10000)), self.latency.lookup)
+
+    def on_click(self, window):
+        if window is self.refill:
+            for edit in self.edits.values():
+                edit.set_text('')
+            self._current_order = None
+        elif window is self.submit:
+            order = self._current_order or {'started': time.perf_counter()}
+            self._current_order = None
+            order.update({
+                'account': self.account,
+                'code': self.edits[config.TRADE_SECURITY_CONTROL_ID].window_text(),
+                'price': self.edits[config.TRADE_PRICE_CONTROL_ID].window_text(),
+                'amount': self.edits[config.TRADE_AMOUNT_CONTROL_ID].window_text(),
+                'side': '卖出' if any('卖出' in item for item in self.menu_path) else '买入',
+                'submitted': time.perf_counter(),
+            })
+            self.orders.append(order)
+            self._pending_order = order
+            self._pop_dialog('委托确认', '证券代码: %(code)s\n委托价格: %(price)s\n委托数量: %(amount)s\n是否确认?' % order,
+                             'confirm')
+
+    def on_keys(self, keys):
+        match = re.match(r'%(\d)$', keys)
+        if match:
+            index = int(match.group(1)) - 1
+            if index < len(self.accounts):
+                self.account_combo.set_text(self.accounts[index], self.latency.account_switch)
+            return
+
+        if keys != '{ENTER}':
+            return
+        top = self.top_window()
+        if top is self.main or top in self._windows:
+            return
+        self.close_window(top)
+
+        order = self._pending_order
+        if top.kind == 'confirm':
+            try:
+                valid = float(order['price']) > 0 and int(order['amount']) > 0
+            except ValueError:
+                valid = False
+            if valid:
+                order['contract_no'] = str(next(self._contract_no))
+                self._pop_dialog('提示', '您的%s委托已成功提交，合同编号：%s' % (order['side'], order['contract_no']), 'result')
+            else:
+                order['contract_no'] = None
+                self._pop_dialog('提示', '委托失败：价格或数量无效', 'result')
+        else:
+            order['completed'] = time.perf_counter()
+            for edit in self.edits.values():
+                edit.set_text('')
+
+    def fill(self, contract_no):
+        """
+        委托全部成交，之后出现在当日成交中
+        """
+        for order in self.orders:
+            if order.get('contract_no') == contract_no:
+                order['filled'] = order['amount']
+
+    def _grid_text(self):
+        menu = list(self.menu_path)
+        if menu == config.TODAY_ENTRUSTS_MENU_PATH:
+            columns = ENTRUST_COLUMNS
+            rows = [{'委托时间': '09:40:00', '证券代码': o['code'], '证券名称': o['code'], '操作': o['side'],
+                     '委托数量': o['amount'], '委托价格': o['price'], '成交数量': o.get('filled', 0),
+                     '合同编号': o['contract_no'], '备注': '已成' if o.get('filled') else '已报'}
+                    for o in self.orders if o.get('contract_no') and o['account'] == self.account]
+        elif menu == config.TODAY_TRADES_MENU_PATH:
+            columns = TRADE_COLUMNS
+            rows = [{'成交时间': '09:40:01', '证券代码': o['code'], '证券名称': o['code'], '操作': o['side'],
+                     '成交数量': o['filled'], '成交价格': o['price'],
+                     '成交金额': round(float(o['price']) * int(o['filled']), 2), '合同编号': o['contract_no'],
+                     '成交编号': 'T%s' % o['contract_no']}
+                    for o in self.orders if o.get('filled') and o['account'] == self.account]
+        else:
+            columns, rows = POSITION_COLUMNS, self.positions
+
+        lines = ['\t'.join(columns)]
+        for row in rows:
+            lines.append('\t'.join(str(row.get(c, '')) for c in columns))
+        return '\r\n'.join(lines) + '\r\n'
+
+
+class SimDriver(object):
+    """
+    模拟客户端的驱动
+    """
+
+    control_errors = (LookupError,)
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def connect(self, exe_path):
+        time.sleep(self.sim.latency.connect)
+        return self.sim.app
+
+    def send_keys(self, keys):
+        self.sim.on_keys(keys)
+
+    def set_foreground(self, window):
+        pass
+
+    def get_clipboard_text(self):
+        return self.sim.clipboard.get()
+
+    def empty_clipboard(self):
+        self.sim.clipboard.set('')
@@ -0,0 +1,140 @@
+# -*- encoding: utf-8 -*-
+"""
+集思录数据快照的增量比对
+按主键保存上一次拉取的数据，每次拉取只计算新增、删除和字段变化的行，
+排名视图保存在有序容器中，只对变化的行做删除和重新插入
+"""
+
+import math
+from sortedcontainers import SortedList
+
+from screener import score_row, CONVERT_BOND_FILTERS, CONVERT_BOND_FACTORS, CONVERT_BOND_NUMERIC
+
+
+class SnapshotDelta(object):
+    """
+    两次快照之间的差异
+    added/removed: {主键: 行}
+    changed: {主键: {字段: (旧值, 新值)}}
+    """
+
+    def __init__(self):
+        self.added = {}
+        self.removed = {}
+        self.changed = {}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return "SnapshotDelta(added=%s, removed=%s, changed=%s)" % (
+            list(self.added), list(self.removed), list(self.changed))
+
+
+class SnapshotStore(object):
+    """
+    快照存储
+    :param key: 主键字段，如 bond_id/fund_id
+    :param score: 排名得分函数 row -> float，越小越靠前，返回 None 的行不参与排名
+    :param fields: 参与比对的字段，None 表示全部字段
+    """
+
+    def __init__(self, key, score, fields=None):
+        self.key = key
+        self.score = score
+        self.fields = fields
+        self.rows = {}
+        self._scores = {}
+        self._ranked = SortedList()
+
+    def _diff(self, old, new):
+        fields = self.fields or (old.keys() | new.keys())
+        return {f: (old.get(f), new.get(f)) for f in fields if old.get(f) != new.get(f)}
+
+    def _rank_insert(self, key, row):
+        score = self.score(row)
+        if score is not None:
+            self._scores[key] = score
+            self._ranked.add((score, key))
+
+    def _rank_discard(self, key):
+        score = self._scores.pop(key, None)
+        if score is not None:
+            self._ranked.discard((score, key))
+
+    def update(self, rows):
+        """
+        用新拉取的数据更新快照
+        :return: SnapshotDelta
+        """
+        delta = SnapshotDelta()
+        new_rows = {row[self.key]: row for row in rows}
+
+        for key in self.rows.keys() - new_rows.keys():
+            delta.removed[key] = self.rows[key]
+            self._rank_discard(key)
+
+        for key, row in new_rows.items():
+            old = self.rows.get(key)
+            if old is None:
+                delta.added[key] = row
+                self._rank_insert(key, row)
+                continue
+
+            # 先整行比较(C 实现)，只有不相等时才逐字段比对
+            if old == row:
+                continue
+            diff = self._diff(old, row)
+            if diff:
+                delta.changed[key] = diff
+                self._rank_discard(key)
+                self._rank_insert(key, row)
+
+        self.rows = new_rows
+        return delta
+
+    def ranked(self, topk=0):
+        """
+        排名视图
+        :param topk: 只取前 topk 个，0 表示全部
+        """
+        items = self._ranked.islice(0, topk) if topk > 0 else self._ranked
+        return [self.rows[key] for _, key in items]
+
+    def rank(self, key):
+        """
+        获取指定主键的排名(从0开始)，不参与排名时返回 None
+        """
+        score = self._scores.get(key)
+        if score is None:
+            return None
+        return self._ranked.index((score, key))
+
+
+def convert_bond_score(row):
+    """
+    可转债按双低值排名，过滤条件与 screener.CONVERT_BOND_FILTERS 相同
+    """
+    score = score_row(row, CONVERT_BOND_FILTERS, CONVERT_BOND_FACTORS, CONVERT_BOND_NUMERIC)
+    return None if score is None else -score
+
+
+def closed_fund_score(row):
+    """
+    封基按 (折价率 - 1.5) / 剩余年限 从大到小排名
+    """
+    try:
+        factor = (float(row['discount_rt']) - 1.5) / float(row['left_year'])
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    if not math.isfinite(factor):
+        return None
+    return -factor
+
+
+def convert_bond_store():
+    return SnapshotStore('bond_id', convert_bond_score)
+
+
+def closed_fund_store():
+    return SnapshotStore('fund_id', closed_fund_score)
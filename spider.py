@@ -6,48 +6,112 @@
 
 import requests
 import time
-from config import headers
-from utils.log import logger
+from concurrent.futures import ThreadPoolExecutor
+
+from config import headers, EAST_REQUEST_TIMEOUT, EAST_POOL_SIZE
+from utils.http_cache import install_cache
+from utils.log import get_logger
+from utils.perf import timed
+
+logger = get_logger('spider')
 
 
 class EastSpider():
-    def __init__(self):
+    def __init__(self, url='https://datacenter-web.eastmoney.com/api/data/v1/get',
+                 timeout=EAST_REQUEST_TIMEOUT, pool_size=EAST_POOL_SIZE):
         super(EastSpider, self).__init__()
-        self.url = 'https://datacenter-web.eastmoney.com/api/data/v1/get'
+        self.url = url
+        self.timeout = timeout
+        self.pool_size = pool_size
 
-    def get_bond_list(self):
+        # 所有报表请求共用一个 keep-alive 连接池，避免每次请求重新建立 TCP/TLS 连接
+        self.session = requests.session()
+        self.session.headers.update(headers)
+        install_cache(self.session, pool_connections=1, pool_maxsize=pool_size)
+
+    @timed('spider.request')
+    def _get_result(self, params):
+        """
+        请求单个报表分页
+        :param params: 报表请求参数
+        :return: dict 报表结果，包含 data 和 pages，超出页数时接口返回 None
         """
-        从东方财富获取可转债数据
+        ret_dict = self.session.get(self.url, params=params, timeout=self.timeout).json()
+        return ret_dict['result']
+
+    def iter_report(self, params, date_column, date):
+        """
+        逐页流式读取按 date_column 倒序排列的报表
+        读到 date_column 早于 date 的行即停止，不会下载整个报表
+        :param params: 报表请求参数，pageNumber 由本函数控制
+        :param date_column: 报表排序所用的日期字段
+        :param date: %Y-%m-%d 格式的日期
+        """
+        page = 1
+        while True:
+            result = self._get_result(dict(params, pageNumber=str(page)))
+            if not result:
+                return
+
+            for row in result['data'] or []:
+                # 日期为空的行(如尚未确定日期)不参与判断，继续往后读
+                row_date = (row.get(date_column) or '')[:10]
+                if row_date and row_date < date:
+                    return
+                yield row
+
+            if page >= result.get('pages', page):
+                return
+            page += 1
+
+    def iter_bond_list(self, date, page_size=10):
+        """
+        流式读取发行日期不早于 date 的可转债
+        :param date: %Y-%m-%d 格式的日期
         """
         params = {
             'sortColumns': 'PUBLIC_START_DATE',
             'sortTypes': '-1',
-            'pageSize': '10',
-            'pageNumber': '1',
+            'pageSize': str(page_size),
             'reportName': 'RPT_BOND_CB_LIST',
             'columns': 'ALL',
             'source': 'WEB',
             'client': 'WEB'
         }
-        ret_dict = requests.get(self.url, params=params, headers=headers).json()
-        data = ret_dict['result']['data']
-        return data
+        return self.iter_report(params, 'PUBLIC_START_DATE', date)
+
+    def iter_stock_list(self, date, page_size=50):
+        """
+        流式读取申购日期不早于 date 的新股
+        :param date: %Y-%m-%d 格式的日期
+        """
+        params = {
+            'sortColumns': 'APPLY_DATE',
+            'sortTypes': '-1',
+            'pageSize': str(page_size),
+            'reportName': 'RPTA_APP_IPOAPPLY',
+            'columns': 'ALL',
+            'source': 'WEB',
+            'client': 'WEB'
+        }
+        return self.iter_report(params, 'APPLY_DATE', date)
 
-    def get_date_bond_list(self, date):
+    @timed('spider.bond_list')
+    def get_date_bond_list(self, date, raise_errors=False):
         """
         获取指定日期的可转债id列表
         :param date: %Y-%m-%d 格式的日期
+        :param raise_errors: 请求失败时抛出异常，默认保留已读取到的数据
         """
+        ret = []
         try:
-            data = self.get_bond_list()
-        except Exception as e:  # API偶尔解析错误，直接返回空list
+            for stock in self.iter_bond_list(date):
+                if (stock.get('VALUE_DATE') or '')[:10] == date:
+                    ret.append(stock['CORRECODE'])
+        except Exception as e:  # API偶尔解析错误，保留已读取到的数据
             logger.info("get bond list failed, err: %s" % e)
-            data = []
-
-        ret = []
-        for stock in data:
-            if stock['VALUE_DATE'].split()[0] == date:
-                ret.append(stock['CORRECODE'])
+            if raise_errors:
+                raise
 
         logger.info("today is: %s, bond_list: %s" % (date, ret))
         return ret
@@ -59,37 +123,21 @@ class EastSpider():
         today_str = time.strftime("%Y-%m-%d", time.localtime())
         return self.get_date_bond_list(today_str)
 
-    def get_stock_list(self):
-        """
-        获取按申购日期排序的前50股票
-        """
-        params = {
-            'sortColumns': 'APPLY_DATE',
-            'sortTypes': '-1',
-            'pageSize': '50',
-            'pageNumber': '1',
-            'reportName': 'RPTA_APP_IPOAPPLY',
-            'columns': 'ALL',
-            'source': 'WEB',
-            'client': 'WEB'
-        }
-        ret_dict = requests.get(self.url, params=params, headers=headers).json()
-        return ret_dict['result']['data']
-
-    def get_date_stock_list(self, date):
+    @timed('spider.stock_list')
+    def get_date_stock_list(self, date, raise_errors=False):
         """
         获取指定日期的股票列表
+        :param raise_errors: 请求失败时抛出异常，默认保留已读取到的数据
         """
+        ret = []
         try:
-            data = self.get_stock_list()
+            for stock in self.iter_stock_list(date):
+                if (stock.get('APPLY_DATE') or '')[:10] == date:
+                    ret.append({"id": stock['APPLY_CODE'],"name": stock['SECURITY_NAME'], 'price': stock['ISSUE_PRICE']})
         except Exception as e:
             logger.info("get stock list failed, err: %s" % e)
-            data = []
-
-        ret = []
-        for stock in data:
-            if stock['APPLY_DATE'].split()[0] == date:
-                ret.append({"id": stock['APPLY_CODE'],"name": stock['SECURITY_NAME'], 'price': stock['ISSUE_PRICE']})
+            if raise_errors:
+                raise
 
         logger.info("today is: %s, stock_list: %s" % (date, ret))
         return ret
@@ -101,6 +149,28 @@ class EastSpider():
         today_str = time.strftime("%Y-%m-%d", time.localtime())
         return self.get_date_stock_list(today_str)
 
+    @timed('spider.get_date_data')
+    def get_date_data(self, date, raise_errors=False):
+        """
+        并发获取指定日期的新股和可转债列表
+        :param date: %Y-%m-%d 格式的日期
+        :param raise_errors: 任一列表请求失败时抛出异常
+        :return: (stock_list, bond_list)
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            stock_future = executor.submit(self.get_date_stock_list, date, raise_errors)
+            bond_future = executor.submit(self.get_date_bond_list, date, raise_errors)
+            return stock_future.result(), bond_future.result()
+
+    def get_today_data(self, raise_errors=False):
+        """
+        并发获取当日的新股和可转债列表，两个报表的请求只需约一次往返时间
+        :param raise_errors: 任一列表请求失败时抛出异常
+        :return: (stock_list, bond_list)
+        """
+        today_str = time.strftime("%Y-%m-%d", time.localtime())
+        return self.get_date_data(today_str, raise_errors)
+
 
 if __name__ == '__main__':
     spider = EastSpider()
@@ -0,0 +1,82 @@
+# -*- encoding: utf-8 -*-
+import time
+
+import numpy as np
+import pytest
+
+from backtest import Panel, backtest, ffill, load_panel, param_grid, sweep
+from history import HistoryStore
+
+# 3 天 x 3 只转债: A 每天涨 10%，B 不动，C 价格高于默认 max_price
+PRICES = [
+    [100, 105, 200],
+    [110, 105, 200],
+    [121, 105, 200],
+]
+
+
+def panel(prices=PRICES):
+    prices = np.array(prices, dtype=np.float32)
+    days, size = prices.shape
+    return Panel(['2022-01-0%s' % (d + 3) for d in range(days)], ['A', 'B', 'C'][:size],
+                 {'price': prices, 'premium_rt': np.zeros_like(prices)})
+
+
+def test_buy_and_hold():
+    ret = backtest(panel(), {'topk': 1, 'rebalance': 20, 'fee': 0})
+    np.testing.assert_allclose(ret['nav'], [1.1, 1.21], rtol=1e-6)
+    assert ret['total_return'] == pytest.approx(0.21, rel=1e-6)
+    assert ret['max_drawdown'] == 0
+    assert ret['turnover'] == 1
+
+
+def test_daily_rebalance_with_fee():
+    # 第 0 天买 A，第 1 天 A 涨到 110 后换成 B，第 2 天继续持有 B
+    ret = backtest(panel(), {'topk': 1, 'rebalance': 1, 'fee': 0.001})
+    np.testing.assert_allclose(ret['nav'], [1.098, 1.098 * 0.998], rtol=1e-6)
+    assert ret['turnover'] == pytest.approx(2 / 3)
+
+
+def test_excluded_and_missing_prices_are_not_bought():
+    prices = [[np.nan, 105, 200], [110, 105, 200], [121, 105, 200]]
+    ret = backtest(panel(prices), {'topk': 2, 'rebalance': 20, 'fee': 0})
+    # 只能买入 B，A 第 0 天没有价格，C 超过 max_price
+    np.testing.assert_allclose(ret['nav'], [1, 1])
+
+
+def test_topk_must_be_positive():
+    with pytest.raises(ValueError):
+        backtest(panel(), {'topk': 0})
+
+
+@pytest.mark.parametrize('prices', [np.zeros((0, 3)), np.zeros((3, 0)), np.zeros((1, 3))])
+def test_nothing_to_pick(prices):
+    ret = backtest(panel(prices), {'topk': 1})
+    assert ret['total_return'] == 0 and ret['sharpe'] == 0 and len(ret['nav']) == 0
+
+
+def test_ffill():
+    values = np.array([[np.nan, 1], [2, np.nan], [np.nan, np.nan]], dtype=np.float32)
+    np.testing.assert_array_equal(ffill(values), [[np.nan, 1], [2, 1], [2, 1]])
+
+
+def test_sweep_sorted_and_parallel_matches_serial():
+    grid = param_grid(topk=[1, 2], rebalance=[1, 20], fee=[0])
+    serial = sweep(panel(), grid, processes=1, sort_by='total_return')
+    parallel = sweep(panel(), grid, processes=2, sort_by='total_return')
+    assert [ret['total_return'] for ret in serial] == sorted((ret['total_return'] for ret in serial), reverse=True)
+    assert [ret['params'] for ret in serial] == [ret['params'] for ret in parallel]
+    assert all('nav' not in ret for ret in serial)
+
+
+def test_load_panel_takes_last_snapshot_of_day(tmp_path):
+    store = HistoryStore(str(tmp_path), 'bond_id', ['price', 'premium_rt'])
+    day = time.mktime((2022, 1, 5, 10, 0, 0, 0, 0, -1))
+    store.append([{'bond_id': 'A', 'price': 100, 'premium_rt': 1}], day)
+    store.append([{'bond_id': 'A', 'price': 101, 'premium_rt': 2}, {'bond_id': 'B', 'price': 90}], day + 60)
+    store.append([{'bond_id': 'B', 'price': 91, 'premium_rt': 3}], day + 86400)
+
+    result = load_panel(store)
+    assert result.symbols == ['A', 'B']
+    np.testing.assert_array_equal(result['price'], [[101, 90], [np.nan, 91]])
+    np.testing.assert_array_equal(result['premium_rt'], [[2, np.nan], [np.nan, 3]])
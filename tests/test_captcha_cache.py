@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+import io
+
+import numpy as np
+from PIL import Image
+
+from utils.captcha_cache import CaptchaCache
+
+
+def captcha(seed=0):
+    rnd = np.random.RandomState(seed)
+    return Image.fromarray(rnd.randint(0, 256, (20, 60, 3)).astype(np.uint8), 'RGB')
+
+
+def encoded(image, fmt):
+    buf = io.BytesIO()
+    image.save(buf, fmt)
+    return buf.getvalue()
+
+
+def test_key_depends_on_pixels_not_encoding():
+    image = captcha()
+    key = CaptchaCache.key(image)
+    assert CaptchaCache.key(encoded(image, 'PNG')) == key
+    assert CaptchaCache.key(encoded(image, 'BMP')) == key
+    assert CaptchaCache.key(image.convert('L')) == key
+    assert CaptchaCache.key(captcha(1)) != key
+    assert CaptchaCache.key(image, namespace='broker') != key
+
+
+def test_recognize_caches_only_successful_reads():
+    cache = CaptchaCache()
+    calls = []
+
+    def recognize(image):
+        calls.append(image)
+        return '1234' if len(calls) > 1 else None
+
+    image = captcha()
+    assert cache.recognize(image, recognize)[1] is None
+    key, code = cache.recognize(image, recognize)
+    assert code == '1234'
+    assert cache.recognize(image, recognize) == (key, '1234')
+    assert len(calls) == 2
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 2, 'rejected': 0, 'hit_rate': 1 / 3}
+
+
+def test_lru_eviction():
+    cache = CaptchaCache(max_size=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.get('a')
+    cache.set('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1' and cache.get('c') == '3'
+
+
+def test_reject_removes_entry():
+    cache = CaptchaCache()
+    cache.set('a', '1')
+    cache.reject('a')
+    cache.reject('a')
+    assert cache.get('a') is None
+    assert cache.stats()['rejected'] == 1
+
+
+def test_only_accepted_codes_persist(tmp_path):
+    path = str(tmp_path / 'captcha_cache.json')
+    cache = CaptchaCache(path=path)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.set('c', '3')
+    cache.accept('a')
+    cache.accept('c')
+    cache.accept('missing')
+
+    loaded = CaptchaCache(path=path)
+    assert len(loaded) == 2 and loaded.get('a') == '1' and loaded.get('b') is None
+
+    # 拒绝已持久化的结果后同步删除
+    loaded.reject('a')
+    assert CaptchaCache(path=path).get('a') is None
+    assert CaptchaCache(path=path).get('c') == '3'
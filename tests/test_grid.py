@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+from utils.grid import convert_value, parse_grid_text, GridTracker
+
+HEADER = '合同编号\t证券代码\t委托数量\t备注'
+
+
+def grid(*rows):
+    return '\n'.join([HEADER] + ['\t'.join(row) for row in rows]) + '\n'
+
+
+def test_convert_value():
+    assert convert_value('12') == 12
+    assert convert_value('-1.5') == -1.5
+    assert convert_value('1e3') == 1000.0
+    assert convert_value('12a') == '12a'
+    assert convert_value('') == ''
+
+
+def test_parse_grid_text_types_and_padding():
+    text = '证券代码\t\t参考市价\n000001\t\t1.5\n000002\n'
+    rows = parse_grid_text(text, {'证券代码': str})
+    assert rows == [
+        {'证券代码': '000001', 'Unnamed: 1': '', '参考市价': 1.5},
+        {'证券代码': '000002', 'Unnamed: 1': '', '参考市价': ''},
+    ]
+
+
+def test_parse_grid_text_default_dtype_keeps_ids_as_strings():
+    rows = parse_grid_text('合同编号\t成交编号\t证券代码\n0012\t0034\t000001\n')
+    assert rows == [{'合同编号': '0012', '成交编号': '0034', '证券代码': '000001'}]
+
+
+def test_tracker_added_and_changed():
+    tracker = GridTracker('合同编号', {'合同编号': str, '证券代码': str})
+    changes = tracker.update(grid(('001', '000001', '100', '已报')))
+    assert [row['合同编号'] for row in changes.added] == ['001']
+    assert changes.reset
+
+    changes = tracker.update(grid(('001', '000001', '100', '已成'), ('002', '000002', '200', '已报')))
+    assert not changes.reset
+    assert [row['合同编号'] for row in changes.added] == ['002']
+    assert [row['备注'] for row in changes.changed] == ['已成']
+    assert changes.removed == []
+    assert set(tracker.rows) == {'001', '002'}
+
+    changes = tracker.update(grid(('001', '000001', '100', '已成'), ('002', '000002', '200', '已报')))
+    assert changes == ([], [], False, [])
+
+
+def test_tracker_drops_replaced_rows_with_same_count():
+    tracker = GridTracker('合同编号', {'合同编号': str})
+    tracker.update(grid(('001', '000001', '100', '已报'), ('002', '000002', '200', '已报')))
+    # 002 被清除，同时出现 003，行数不变
+    changes = tracker.update(grid(('001', '000001', '100', '已报'), ('003', '000003', '300', '已报')))
+    assert [row['合同编号'] for row in changes.added] == ['003']
+    assert [row['合同编号'] for row in changes.removed] == ['002']
+    assert set(tracker.rows) == {'001', '003'}
+
+
+def test_tracker_replaces_all_rows_after_account_switch():
+    tracker = GridTracker('合同编号', {'合同编号': str})
+    tracker.update(grid(('001', '000001', '100', '已报')))
+    changes = tracker.update(grid(('101', '000009', '500', '已报')))
+    assert not changes.reset
+    assert [row['合同编号'] for row in changes.added] == ['101']
+    assert [row['合同编号'] for row in changes.removed] == ['001']
+    assert set(tracker.rows) == {'101'}
+
+
+def test_tracker_resets_on_header_change_and_empty_text():
+    tracker = GridTracker('合同编号')
+    tracker.update(grid(('001', '000001', '100', '已报')))
+    changes = tracker.update('合同编号\t证券代码\n001\t000001\n')
+    assert changes.reset and len(changes.added) == 1
+    changes = tracker.update('')
+    assert changes.reset and len(changes.removed) == 1
+    assert tracker.rows == {}
+
+
+def test_tracker_without_key_uses_lines():
+    tracker = GridTracker()
+    tracker.update(grid(('001', '000001', '100', '已报')))
+    changes = tracker.update(grid(('001', '000001', '100', '已报'), ('002', '000002', '200', '已报')))
+    assert len(changes.added) == 1 and len(tracker.rows) == 2
@@ -0,0 +1,112 @@
+# -*- encoding: utf-8 -*-
+import json
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.http_cache import HttpCache, CacheAdapter, payload_rows
+
+
+def make_cache(tmp_path, **kwargs):
+    kwargs.setdefault('ttls', {'jisilu': 60, 'eastmoney': 60})
+    return HttpCache(str(tmp_path), 1 << 20, **kwargs)
+
+
+@pytest.mark.parametrize('body, rows', [
+    ('{"result": {"data": [1, 2], "pages": 1}}', 2),
+    ('{"result": null}', 0),
+    ('{"result": {"data": null}}', 0),
+    ('{"rows": [1, 2, 3]}', 3),
+    ('{"data": []}', 0),
+    ('{}', 0),
+    ('{"code": 200}', None),
+    ('[1, 2]', None),
+    ('<html>', None),
+])
+def test_payload_rows(body, rows):
+    assert payload_rows(body) == rows
+
+
+def test_cacheable_min_rows(tmp_path):
+    cache = make_cache(tmp_path, min_rows={'jisilu': 3})
+    assert cache.cacheable('https://www.jisilu.cn/x', '{"rows": [1, 2, 3]}')
+    assert not cache.cacheable('https://www.jisilu.cn/x', '{"rows": [1, 2]}')
+    # 未配置的 url 至少要有 1 行，无法识别的响应照常缓存
+    assert cache.cacheable('https://eastmoney.com/x', '{"result": {"data": [1]}}')
+    assert not cache.cacheable('https://eastmoney.com/x', '{"result": null}')
+    assert cache.cacheable('https://eastmoney.com/x', '<html>')
+
+
+def test_key_uses_cookie_only_for_auth_urls(tmp_path):
+    cache = make_cache(tmp_path, auth_urls=['jisilu'])
+    auth_url, public_url = 'https://www.jisilu.cn/data', 'https://eastmoney.com/data'
+    assert cache.key('GET', auth_url, 'a=1') != cache.key('GET', auth_url, 'a=2')
+    assert cache.key('GET', auth_url, 'a=1') != cache.key('GET', auth_url)
+    assert cache.key('GET', public_url, 'a=1') == cache.key('GET', public_url, 'a=2') == cache.key('GET', public_url)
+
+
+def test_key_ignores_patterns(tmp_path):
+    cache = make_cache(tmp_path, ignore_patterns=[r'[?&]___jsl=[^&]*'])
+    assert cache.key('GET', 'https://www.jisilu.cn/data?___jsl=LST___t=1') == \
+        cache.key('GET', 'https://www.jisilu.cn/data?___jsl=LST___t=2')
+    assert cache.key('GET', 'https://www.jisilu.cn/data?p=1') != cache.key('GET', 'https://www.jisilu.cn/data?p=2')
+
+
+def test_ttl_takes_first_match(tmp_path):
+    cache = make_cache(tmp_path, ttls={'jisilu.cn/data/cbnew': 10, 'jisilu': 60})
+    assert cache.ttl('https://www.jisilu.cn/data/cbnew/x') == 10
+    assert cache.ttl('https://www.jisilu.cn/data/other') == 60
+    assert cache.ttl('https://example.com') is None
+
+
+class FakeTransport(object):
+    """
+    替换 HTTPAdapter.send，按顺序返回给定的响应体并记录请求次数
+    """
+
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.calls = 0
+
+    def __call__(self, request, **kwargs):
+        self.calls += 1
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = self.bodies.pop(0).encode('utf-8')
+        resp.headers['Content-Type'] = 'application/json'
+        resp.url = request.url
+        resp.request = request
+        return resp
+
+
+def session_with(cache, transport, monkeypatch):
+    monkeypatch.setattr(HTTPAdapter, 'send', lambda adapter, request, **kwargs: transport(request, **kwargs))
+    session = requests.Session()
+    session.mount('https://', CacheAdapter(cache))
+    return session
+
+
+def test_adapter_caches_only_complete_responses(tmp_path, monkeypatch):
+    empty, full = json.dumps({'rows': []}), json.dumps({'rows': [{'id': 1}]})
+    transport = FakeTransport(empty, full, full)
+    session = session_with(make_cache(tmp_path), transport, monkeypatch)
+    url = 'https://www.jisilu.cn/data'
+
+    assert session.get(url).json() == {'rows': []}
+    assert session.get(url).from_cache is False
+    resp = session.get(url)
+    assert resp.from_cache is True and resp.json() == {'rows': [{'id': 1}]}
+    assert transport.calls == 2
+
+
+def test_offline_reads_cache_and_fails_on_miss(tmp_path, monkeypatch):
+    transport = FakeTransport(json.dumps({'rows': [1]}))
+    session = session_with(make_cache(tmp_path), transport, monkeypatch)
+    session.get('https://www.jisilu.cn/a')
+
+    offline = session_with(make_cache(tmp_path, offline=True), transport, monkeypatch)
+    assert offline.get('https://www.jisilu.cn/a').json() == {'rows': [1]}
+    with pytest.raises(requests.exceptions.ConnectionError):
+        offline.get('https://www.jisilu.cn/b')
+    assert transport.calls == 1
@@ -0,0 +1,25 @@
+# -*- encoding: utf-8 -*-
+import io
+import time
+import queue
+import logging
+
+from utils.log import BatchQueueListener, BatchStreamHandler
+
+
+class ClosedStream(io.StringIO):
+    def flush(self):
+        raise ValueError("I/O operation on closed file.")
+
+
+def test_writer_survives_flush_errors():
+    out = io.StringIO()
+    log_queue = queue.Queue()
+    listener = BatchQueueListener(log_queue, BatchStreamHandler(ClosedStream()), BatchStreamHandler(out),
+                                  flush_interval=0.01)
+    listener.start()
+    for i in range(3):
+        log_queue.put(logging.LogRecord('test', logging.INFO, __file__, 1, 'message %s', (i,), None))
+        time.sleep(0.05)
+    listener.stop()
+    assert out.getvalue().splitlines() == ['message 0', 'message 1', 'message 2']
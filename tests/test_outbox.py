@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+from utils.outbox import Outbox
+
+
+class Sender(object):
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    def __call__(self, title, body):
+        if self.fail:
+            raise IOError("push failed")
+        self.sent.append((title, body))
+
+
+@pytest.fixture
+def manual_outbox(tmp_path, monkeypatch):
+    """
+    不启动发送线程，由测试调用 _due/_deliver
+    """
+    monkeypatch.setattr(Outbox, '_run', lambda self: None)
+
+    def make(send, **kwargs):
+        return Outbox(str(tmp_path / 'outbox.db'), send, **kwargs)
+
+    return make
+
+
+def rows_of(outbox):
+    with outbox._lock:
+        return outbox._conn.execute("SELECT id, title, body, attempts, next_try FROM messages ORDER BY id").fetchall()
+
+
+def attempts(outbox):
+    return {row[1]: row[3] for row in rows_of(outbox)}
+
+
+def test_coalesce():
+    assert Outbox.coalesce([(1, 'a', 'x', 0, 0)]) == ('a', 'x')
+    title, body = Outbox.coalesce([(1, 'a', 'x', 0, 0), (2, 'b', 'y', 0, 0)])
+    assert title == 'a 等2条通知'
+    assert body == '### a\n\nx\n\n---\n\n### b\n\ny'
+
+
+def test_deliver_coalesces_pending_messages(manual_outbox):
+    send = Sender()
+    outbox = manual_outbox(send)
+    outbox.put('a', 'x')
+    outbox.put('b', 'y')
+    rows, _ = outbox._due()
+    outbox._deliver(rows)
+    assert [title for title, _ in send.sent] == ['a 等2条通知']
+    assert outbox.pending() == 0 and outbox.pushes == 1
+
+
+def test_failed_messages_back_off_and_drop_by_their_own_attempts(manual_outbox):
+    send = Sender(fail=True)
+    outbox = manual_outbox(send, retry_interval=10, max_retry_interval=15, max_attempts=3)
+    outbox.put('old', 'x')
+    rows, _ = outbox._due()
+    outbox._deliver(rows)
+    # 等待重试期间没有到发送时间的消息
+    rows, next_try = outbox._due()
+    assert rows == [] and next_try is not None
+
+    # 新消息到了发送时间，等待重试的旧消息一起发送，但各自累计发送次数
+    outbox.put('new', 'y')
+    rows, _ = outbox._due()
+    assert [row[1] for row in rows] == ['old', 'new']
+    outbox._deliver(rows)
+    assert attempts(outbox) == {'old': 2, 'new': 1}
+    # 第 2 次失败等待 min(10 * 2, 15) 秒，第 1 次失败等待 10 秒
+    next_tries = {row[1]: row[4] for row in rows_of(outbox)}
+    assert next_tries['old'] - next_tries['new'] == pytest.approx(5)
+
+    outbox._deliver(rows_of(outbox))
+    assert attempts(outbox) == {'new': 2}
+
+
+def test_messages_survive_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(Outbox, '_run', lambda self: None)
+    path = str(tmp_path / 'outbox.db')
+    Outbox(path, Sender()).put('a', 'x')
+    assert Outbox(path, Sender()).pending() == 1
+
+
+def test_sender_survives_database_errors(tmp_path, monkeypatch):
+    due = Outbox._due
+    failures = []
+
+    def flaky_due(self):
+        if not failures:
+            failures.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        return due(self)
+
+    monkeypatch.setattr(Outbox, '_due', flaky_due)
+    send = Sender()
+    outbox = Outbox(str(tmp_path / 'outbox.db'), send, retry_interval=0.01)
+    try:
+        outbox.put('a', 'x')
+        assert outbox.flush(5)
+        assert failures and send.sent == [('a', 'x')]
+    finally:
+        outbox.close()
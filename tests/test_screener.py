@@ -0,0 +1,75 @@
+# -*- encoding: utf-8 -*-
+import random
+
+import pytest
+
+from screener import (Screener, FILTER_OPS, score_row, convert_bond_screener, CONVERT_BOND_FILTERS,
+                      CONVERT_BOND_FACTORS, CONVERT_BOND_NUMERIC)
+
+
+def make_rows(count=200, seed=0):
+    rnd = random.Random(seed)
+    return [{
+        'id': i,
+        'price': rnd.choice([rnd.uniform(90, 200), rnd.uniform(90, 200), '-', None, '']),
+        'dblow': rnd.uniform(100, 250),
+        'tips': rnd.choice(['待上市', 'x', '', None]),
+    } for i in range(count)]
+
+
+# 每个操作符的测试条件
+OP_CASES = {
+    '>': ('price', 120),
+    '>=': ('price', 120),
+    '<': ('price', 150),
+    '<=': ('price', 150),
+    '==': ('tips', 'x'),
+    '!=': ('tips', '待上市'),
+    'in': ('tips', ['x', '待上市']),
+    'not in': ('tips', ['x', '待上市']),
+    'empty': ('tips', None),
+    'not empty': ('tips', None),
+}
+
+
+def test_every_op_has_a_case():
+    assert set(OP_CASES) == set(FILTER_OPS)
+
+
+@pytest.mark.parametrize('op', sorted(OP_CASES))
+def test_score_row_matches_select(op):
+    rows = make_rows()
+    field, value = OP_CASES[op]
+    filters = [(field, op, value)]
+    factors = [('dblow', -1)]
+    numeric = ('price', 'dblow')
+
+    indices = Screener(rows, numeric).select(filters, factors)
+    scored = [(score_row(row, filters, factors, numeric), row['id']) for row in rows]
+    expected = [row_id for score, row_id in sorted((-s, i) for s, i in scored if s is not None)]
+    assert [rows[i]['id'] for i in indices] == expected
+    assert 0 < len(expected) < len(rows)
+
+
+def test_score_row_not_empty_rejects_empty():
+    assert score_row({'a': None}, [('a', 'not empty', None)]) is None
+    assert score_row({'a': ''}, [('a', 'not empty', None)]) is None
+    assert score_row({'a': 'x'}, [('a', 'not empty', None)]) == 0
+
+
+def test_convert_bond_filters_match_select():
+    rows = make_rows(500, seed=1)
+    for row in rows:
+        row['price_tips'] = row.pop('tips')
+        row['redeem_dt'] = random.Random(row['id']).choice([None, '', '2026-01-01'])
+    indices = convert_bond_screener(rows).select(CONVERT_BOND_FILTERS, CONVERT_BOND_FACTORS)
+    kept = {row['id'] for row in rows
+            if score_row(row, CONVERT_BOND_FILTERS, CONVERT_BOND_FACTORS, CONVERT_BOND_NUMERIC) is not None}
+    assert {rows[i]['id'] for i in indices} == kept
+
+
+def test_top_uses_argpartition_order():
+    rows = [{'id': i, 'v': v} for i, v in enumerate([5, 1, 4, 2, 3])]
+    screener = Screener(rows, ('v',))
+    assert [row['id'] for row in screener.top(factors=[('v', 1)], topk=3)] == [0, 2, 4]
+    assert [row['id'] for row in screener.top(factors=[('v', -1)])] == [1, 3, 4, 2, 0]
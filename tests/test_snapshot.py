@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+from snapshot import SnapshotStore, closed_fund_score
+
+
+def price_score(row):
+    return row['price'] if isinstance(row['price'], float) else None
+
+
+def bonds(**prices):
+    return [{'bond_id': bond_id, 'price': price, 'name': bond_id.upper()} for bond_id, price in prices.items()]
+
+
+def test_first_update_adds_everything():
+    store = SnapshotStore('bond_id', price_score)
+    delta = store.update(bonds(a=110.0, b=100.0, c='-'))
+    assert set(delta.added) == {'a', 'b', 'c'} and not delta.removed and not delta.changed
+    # 得分为 None 的行不参与排名
+    assert [row['bond_id'] for row in store.ranked()] == ['b', 'a']
+    assert store.rank('c') is None
+
+
+def test_delta_and_ranking_follow_changes():
+    store = SnapshotStore('bond_id', price_score)
+    store.update(bonds(a=110.0, b=100.0, c=120.0))
+    delta = store.update(bonds(a=90.0, c=120.0, d=105.0))
+
+    assert list(delta.added) == ['d']
+    assert list(delta.removed) == ['b']
+    assert delta.changed == {'a': {'price': (110.0, 90.0)}}
+    assert [row['bond_id'] for row in store.ranked()] == ['a', 'd', 'c']
+    assert [row['bond_id'] for row in store.ranked(topk=2)] == ['a', 'd']
+    assert store.rank('c') == 2 and store.rank('b') is None
+
+
+def test_unchanged_rows_give_empty_delta():
+    store = SnapshotStore('bond_id', price_score)
+    store.update(bonds(a=110.0, b=100.0))
+    delta = store.update(bonds(a=110.0, b=100.0))
+    assert not delta
+
+
+def test_row_losing_its_score_leaves_the_ranking():
+    store = SnapshotStore('bond_id', price_score)
+    store.update(bonds(a=110.0, b=100.0))
+    delta = store.update(bonds(a=110.0, b='-'))
+    assert delta.changed == {'b': {'price': (100.0, '-')}}
+    assert [row['bond_id'] for row in store.ranked()] == ['a']
+
+
+def test_fields_limit_the_comparison():
+    store = SnapshotStore('bond_id', price_score, fields=['price'])
+    store.update(bonds(a=110.0))
+    delta = store.update([{'bond_id': 'a', 'price': 110.0, 'name': 'renamed'}])
+    assert not delta
+    assert store.rows['a']['name'] == 'renamed'
+
+
+def test_closed_fund_score():
+    assert closed_fund_score({'discount_rt': '5.5', 'left_year': '2'}) == -2
+    assert closed_fund_score({'discount_rt': '5.5', 'left_year': '0'}) is None
+    assert closed_fund_score({'discount_rt': '-', 'left_year': '2'}) is None
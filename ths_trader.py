@@ -4,17 +4,23 @@
 link： https://github.com/shidenggui/easytrader
 """
 
+import re
 import time
 import functools
 import tempfile
-import pandas as pd
-import pywinauto
-from pywinauto import win32defines, findwindows, timings
-from pywinauto.win32functions import SetForegroundWindow, ShowWindow
 
 import config
-from utils.log import logger
-from spider import EastSpider
+from driver import PywinautoDriver
+from utils.grid import parse_grid_file, parse_grid_text, GridTracker
+from utils.log import get_logger
+from utils.perf import span, timed
+from utils.wait import wait_until
+from pop_dialog import PopDialogWatcher, DialogState, DIALOG_CAPTCHA, DIALOG_ERROR
+
+logger = get_logger('trade')
+
+# 委托结果弹窗中的合同编号
+_CONTRACT_NO_RE = re.compile(r'合同编号[:：]\s*(\w+)')
 
 
 def get_code_type(code):
@@ -43,46 +49,58 @@ def round_price_by_code(price, code):
     return '{:.2f}'.format(price)
 
 
-def set_foreground(window):
-    if window.has_style(win32defines.WS_MINIMIZE):  # if minimized
-        ShowWindow(window.wrapper_object(), 9)  # restore window state
-    else:
-        SetForegroundWindow(window.wrapper_object())  # bring to front
-
-
 def wait(seconds):
     time.sleep(seconds)
 
 
 class THSTrader():
-    def __init__(self, exe_path):
+    def __init__(self, exe_path, driver=None, spider=None):
+        """
+        :param exe_path: xiadan.exe 路径
+        :param driver: 客户端驱动，默认为 PywinautoDriver
+        :param spider: 新股新债数据来源，默认为 EastSpider
+        """
         super().__init__()
+        self._driver = driver or PywinautoDriver()
+        self._today_data = None
+        self._grid_trackers = {}
         self.connect(exe_path)
-        self.spider = EastSpider()
+        if spider is None:
+            # EastSpider 依赖 requests，只有实际使用时才导入
+            from spider import EastSpider
+            spider = EastSpider()
+        self.spider = spider
 
+    @timed('trade.connect')
     def connect(self, exe_path: str):
-        try:
-            self._app = pywinauto.Application().connect(path=exe_path, timeout=3)
-        except Exception as e:
-            logger.warning("try connect exe_path: %s failed, err: %s, try start it" % (exe_path, e))
-            self._app = pywinauto.Application().start(exe_path)
+        self._app = self._driver.connect(exe_path)
 
         self._close_prompt_windows()
         self._main = self._app.top_window()
         self._init_toolbar()
+        self._dialog_watcher = PopDialogWatcher(self._app, self._main)
+        self._dialog_watcher.start()
+        self._handled_dialog = None
+
+    def _get_prompt_windows(self):
+        """
+        获取主窗口以外的提示窗口
+        """
+        return [window for window in self._app.windows(class_name="#32770", visible_only=True)
+                if window.window_text() != config.TITLE]
 
     def _close_prompt_windows(self):
         """
         关闭提示窗口
         """
-        wait(1)
-        for window in self._app.windows(class_name="#32770", visible_only=True):
+        # 等待主窗口出现，提示窗口一般与主窗口同时弹出
+        wait_until(lambda: self._app.window(title=config.TITLE, class_name="#32770").exists(), timeout=1)
+        for window in self._get_prompt_windows():
             title = window.window_text()
-            if title != config.TITLE:
-                logger.info("close " + title)
-                window.close()
-                wait(0.2)
-        wait(1)
+            logger.info("close " + title)
+            window.close()
+            wait_until(lambda: not window.exists(), timeout=0.2)
+        wait_until(lambda: not self._get_prompt_windows(), timeout=1)
 
     def _init_toolbar(self):
         """
@@ -105,6 +123,16 @@ class THSTrader():
 
         return ret
 
+    def _get_new_account_name(self, users):
+        """
+        获取当前账户名，账户名为空或已在 users 中时返回 None
+        """
+        name = self._get_account_name()
+        if name and name not in users:
+            return name
+        return None
+
+    @timed('trade.menu')
     def _switch_left_menus(self, path, sleep=0.2):
         """
         点击左侧菜单栏里面指定的按钮
@@ -120,7 +148,7 @@ class THSTrader():
         count = 2
         while True:
             try:
-                set_foreground(self._main)
+                self._driver.set_foreground(self._main)
                 handle = self._main.child_window(control_id=0x81, class_name="SysTreeView32")
 
                 if count <= 0:
@@ -134,39 +162,86 @@ class THSTrader():
                 logger.exception("error occurred when trying to get left menus, err: %s" % e)
             count = count - 1
 
-    def _handle_pop_dialogs(self):
+    @timed('trade.dialogs')
+    def _handle_pop_dialogs(self, timeout=None, expected=0, result=None):
         """
         处理弹出的窗口
+        确认类弹窗按回车确认，错误类弹窗记录内容后关闭，遇到验证码弹窗直接返回
+        :param timeout: 等待第一个弹窗的超时时间，默认 config.POP_DIALOG_TIMEOUT，为 0 时只处理已经弹出的窗口
+        :param expected: 处理完该数量的弹窗后立即返回，不再等待后续弹窗，0 表示等到没有新弹窗为止
+        :param result: 在已有的处理结果上继续处理
+        :return: dict {'success': 是否成功, 'message': 弹窗内容}，委托成功时包含 'contract_no': 合同编号
         """
-        cnt = 0
-        while self._is_exist_pop_dialog():
-            pywinauto.keyboard.send_keys('{ENTER}')
-            logger.info("exist_pop_dialog, press enter.")
-            wait(1)
-            cnt += 1
-            if cnt >= 3:
-                self._main.set_focus()
-                break
+        if result is None:
+            result = {'success': True, 'message': ''}
+        if timeout is None:
+            timeout = config.POP_DIALOG_TIMEOUT
+        for count in range(1, config.POP_DIALOG_MAX_COUNT + 1):
+            # 按过回车的弹窗在关闭前仍可能是最前窗口，不能重复处理
+            state = self._dialog_watcher.wait_dialog(timeout, exclude=self._handled_dialog)
+            if state is None:
+                return result
+
+            if state.kind == DIALOG_CAPTCHA:
+                result.update(success=False, message=state.text or state.title)
+                return result
+            if state.kind == DIALOG_ERROR:
+                result.update(success=False, message=state.text or state.title)
+            elif result['success']:
+                result['message'] = state.text
+                match = _CONTRACT_NO_RE.search(state.text or '')
+                if match:
+                    result['contract_no'] = match.group(1)
+
+            self._driver.send_keys('{ENTER}')
+            logger.info("exist_pop_dialog: %s, press enter." % state.kind)
+            self._handled_dialog = state.handle
+            if count == expected:
+                return result
+
+            self._dialog_watcher.wait_closed(state.handle, config.POP_DIALOG_TIMEOUT)
+            # 确认后紧接着弹出的提示窗口出现得很快，不必再等满 POP_DIALOG_TIMEOUT
+            timeout = config.POP_DIALOG_FOLLOWUP_TIMEOUT
+
+        self._main.set_focus()
+        return result
+
+    def _resolve_trade_controls(self):
+        """
+        查找下单界面的输入框和下单按钮，返回 {控件ID: wrapper}
+        批量下单时复用，避免每笔委托重新查找控件
+        """
+        controls = {}
+        for control_id in (config.TRADE_SECURITY_CONTROL_ID, config.TRADE_PRICE_CONTROL_ID,
+                           config.TRADE_AMOUNT_CONTROL_ID):
+            controls[control_id] = self._main.child_window(control_id=control_id, class_name="Edit").wrapper_object()
+        controls[config.TRADE_SUBMIT_CONTROL_ID] = self._main.child_window(
+            control_id=config.TRADE_SUBMIT_CONTROL_ID, class_name="Button"
+        ).wrapper_object()
+        return controls
 
-    def _set_trade_params(self, code, price, amount):
+    @timed('trade.set_params')
+    def _set_trade_params(self, code, price, amount, controls=None):
         """
         设置交易参数
+        :param controls: _resolve_trade_controls 的返回值，为 None 时重新查找
         """
         logger.info("set_trade_params，code: %s, price: %s, amount: %s" % (code, price, amount))
-        self._type_edit_control_keys(config.TRADE_SECURITY_CONTROL_ID, code)
+        if controls is None:
+            controls = self._resolve_trade_controls()
 
-        # wait security input finish
-        wait(0.5)
+        amount_limit = self._get_static_text(config.TRADE_AMOUNT_LIMIT_CONTROL_ID)
+        self._type_editor_keys(controls[config.TRADE_SECURITY_CONTROL_ID], code)
 
-        self._type_edit_control_keys(
-            config.TRADE_PRICE_CONTROL_ID,
-            round_price_by_code(price, code),
-        )
+        # wait security input finish: 客户端查询到证券后会刷新可买数量
+        self._wait_static_changed(config.TRADE_AMOUNT_LIMIT_CONTROL_ID, amount_limit, timeout=0.5)
 
-        wait(0.5)
-        self._type_edit_control_keys(
-            config.TRADE_AMOUNT_CONTROL_ID, str(int(amount))
-        )
+        price = round_price_by_code(price, code)
+        price_editor = controls[config.TRADE_PRICE_CONTROL_ID]
+        self._type_editor_keys(price_editor, price)
+        wait_until(lambda: price_editor.window_text() == price, timeout=0.5)
+
+        self._type_editor_keys(controls[config.TRADE_AMOUNT_CONTROL_ID], str(int(amount)))
 
     def _type_edit_control_keys(self, control_id, text):
         """
@@ -174,16 +249,65 @@ class THSTrader():
         """
         logger.info("type_edit_control_keys, control_id: %s, text: %s" % (control_id, text))
         editor = self._main.child_window(control_id=control_id, class_name="Edit")
+        self._type_editor_keys(editor, text)
+
+    def _type_editor_keys(self, editor, text):
+        """
+        在输入框输入文本
+        """
         editor.select()
         # pywinauto.keyboard.send_keys('^a')
         # pywinauto.keyboard.send_keys('{DEL}')
         editor.type_keys(text)
 
-    def _submit_trade(self):
-        time.sleep(0.2)
-        self._main.child_window(
-            control_id=config.TRADE_SUBMIT_CONTROL_ID, class_name="Button"
-        ).click()
+    def _get_edit_text(self, control_id):
+        return self._main.child_window(control_id=control_id, class_name="Edit").window_text()
+
+    def _get_static_text(self, control_id):
+        try:
+            return self._main.child_window(control_id=control_id, class_name="Static").window_text()
+        except self._driver.control_errors:
+            return None
+
+    def _wait_edit_text(self, control_id, text, timeout=config.WAIT_TIMEOUT):
+        """
+        等待输入框的内容变为 text
+        """
+        return wait_until(lambda: self._get_edit_text(control_id) == text, timeout=timeout)
+
+    def _wait_static_changed(self, control_id, old_text, timeout=config.WAIT_TIMEOUT):
+        """
+        等待 Static 控件刷新：内容变为不同于 old_text 的非空值，或者先被清空再重新填充
+        :return: 刷新后的内容，超时返回当前内容
+        """
+        cleared = []
+
+        def refreshed():
+            text = self._get_static_text(control_id)
+            if not text:
+                cleared.append(True)
+                return False
+            return text != old_text or bool(cleared)
+
+        wait_until(refreshed, timeout=timeout)
+        return self._get_static_text(control_id)
+
+    def _is_main_top(self):
+        """
+        主窗口是否位于最前(没有弹窗)，不等待
+        """
+        return self._main.wrapper_object() == self._app.top_window().wrapper_object()
+
+    @timed('trade.submit')
+    def _submit_trade(self, controls=None):
+        if controls is None:
+            submit = self._main.child_window(
+                control_id=config.TRADE_SUBMIT_CONTROL_ID, class_name="Button"
+            )
+        else:
+            submit = controls[config.TRADE_SUBMIT_CONTROL_ID]
+        wait_until(submit.is_enabled, timeout=0.2)
+        submit.click()
 
     def _get_grid(self, control_id: int):
         grid = self._main.child_window(
@@ -192,62 +316,164 @@ class THSTrader():
         return grid
 
     def _format_grid_data(self, filepath: str):
-        df = pd.read_csv(
-            filepath,
-            delimiter="\t",
-            dtype=config.GRID_DTYPE,
-            na_filter=False,
-            encoding="gbk"
-        )
-        return df.to_dict("records")
+        return parse_grid_file(filepath, encoding="gbk", dtype=config.GRID_DTYPE)
+
+    def _input_grid_captcha(self, state):
+        """
+        识别并输入导出表格时弹出的验证码
+        :param state: 验证码弹窗的 DialogState
+        :return: 识别结果的缓存 key，用于 _feedback_grid_captcha，未输入验证码时返回 None
+        """
+        top = self._app.top_window()
+        if not top.window(class_name="Static", title_re=".*输入验证码.*").exists():
+            return
+
+        image = top.window(class_name="Static", control_id=0x965).capture_as_image()
+
+        from utils.captcha import captcha_recognize
+        from utils.captcha_cache import default_cache
+
+        def recognize(img):
+            captcha_num = captcha_recognize(img).strip()  # 识别验证码，直接使用截图，不保存临时文件
+            return "".join(captcha_num.split())
+
+        # 同一张验证码图片直接使用缓存的识别结果
+        key, captcha_num = default_cache().recognize(image, recognize, 'ths')
+        logger.info("captcha result-->%s, cache: %s" % (captcha_num, default_cache().stats()))
+        if len(captcha_num) != config.CAPTCHA_LENGTH:
+            default_cache().reject(key)
+            return None
+
+        editor = top.child_window(control_id=0x964, class_name="Edit")
+        editor.select()
+        editor.type_keys(captcha_num)
+        top.set_focus()
+        self._driver.send_keys("{ENTER}")  # 模拟发送enter，点击确定
+        self._dialog_watcher.wait_closed(state.handle, timeout=1)
+        return key
 
+    def _feedback_grid_captcha(self, key, accepted):
+        """
+        把客户端是否接受验证码反馈给识别结果缓存，识别错误的结果会被删除
+        """
+        if key is None:
+            return
+        from utils.captcha_cache import default_cache
+
+        if accepted:
+            default_cache().accept(key)
+        else:
+            logger.warning("captcha rejected by client")
+            default_cache().reject(key)
+
+    def _get_clipboard_text(self):
+        try:
+            return self._driver.get_clipboard_text()
+        except Exception:  # 剪贴板被其他程序占用或为空
+            return ''
+
+    @timed('trade.grid')
     def _get_grid_data(self, control_id):
         """
-        获取通过保存到xls获取表格数据
-        暂时没有用到此函数，现采用的是爬取东方财富的数据
+        获取表格数据，config.GRID_STRATEGY 为 copy 时通过剪贴板复制，失败时退回保存文件的方式
+        """
+        if config.GRID_STRATEGY == 'copy':
+            data = self._get_grid_data_by_copy(control_id)
+            if data is not None:
+                return data
+            logger.warning("copy grid data failed, fallback to save file")
+        return self._get_grid_data_by_save(control_id)
+
+    @timed('trade.grid')
+    def _get_grid_text(self, control_id):
+        """
+        获取表格的原始文本，复制失败时退回保存文件的方式
+        """
+        if config.GRID_STRATEGY == 'copy':
+            text = self._get_grid_text_by_copy(control_id)
+            if text is not None:
+                return text
+            logger.warning("copy grid text failed, fallback to save file")
+        with open(self._save_grid_file(control_id), encoding="gbk", newline='') as f:
+            return f.read()
+
+    def _get_grid_data_by_copy(self, control_id):
+        """
+        通过 ctrl+a ctrl+c 复制表格到剪贴板后解析，省去保存文件和读文件
+        :return: list 表格数据，剪贴板没有数据时返回 None
+        """
+        text = self._get_grid_text_by_copy(control_id)
+        if text is None:
+            return None
+        return parse_grid_text(text, dtype=config.GRID_DTYPE)
+
+    def _get_grid_text_by_copy(self, control_id):
+        """
+        ctrl+a ctrl+c 复制表格到剪贴板
+        :return: 表格文本，剪贴板没有数据时返回 None
         """
         grid = self._get_grid(control_id)
-        set_foreground(grid)  # setFocus buggy, instead of SetForegroundWindow
-        grid.type_keys("^s", set_foreground=False)
-        count = 10
-        while count > 0:
-            if self._is_exist_pop_dialog():
-                if self._app.top_window().window(class_name="Static", title_re=".*输入验证码.*").exists():
-                    file_path = "tmp.png"
-                    self._app.top_window().window(class_name="Static", control_id=0x965).capture_as_image().save(
-                        file_path)
-                    set_foreground(grid)
-
-                    from utils.captcha import captcha_recognize
-                    captcha_num = captcha_recognize("tmp.png").strip()  # 识别验证码
-                    captcha_num = "".join(captcha_num.split())
-                    logger.info("captcha result-->" + captcha_num)
-                    if len(captcha_num) == 4:
-                        editor = self._app.top_window().child_window(control_id=0x964, class_name="Edit")
-                        editor.select()
-                        editor.type_keys(captcha_num)
-                        self._app.top_window().set_focus()
-                        pywinauto.keyboard.send_keys("{ENTER}")  # 模拟发送enter，点击确定
-                        wait(1)
-                break
+        self._driver.empty_clipboard()
+        self._driver.set_foreground(grid)  # setFocus buggy, instead of SetForegroundWindow
+        grid.type_keys("^A^C", set_foreground=False)
+
+        ret = wait_until(lambda: self._dialog_watcher.state or self._get_clipboard_text(),
+                         timeout=config.GRID_COPY_TIMEOUT)
+        if isinstance(ret, DialogState):
+            if ret.kind != DIALOG_CAPTCHA:
+                return None
+            key = self._input_grid_captcha(ret)
+            ret = wait_until(lambda: self._dialog_watcher.state or self._get_clipboard_text(),
+                             timeout=config.GRID_COPY_TIMEOUT)
+            # 验证码错误时客户端会再次弹窗，不会复制数据
+            self._feedback_grid_captcha(key, bool(ret) and not isinstance(ret, DialogState))
+            if isinstance(ret, DialogState):
+                return None
+
+        if not ret:
+            return None
+        return ret
+
+    def _get_grid_data_by_save(self, control_id):
+        """
+        通过 ctrl+s 保存表格到临时文件后解析
+        """
+        return self._format_grid_data(self._save_grid_file(control_id))
 
-            wait(1)
-            count -= 1
+    def _save_grid_file(self, control_id):
+        """
+        ctrl+s 保存表格到临时文件
+        :return: 文件路径
+        """
+        grid = self._get_grid(control_id)
+        self._driver.set_foreground(grid)  # setFocus buggy, instead of SetForegroundWindow
+        grid.type_keys("^s", set_foreground=False)
+        state = self._dialog_watcher.wait_dialog(timeout=10)
+        if state is not None and state.kind == DIALOG_CAPTCHA:
+            self._driver.set_foreground(grid)
+            key = self._input_grid_captcha(state)
+            # 等待保存窗口弹出，验证码错误时弹出的是错误提示或新的验证码
+            next_state = self._dialog_watcher.wait_dialog(timeout=1, exclude=state.handle)
+            self._feedback_grid_captcha(key, next_state is not None and
+                                        next_state.kind not in (DIALOG_CAPTCHA, DIALOG_ERROR))
 
         temp_path = tempfile.mktemp(suffix=".csv")
-        set_foreground(self._app.top_window())
+        self._driver.set_foreground(self._app.top_window())
 
         # alt+s保存，alt+y替换已存在的文件
-        self._app.top_window().Edit1.set_edit_text(temp_path)
-        wait(0.1)
-        self._app.top_window().type_keys("%{s}%{y}", set_foreground=False)
-        # Wait until file save complete otherwise pandas can not find file
-        wait(0.2)
-        if self._is_exist_pop_dialog():
+        save_dialog = self._app.top_window()
+        save_dialog.Edit1.set_edit_text(temp_path)
+        wait_until(lambda: save_dialog.Edit1.window_text() == temp_path, timeout=0.1)
+        save_handle = save_dialog.wrapper_object().handle
+        save_dialog.type_keys("%{s}%{y}", set_foreground=False)
+        # Wait until file save complete otherwise the file can not be found
+        self._dialog_watcher.wait_closed(save_handle, timeout=1)
+        state = self._dialog_watcher.wait_dialog(timeout=0.2, exclude=save_handle)
+        if state is not None:
             self._app.top_window().Button2.click()
-            wait(0.2)
+            self._dialog_watcher.wait_closed(state.handle, timeout=0.2)
 
-        return self._format_grid_data(temp_path)
+        return temp_path
 
     def _click(self, control_id):
         """
@@ -257,13 +483,17 @@ class THSTrader():
         btn.click()
 
     def _is_exist_pop_dialog(self):
-        wait(1)  # wait dialog display
+        """
+        当前是否存在弹窗，不等待
+        """
+        if self._dialog_watcher.is_alive():
+            return self._dialog_watcher.state is not None
 
         try:
             main_wrapper = self._main.wrapper_object()
             top_window_wrapper = self._app.top_window().wrapper_object()
             return main_wrapper != top_window_wrapper
-        except (findwindows.ElementNotFoundError, timings.TimeoutError, RuntimeError,) as e:
+        except self._driver.control_errors as e:
             logger.exception("check pop dialog timeout, err: %s" % e)
             return False
 
@@ -272,22 +502,94 @@ class THSTrader():
         :param security: 股票id
         :param price: 价格
         :param amount: 数量
+        :return: dict {'success': 是否成功, 'message': 弹窗内容}
         """
         self._set_trade_params(security, price, amount)
         self._submit_trade()
-        self._handle_pop_dialogs()
+        return self._handle_pop_dialogs()
 
     def buy(self, security, price, amount):
         self._switch_left_menus(["买入[F1]"])
         return self.trade(security, price, amount)
 
+    @timed('trade.batch')
+    def trade_batch(self, menu_path, orders):
+        """
+        在同一个下单界面批量委托
+        只切换一次菜单、查找一次控件；每笔委托只等待 config.TRADE_POP_DIALOG_COUNT 个弹窗，
+        之后迟到的弹窗在下一笔委托输入前处理，与下一笔的准备工作重叠
+        :param menu_path: 下单界面的菜单路径
+        :param orders: [(证券代码, 价格, 数量), ...]
+        :return: list 每笔委托的结果 {'code', 'price', 'amount', 'success', 'message', 'elapsed'[, 'contract_no']}
+        """
+        results = []
+        if not orders:
+            return results
+
+        self._switch_left_menus(menu_path)
+        controls = self._resolve_trade_controls()
+        previous = None
+        for index, (code, price, amount) in enumerate(orders):
+            start = time.perf_counter()
+            result = {'code': code, 'price': price, 'amount': amount, 'success': True, 'message': ''}
+            try:
+                # 上一笔委托迟到的弹窗
+                if previous is not None and not self._is_main_top():
+                    self._handle_pop_dialogs(timeout=0, result=previous)
+                wait_until(self._is_main_top, timeout=config.POP_DIALOG_FOLLOWUP_TIMEOUT)
+
+                self._set_trade_params(code, price, amount, controls)
+                self._submit_trade(controls)
+                self._handle_pop_dialogs(expected=config.TRADE_POP_DIALOG_COUNT, result=result)
+            except Exception as e:
+                logger.error("trade %s failed, err: %s" % (code, e))
+                result.update(success=False, message=str(e))
+                # 界面可能已经变化，重新查找控件
+                try:
+                    controls = self._resolve_trade_controls()
+                except Exception as e:
+                    logger.error("resolve trade controls failed, skip remaining orders, err: %s" % e)
+                    controls, lost = None, str(e)
+            result['elapsed'] = time.perf_counter() - start
+            results.append(result)
+            previous = result
+
+            if controls is None:
+                for code, price, amount in orders[index + 1:]:
+                    results.append({'code': code, 'price': price, 'amount': amount, 'success': False,
+                                    'message': "下单界面不可用: %s" % lost, 'elapsed': 0.0})
+                break
+
+        # 最后一笔委托的后续弹窗
+        if previous is not None:
+            self._handle_pop_dialogs(timeout=config.POP_DIALOG_FOLLOWUP_TIMEOUT, result=previous)
+        return results
+
+    def buy_batch(self, orders):
+        """
+        批量买入
+        :param orders: [(证券代码, 价格, 数量), ...]
+        """
+        return self.trade_batch(["买入[F1]"], orders)
+
+    def sell(self, security, price, amount):
+        self._switch_left_menus(["卖出[F2]"])
+        return self.trade(security, price, amount)
+
+    def sell_batch(self, orders):
+        """
+        批量卖出
+        :param orders: [(证券代码, 价格, 数量), ...]
+        """
+        return self.trade_batch(["卖出[F2]"], orders)
+
     def apply_stocks(self, stock_list):
 
         if len(stock_list) == 0:
             return "今日无新股"
 
         ret = ""
-        set_foreground(self._main)
+        self._driver.set_foreground(self._main)
         self._switch_left_menus(config.AUTO_IPO_MENU_PATH)
 
         new_stocks = []
@@ -295,25 +597,27 @@ class THSTrader():
             stock_id = stock['id']
             stock_name = stock['name']
             stock_price = stock['price']
+            old_apply_num = self._get_static_text(config.TRADE_AMOUNT_LIMIT_CONTROL_ID)
             self._type_edit_control_keys(control_id=config.TRADE_SECURITY_CONTROL_ID, text=stock_id)
-            wait(1)
 
-            apply_num = self._main.child_window(control_id=0x3FA, class_name="Static").window_text()
+            apply_num = self._wait_static_changed(config.TRADE_AMOUNT_LIMIT_CONTROL_ID, old_apply_num, timeout=1)
             if not apply_num or float(apply_num) <= 100:
-                set_foreground(self._main)
+                self._driver.set_foreground(self._main)
                 self._main.child_window(control_id=config.TRADE_REFILL_CONTRON_ID, class_name="Button").click()
-                wait(1)
+                self._wait_edit_text(config.TRADE_SECURITY_CONTROL_ID, '', timeout=1)
                 ret += "%s 可申购数量: %s; " % (stock_name, 0)
                 continue
 
             new_stocks.append([stock_id, stock_name, stock_price, apply_num])
-            wait(1)
 
         ret += '\n'
-        for stock_id, stock_name, stock_price, apply_num in new_stocks:
-            self.buy(stock_id, stock_price, apply_num)
-            ret += "%s 申购成功， 申购数量: %s; " % (stock_name, apply_num)
-            wait(1)
+        results = self.buy_batch([(stock_id, stock_price, apply_num)
+                                  for stock_id, _, stock_price, apply_num in new_stocks])
+        for (_, stock_name, _, apply_num), result in zip(new_stocks, results):
+            if result['success']:
+                ret += "%s 申购成功， 申购数量: %s; " % (stock_name, apply_num)
+            else:
+                ret += "%s 申购失败: %s; " % (stock_name, result['message'])
 
         return ret
 
@@ -327,62 +631,191 @@ class THSTrader():
             return "今日无可转债"
 
         ret = ""
-        for bond_id in bonds:
+        for result in self.buy_batch([(bond_id, price, amount) for bond_id in bonds]):
+            if result['success']:
+                ret += "可转债: %s 申购成功;" % result['code']
+            else:
+                ret += "可转债: %s 申购失败: %s;\n" % (result['code'], result['message'])
+
+        return ret
+
+    def _switch_account(self, index, users):
+        """
+        按 alt + index 切换到第 index 个账户，等待工具栏的账户名切换为不在 users 中的账户
+        :return: 切换后的账户名，失败返回 None
+        """
+        for _ in range(3):
+            self._driver.send_keys('%%%s' % index)
+            name = wait_until(lambda: self._get_new_account_name(users), timeout=3)
+            logger.info("press alt + %s to switch account to: %s" % (index, name))
+            if name and name not in users:
+                return name
+        logger.warning("swicth user %s failed", index)
+        return None
+
+    def _get_today_data(self, raise_errors=False):
+        """
+        当日的新股和可转债列表，优先使用 prewarm 缓存的数据
+        两个列表都为空时可能是接口失败，不缓存，申购时重新获取
+        :param raise_errors: 请求失败时抛出异常，不返回不完整的数据
+        :return: (stock_list, bonds)
+        """
+        today = time.strftime("%Y-%m-%d", time.localtime())
+        if self._today_data is not None and self._today_data[0] == today:
+            return self._today_data[1]
+        with span('trade.get_today_data'):
+            data = self.spider.get_today_data(raise_errors=raise_errors)
+        if data[0] or data[1]:
+            self._today_data = (today, data)
+        return data
+
+    def prewarm(self):
+        """
+        申购前预热：查找并校验菜单和下单控件，拉取并缓存当日新股新债，确认所有账户都能切换到
+        :return: dict {'ok': 是否就绪, 'problems': 问题列表, 'accounts': 账户名列表, 'stocks', 'bonds'}
+        """
+        problems = []
+        accounts = []
+        stock_list, bonds = [], []
+        with span('trade.prewarm'):
+            self._close_prompt_windows()
+            try:
+                self._driver.set_foreground(self._main)
+                self._switch_left_menus(["买入[F1]"])
+                self._resolve_trade_controls()
+                self._main.child_window(control_id=config.TRADE_AMOUNT_LIMIT_CONTROL_ID,
+                                        class_name="Static").wrapper_object()
+                self._get_grid(config.COMMON_GRID_CONTROL_ID).wrapper_object()
+            except self._driver.control_errors as e:
+                problems.append("下单界面控件查找失败: %s" % e)
+
+            self._today_data = None
             try:
-                self.buy(bond_id, price, amount)
-                ret += "可转债: %s 申购成功;" % bond_id
-                wait(1)
+                stock_list, bonds = self._get_today_data(raise_errors=True)
             except Exception as e:
-                logger.error("buy bond: %s failed, err: %s" % (bond_id, e))
-                ret += "可转债: %s 申购失败;\n" % bond_id
+                problems.append("获取当日新股新债失败: %s" % e)
 
-        return ret
+            if config.ACCOUNT_COUNT > 1:
+                for i in range(1, config.ACCOUNT_COUNT + 1):
+                    name = self._switch_account(i, set(accounts))
+                    if name is None:
+                        problems.append("无法切换到第 %s 个账户" % i)
+                    else:
+                        accounts.append(name)
+                # 切换回第一个账户，等待账户名不再是其他账户
+                if accounts:
+                    self._switch_account(1, set(accounts[1:]))
+            else:
+                accounts.append(self._get_account_name())
+
+        status = {'ok': not problems, 'problems': problems, 'accounts': accounts,
+                  'stocks': stock_list, 'bonds': bonds}
+        logger.info("prewarm finished: %s" % status)
+        return status
 
     def auto_ipo(self):
         """
         自动申购可转债和新股
         """
         ret = ""
-        stock_list = self.spider.get_today_stock()
-        bonds = self.spider.get_today_bond_list()
+        self._close_prompt_windows()
+        stock_list, bonds = self._get_today_data()
         users = set()
 
         for i in range(1, config.ACCOUNT_COUNT + 1):
-            set_foreground(self._main)
-            wait(1)
-
-            if config.ACCOUNT_COUNT > 1:
-                cnt = 0
-                while cnt < 3:
-                    key = '%%%s' % i
-                    wait(3)
-                    pywinauto.keyboard.send_keys(key)
-                    name = self._get_account_name()
-                    logger.info("press alt + %s to switch account to: %s" % (i, name))
-                    if name and name not in users:
+            with span('trade.account', account=i) as account_span:
+                self._driver.set_foreground(self._main)
+                wait_until(lambda: self._main.wrapper_object().is_active(), timeout=1)
+
+                if config.ACCOUNT_COUNT > 1:
+                    with span('trade.switch_account'):
+                        name = self._switch_account(i, users)
+                    if name is not None:
                         ret += name + "\n"
                         users.add(name)
-                        break
-                    cnt += 1
-                else:
-                    logger.warning("swicth user %s failed", i)
+                        # 之后的步骤按账户名统计耗时
+                        account_span.tag(account=name)
 
-            logger.info("start apply bonds")
-            ret += self.apple_bonds(bonds) + "\n"
-            wait(1)
+                logger.info("start apply bonds")
+                with span('trade.apply_bonds'):
+                    ret += self.apple_bonds(bonds) + "\n"
+                    wait_until(self._is_main_top, timeout=1)
 
-            logger.info("start apply stocks")
-            ret += self.apply_stocks(stock_list) + "\n"
-            wait(1)
+                logger.info("start apply stocks")
+                with span('trade.apply_stocks'):
+                    ret += self.apply_stocks(stock_list) + "\n"
+                    wait_until(self._is_main_top, timeout=1)
 
-            ret += '=' * 20 + "\n"
+                ret += '=' * 20 + "\n"
 
         return ret
 
+    def close(self):
+        """
+        停止弹窗监视线程
+        """
+        self._dialog_watcher.stop()
+
     def get_position(self):
         self._switch_left_menus(["查询[F4]", "资金股票"])
         return self._get_grid_data(config.COMMON_GRID_CONTROL_ID)
 
+    def get_today_entrusts(self):
+        """
+        当日委托
+        """
+        self._switch_left_menus(config.TODAY_ENTRUSTS_MENU_PATH)
+        return self._get_grid_data(config.COMMON_GRID_CONTROL_ID)
+
+    def get_today_trades(self):
+        """
+        当日成交
+        """
+        self._switch_left_menus(config.TODAY_TRADES_MENU_PATH)
+        return self._get_grid_data(config.COMMON_GRID_CONTROL_ID)
+
+    def _poll_grid(self, menu_path, key):
+        tracker = self._grid_trackers.get(tuple(menu_path))
+        if tracker is None:
+            tracker = self._grid_trackers[tuple(menu_path)] = GridTracker(key, config.GRID_DTYPE)
+        self._switch_left_menus(menu_path)
+        changes = tracker.update(self._get_grid_text(config.COMMON_GRID_CONTROL_ID))
+        if changes.reset:
+            logger.info("grid %s reset, %s rows" % (menu_path, len(changes.added)))
+        return changes
+
+    def poll_today_entrusts(self):
+        """
+        增量读取当日委托，只解析和返回上次调用以来新增、状态变化和消失的委托，切换账户后旧账户的委托都在 removed 中
+        :return: utils.grid.GridChanges
+        """
+        return self._poll_grid(config.TODAY_ENTRUSTS_MENU_PATH, config.TODAY_ENTRUSTS_KEY)
+
+    def poll_today_trades(self):
+        """
+        增量读取当日成交，见 poll_today_entrusts
+        :return: utils.grid.GridChanges
+        """
+        return self._poll_grid(config.TODAY_TRADES_MENU_PATH, config.TODAY_TRADES_KEY)
+
+    def confirm_entrusts(self, contract_nos, timeout=config.WAIT_TIMEOUT):
+        """
+        等待委托出现在当日委托中
+        :param contract_nos: 合同编号
+        :return: 未出现的合同编号
+        """
+        missing = set(map(str, contract_nos))
+
+        def confirmed():
+            self.poll_today_entrusts()
+            tracker = self._grid_trackers[tuple(config.TODAY_ENTRUSTS_MENU_PATH)]
+            missing.difference_update(tracker.rows)
+            return not missing
+
+        wait_until(confirmed, timeout=timeout, interval=config.GRID_POLL_INTERVAL,
+                   max_interval=config.GRID_POLL_INTERVAL)
+        return missing
+
 
 if __name__ == '__main__':
     from config import ths_xiadan_path
@@ -0,0 +1,163 @@
+# -*- encoding: utf-8 -*-
+"""
+验证码识别结果缓存
+客户端经常重复弹出同一张验证码图片，按灰度像素内容的哈希缓存识别结果:
+- 按条目数做 LRU 淘汰
+- 客户端接受的结果标记为 accepted，可以持久化到文件，下次启动继续使用
+- 客户端拒绝的结果立即删除，下次重新识别
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import config
+from utils.captcha import to_array
+from utils.log import get_logger
+
+logger = get_logger('captcha')
+
+
+class CaptchaCache(object):
+    """
+    验证码识别结果的 LRU 缓存
+    :param max_size: 最多缓存的验证码数量
+    :param path: 持久化文件路径，为 None 时只在内存中缓存
+    """
+
+    def __init__(self, max_size=config.CAPTCHA_CACHE_MAX_SIZE, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        entries = OrderedDict()
+        if self.path is None:
+            return entries
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for key, code in json.load(f):
+                    entries[key] = {'code': code, 'accepted': True}
+        except (OSError, ValueError):
+            pass
+        return entries
+
+    def _save(self):
+        if self.path is None:
+            return
+        # 只持久化客户端接受过的结果
+        accepted = [(key, entry['code']) for key, entry in self._entries.items() if entry['accepted']]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.%s.tmp' % os.getpid()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(accepted, f)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(image, namespace=''):
+        """
+        按灰度像素内容计算缓存 key，同一张图片不论来自截图、文件还是不同的编码格式 key 都相同
+        :param namespace: 区分不同的识别方式，如券商名称
+        """
+        arr = to_array(image, 'L')
+        digest = hashlib.sha1(('%s %s ' % (namespace, arr.shape)).encode('utf-8'))
+        digest.update(arr.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        :return: 缓存的识别结果，未命中返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry['code']
+
+    def set(self, key, code):
+        with self._lock:
+            self._entries[key] = {'code': code, 'accepted': False}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def accept(self, key):
+        """
+        客户端接受了识别结果
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['accepted']:
+                return
+            entry['accepted'] = True
+            try:
+                self._save()
+            except OSError as e:
+                logger.warning("save captcha cache failed, err: %s" % e)
+
+    def reject(self, key):
+        """
+        客户端拒绝了识别结果，删除缓存
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self.rejected += 1
+            if entry['accepted']:
+                try:
+                    self._save()
+                except OSError as e:
+                    logger.warning("save captcha cache failed, err: %s" % e)
+
+    def recognize(self, image, recognize_func, namespace=''):
+        """
+        先查缓存，未命中时调用 recognize_func 识别并缓存结果
+        :return: (key, code)，key 用于之后调用 accept/reject
+        """
+        key = self.key(image, namespace)
+        code = self.get(key)
+        if code is None:
+            code = recognize_func(image)
+            if code:
+                self.set(key, code)
+        return key, code
+
+    def stats(self):
+        """
+        命中率统计
+        """
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'rejected': self.rejected,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    按 config 创建的全局共享缓存
+    """
+    global _default_cache
+    if _default_cache is None:
+        path = config.CAPTCHA_CACHE_PATH if config.CAPTCHA_CACHE_PERSIST else None
+        _default_cache = CaptchaCache(config.CAPTCHA_CACHE_MAX_SIZE, path)
+    return _default_cache
@@ -0,0 +1,145 @@
+# -*- encoding: utf-8 -*-
+"""
+解析交易客户端表格(CVirtualGridCtrl)导出的制表符分隔文本
+逐行流式解析，不依赖 pandas
+GridTracker 记录上一次读取的表格，之后只解析和返回新增或变化的行
+"""
+
+import csv
+import io
+import re
+from collections import namedtuple
+
+import config
+
+_NUMBER_RE = re.compile(r'[+-]?(?:(\d+)|\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?$')
+
+
+def convert_value(value):
+    """
+    与 pd.read_csv(na_filter=False) 的类型推断保持一致：整数、浮点数转换为数值，其余保留字符串
+    与 pandas 按列推断不同，这里逐个单元格推断
+    """
+    match = _NUMBER_RE.match(value)
+    if match is None:
+        return value
+    if match.group(1) is not None and match.end(1) == len(value):
+        return int(value)
+    return float(value)
+
+
+def iter_grid_rows(lines, dtype=None):
+    """
+    逐行解析表格
+    :param lines: 文本行的可迭代对象，第一行为表头
+    :param dtype: {列名: str}，指定列保留为字符串，默认 config.GRID_DTYPE
+    """
+    if dtype is None:
+        dtype = config.GRID_DTYPE
+
+    reader = csv.reader(lines, delimiter='\t', quoting=csv.QUOTE_NONE)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    # 空列名与 pandas 一样命名为 Unnamed: n
+    header = [name or 'Unnamed: %d' % i for i, name in enumerate(header)]
+    converters = [str if dtype.get(name) is str else convert_value for name in header]
+    columns = list(zip(header, converters))
+    width = len(columns)
+
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        yield {name: converter(value) for (name, converter), value in zip(columns, row)}
+
+
+def parse_grid_text(text, dtype=None):
+    """
+    解析剪贴板中的表格文本
+    """
+    return list(iter_grid_rows(io.StringIO(text, newline=''), dtype))
+
+
+def parse_grid_file(filepath, encoding='gbk', dtype=None):
+    """
+    解析客户端保存的表格文件
+    """
+    with open(filepath, encoding=encoding, newline='') as f:
+        return list(iter_grid_rows(f, dtype))
+
+
+# added/changed: 新增/变化的行，removed: 消失的行(切换账户、隔日、撤单后被清除)，
+# reset: 表格被重置(第一次读取或表头变化)，此时 added 为全部行
+GridChanges = namedtuple('GridChanges', ['added', 'changed', 'reset', 'removed'])
+
+
+class GridTracker(object):
+    """
+    增量读取表格
+    与上一次内容相同的文本行直接跳过，只解析新出现的行，再按 key 列区分新增和变化；
+    每次更新后 rows 只保留当前表格中的行
+    :param key: 行的唯一标识列，如 合同编号；为 None 或表头中没有该列时，每个新出现的行都视为新增
+    """
+
+    def __init__(self, key=None, dtype=None):
+        self.key = key
+        self.dtype = dtype
+        self.header = None
+        self.rows = {}
+        # 上一次的文本行 -> 该行的 key
+        self._lines = {}
+
+    def reset(self):
+        self.header = None
+        self.rows = {}
+        self._lines = {}
+
+    def update(self, text):
+        """
+        :param text: 表格的完整文本
+        :return: GridChanges
+        """
+        lines = [line for line in text.splitlines() if line]
+        if not lines:
+            removed = list(self.rows.values())
+            self.reset()
+            return GridChanges([], [], bool(removed), removed)
+
+        header, body = lines[0], lines[1:]
+        reset = header != self.header
+        if reset:
+            removed = list(self.rows.values())
+            self.reset()
+            self.header = header
+        else:
+            removed = []
+
+        current = {}
+        new_lines = []
+        for line in body:
+            if line in self._lines:
+                current[line] = self._lines[line]
+            else:
+                new_lines.append(line)
+
+        added, changed = [], []
+        for line, row in zip(new_lines, iter_grid_rows([header] + new_lines, self.dtype)):
+            key = row.get(self.key) if self.key is not None else None
+            if key is None:
+                key = line
+            if key in self.rows:
+                changed.append(row)
+            else:
+                added.append(row)
+            self.rows[key] = row
+            current[line] = key
+
+        # 消失的行(撤单后被清除、被其他行替换)不再保留
+        keys = set(current.values())
+        for key in [key for key in self.rows if key not in keys]:
+            removed.append(self.rows.pop(key))
+        self._lines = current
+        return GridChanges(added, changed, reset, removed)
@@ -0,0 +1,292 @@
+# -*- encoding: utf-8 -*-
+"""
+磁盘 HTTP 响应缓存，以 requests Adapter 的方式挂载到 session 上
+- 按 url 匹配的规则设置每个接口的缓存时间，数据为空或行数不足的响应(接口报错、未登录)不缓存
+- 需要登录的接口按 cookie 区分缓存
+- 过期后若有 ETag/Last-Modified 则发条件请求，304 时直接复用缓存
+- 按总大小做 LRU 淘汰
+- 离线模式下只读缓存，不访问网络
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import config
+from utils.log import get_logger
+
+logger = get_logger('http')
+
+# 响应体已解码，这些头不能原样回放
+_SKIP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'connection')
+
+
+def payload_rows(body):
+    """
+    响应中的数据行数：东方财富 result.data，集思录 data 或 rows
+    :return: 行数，不是 json 或没有这些字段时返回 None
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    if 'result' in payload:
+        payload = payload['result'] or {}
+        if not isinstance(payload, dict):
+            return 0
+    for field in ('data', 'rows'):
+        if field in payload:
+            return len(payload[field] or [])
+    return None if payload else 0
+
+
+class HttpCache(object):
+    """
+    磁盘响应缓存
+    :param cache_dir: 缓存目录
+    :param max_bytes: 缓存总大小上限，超出后按最近最少使用淘汰
+    :param ttls: {url 片段: 缓存秒数}，按顺序取第一个匹配项，未匹配的 url 不缓存
+    :param offline: 离线回放模式，命中缓存时忽略过期时间，未命中时报错
+    :param ignore_patterns: 计算缓存 key 时从 url 中去掉的正则，用于忽略时间戳之类的防缓存参数
+    :param min_rows: {url 片段: 最少数据行数}，数据行数不足的响应不缓存，未匹配的 url 至少要有 1 行
+    :param auth_urls: 需要登录的 url 片段，缓存 key 带上 cookie 的指纹
+    """
+
+    def __init__(self, cache_dir, max_bytes, ttls, offline=False, ignore_patterns=(), min_rows=None,
+                 auth_urls=()):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttls = list(ttls.items())
+        self.offline = offline
+        self.ignore_patterns = [re.compile(p) for p in ignore_patterns]
+        self.min_rows = list((min_rows or {}).items())
+        self.auth_urls = list(auth_urls)
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+
+        index = OrderedDict()
+        for key, meta in entries:
+            if os.path.exists(self._body_path(key)):
+                index[key] = meta
+        return index
+
+    def _save_index(self):
+        tmp_path = self._index_path + '.%s.tmp' % os.getpid()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self._index.items()), f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path)
+
+    def _body_path(self, key):
+        return os.path.join(self.cache_dir, key + '.body')
+
+    def key(self, method, url, cookie=None):
+        """
+        :param cookie: 请求的 Cookie 头，只有需要登录的 url 才参与计算
+        """
+        auth = ''
+        if cookie and any(fragment in url for fragment in self.auth_urls):
+            auth = ' ' + hashlib.sha1(cookie.encode('utf-8')).hexdigest()
+        for pattern in self.ignore_patterns:
+            url = pattern.sub('', url)
+        return hashlib.sha1(('%s %s%s' % (method, url, auth)).encode('utf-8')).hexdigest()
+
+    def ttl(self, url):
+        """
+        获取 url 的缓存时间，返回 None 表示不缓存
+        """
+        for fragment, seconds in self.ttls:
+            if fragment in url:
+                return seconds
+        return None
+
+    def cacheable(self, url, body):
+        """
+        响应的数据行数是否达到 url 要求的最少行数，无法识别数据行的响应照常缓存
+        """
+        rows = payload_rows(body)
+        if rows is None:
+            return True
+        for fragment, count in self.min_rows:
+            if fragment in url:
+                return rows >= count
+        return rows >= 1
+
+    def get(self, key):
+        """
+        读取缓存
+        :return: (meta, body)，未命中返回 (None, None)
+        """
+        with self._lock:
+            meta = self._index.get(key)
+            if meta is None:
+                return None, None
+            try:
+                with open(self._body_path(key), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                del self._index[key]
+                return None, None
+            self._index.move_to_end(key)
+            return meta, body
+
+    def set(self, key, url, response, body):
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _SKIP_HEADERS}
+        meta = {
+            'url': url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': headers,
+            'time': time.time(),
+            'size': len(body),
+        }
+        with self._lock:
+            tmp_path = self._body_path(key) + '.%s.tmp' % os.getpid()
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, self._body_path(key))
+            self._index[key] = meta
+            self._index.move_to_end(key)
+            self._evict()
+            self._save_index()
+
+    def refresh(self, key):
+        """
+        条件请求返回 304 后刷新缓存时间
+        """
+        with self._lock:
+            if key in self._index:
+                self._index[key]['time'] = time.time()
+                self._save_index()
+
+    def _evict(self):
+        total = sum(meta['size'] for meta in self._index.values())
+        while total > self.max_bytes and len(self._index) > 1:
+            key, meta = self._index.popitem(last=False)
+            total -= meta['size']
+            try:
+                os.remove(self._body_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._body_path(key))
+                except OSError:
+                    pass
+            self._index.clear()
+            self._save_index()
+
+
+class CacheAdapter(HTTPAdapter):
+    """
+    带磁盘缓存的 HTTPAdapter，只缓存 GET 请求
+    """
+
+    def __init__(self, cache, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def _build_response(self, request, meta, body):
+        resp = requests.Response()
+        resp.status_code = meta['status']
+        resp.reason = meta.get('reason')
+        resp.headers = CaseInsensitiveDict(meta['headers'])
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp._content = body
+        resp.url = request.url
+        resp.request = request
+        resp.connection = self
+        resp.from_cache = True
+        return resp
+
+    def send(self, request, **kwargs):
+        ttl = self.cache.ttl(request.url)
+        if request.method != 'GET' or ttl is None:
+            return super().send(request, **kwargs)
+
+        key = self.cache.key(request.method, request.url, request.headers.get('Cookie'))
+        meta, body = self.cache.get(key)
+        if meta is not None and (self.cache.offline or time.time() - meta['time'] < ttl):
+            return self._build_response(request, meta, body)
+        if self.cache.offline:
+            raise requests.exceptions.ConnectionError("offline cache miss: %s" % request.url, request=request)
+
+        if meta is not None:
+            headers = CaseInsensitiveDict(meta['headers'])
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+
+        resp = super().send(request, **kwargs)
+        if resp.status_code == 304 and meta is not None:
+            resp.close()
+            self.cache.refresh(key)
+            return self._build_response(request, meta, body)
+
+        if resp.status_code == 200 and not self.cache.cacheable(request.url, resp.content):
+            logger.info("skip caching empty or incomplete response, url: %s" % request.url)
+        elif resp.status_code == 200:
+            try:
+                self.cache.set(key, request.url, resp, resp.content)
+            except OSError as e:
+                logger.warning("write http cache failed, url: %s, err: %s" % (request.url, e))
+        resp.from_cache = False
+        return resp
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    按 config 创建的全局共享缓存
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = HttpCache(
+            config.HTTP_CACHE_DIR,
+            config.HTTP_CACHE_MAX_BYTES,
+            config.HTTP_CACHE_TTL,
+            offline=config.HTTP_CACHE_OFFLINE,
+            ignore_patterns=config.HTTP_CACHE_IGNORE_PATTERNS,
+            min_rows=config.HTTP_CACHE_MIN_ROWS,
+            auth_urls=config.HTTP_CACHE_AUTH_URLS,
+        )
+    return _default_cache
+
+
+def install_cache(session, cache=None, **adapter_kwargs):
+    """
+    给 session 挂载缓存，config.HTTP_CACHE_ENABLED 为 False 时挂载普通 HTTPAdapter
+    :param adapter_kwargs: 传给 HTTPAdapter 的连接池参数
+    """
+    if config.HTTP_CACHE_ENABLED:
+        adapter = CacheAdapter(cache or default_cache(), **adapter_kwargs)
+    else:
+        adapter = HTTPAdapter(**adapter_kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -1,7 +1,23 @@
 # -*- encoding: utf-8 -*-
+"""
+日志
+记录日志时只把日志放入队列，由后台线程批量写入控制台和文件，下单线程不做磁盘 I/O
+- 日志文件按大小和时间轮转
+- config.LOG_FORMAT 为 json 时文件中每行一条 JSON 日志
+- config.LOG_LEVELS 按子系统设置日志级别，子系统日志通过 get_logger 获取
+"""
 
 import os
+import re
+import json
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
+import threading
+
+import config
 
 logger = logging.getLogger("auto_make_money")
 logger.setLevel(logging.DEBUG)
@@ -11,15 +27,203 @@ fmt = logging.Formatter(
     "%(asctime)s [%(levelname)s] %(filename)s %(lineno)s: %(message)s"
 )
 
+# LogRecord 的标准属性，其余属性为 extra 传入的字段
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志格式化为一行 JSON，extra 传入的字段原样输出
+    """
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _BatchFlushMixin(object):
+    """
+    批量写入期间不逐条 flush，由 BatchQueueListener 在一批日志写完后统一 flush
+    """
+
+    batching = False
+
+    def flush(self):
+        if not self.batching:
+            super().flush()
+
+
+class BatchStreamHandler(_BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class RotatingFileHandler(_BatchFlushMixin, logging.handlers.TimedRotatingFileHandler):
+    """
+    按时间和大小轮转的文件日志，第一次写日志时才创建日志目录和打开文件
+    备份文件名为 日志文件名.年-月-日_时-分-秒[_序号]，两种轮转共用 backup_count
+    :param max_bytes: 单个文件的大小上限，为 0 时只按时间轮转
+    :param when/backup_count: 见 TimedRotatingFileHandler
+    """
+
+    def __init__(self, filename, max_bytes=0, when='midnight', backup_count=7, encoding='utf-8'):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding=encoding, delay=True)
+        self.max_bytes = max_bytes
+        self.suffix = "%Y-%m-%d_%H-%M-%S"
+        self.extMatch = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}(_\d+)?$", re.ASCII)
+        self._size_rollover = False
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        self._size_rollover = self.stream.tell() >= self.max_bytes
+        return self._size_rollover
+
+    def doRollover(self):
+        if not self._size_rollover:
+            return super().doRollover()
+
+        # 按大小轮转不改变下一次按时间轮转的时间
+        self._size_rollover = False
+        self.stream.close()
+        self.stream = None
+        # 同一秒内多次轮转时加上序号
+        dfn = self.rotation_filename(self.baseFilename + "." + time.strftime(self.suffix))
+        n = 0
+        while os.path.exists(dfn):
+            n += 1
+            dfn = self.rotation_filename(self.baseFilename + "." + time.strftime(self.suffix) + "_%s" % n)
+        self.rotate(self.baseFilename, dfn)
+        if self.backupCount > 0:
+            for path in self.getFilesToDelete():
+                os.remove(path)
+
+
+class BatchQueueListener(logging.handlers.QueueListener):
+    """
+    从队列中一次取出多条日志，全部交给 handler 后再统一 flush
+    :param batch_size: 每批最多处理的日志条数
+    :param flush_interval: 处理完一批后等待的时间(秒)，让日志在队列中积攒成批，减少写线程被唤醒的次数
+    """
+
+    def __init__(self, log_queue, *handlers, batch_size=config.LOG_BATCH_SIZE,
+                 flush_interval=config.LOG_FLUSH_INTERVAL):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name="LogWriter", daemon=True)
+        self._thread.start()
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = self._sentinel in batch
+            if stop:
+                del batch[batch.index(self._sentinel):]
+            self._handle_batch(batch)
+            if stop:
+                return
+            if len(batch) < self.batch_size:
+                time.sleep(self.flush_interval)
+
+    def _handle_batch(self, batch):
+        for handler in self.handlers:
+            handler.batching = True
+        try:
+            for record in batch:
+                self.handle(record)
+        finally:
+            for handler in self.handlers:
+                handler.batching = False
+                # 与 emit 出错时一样，flush 出错(如输出流已关闭)不能结束后台线程，否则之后的日志都会丢失
+                try:
+                    handler.flush()
+                except (OSError, ValueError):
+                    pass
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    只在入队前合并日志参数，格式化交给后台线程
+    """
+
+    def prepare(self, record):
+        # logger 只挂了这一个 handler，直接修改 record，不复制
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # 异常对象不跨线程传递，先格式化为文本
+            record.exc_text = fmt.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def get_logger(name):
+    """
+    获取子系统日志，如 get_logger('trade') 即 auto_make_money.trade，级别由 config.LOG_LEVELS 设置
+    """
+    return logger.getChild(name)
+
+
+def start_queue_logging(target, handlers, batch_size=config.LOG_BATCH_SIZE, flush_interval=config.LOG_FLUSH_INTERVAL):
+    """
+    把 target 的日志改为经队列由后台线程写入 handlers
+    :return: BatchQueueListener，程序退出前调用 stop() 写完剩余日志
+    """
+    log_queue = queue.SimpleQueue()
+    listener = BatchQueueListener(log_queue, *handlers, batch_size=batch_size, flush_interval=flush_interval)
+    target.handlers = [_QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+
+def _file_formatter():
+    return JsonFormatter() if config.LOG_FORMAT == 'json' else fmt
+
+
 # 日志输出到控制台
-sh = logging.StreamHandler()
+sh = BatchStreamHandler()
 sh.setFormatter(fmt)
 
 # 日志输出到文件
-log_file = "../logs/auto_make_money.log"
-os.makedirs(os.path.dirname(log_file), exist_ok=True)
-fh = logging.FileHandler(log_file, mode='a', encoding='utf-8')
-fh.setFormatter(fmt)
+log_file = config.LOG_FILE
+fh = RotatingFileHandler(log_file, max_bytes=config.LOG_MAX_BYTES, when=config.LOG_ROTATE_WHEN,
+                         backup_count=config.LOG_BACKUP_COUNT)
+fh.setFormatter(_file_formatter())
+
+for _name, _level in config.LOG_LEVELS.items():
+    (get_logger(_name) if _name else logger).setLevel(_level)
 
-logger.handlers.append(sh)
-logger.handlers.append(fh)
+listener = start_queue_logging(logger, [sh, fh])
+atexit.register(listener.stop)
@@ -0,0 +1,198 @@
+# -*- encoding: utf-8 -*-
+"""
+通知发件箱
+消息先写入本地 sqlite 队列立即返回，由后台线程发送:
+- 每次发送有超时，失败后按指数退避重试，超过最大次数后丢弃
+- 同时有多条待发送消息时合并为一次推送，等待重试的消息也随新消息一起发送
+- 进程退出时未发送的消息保留在队列中，下次启动继续发送
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+import config
+from utils.log import get_logger
+
+logger = get_logger('outbox')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL NOT NULL
+)
+"""
+
+
+class PushError(Exception):
+    pass
+
+
+def serverchan_sender(url, timeout=config.PUSH_TIMEOUT):
+    """
+    Server酱 推送
+    :param url: 推送地址，如 http://sc.ftqq.com/<SCKey>.send
+    :return: send(title, body) 函数，推送失败时抛出异常
+    """
+    sessions = []
+
+    def send(title, body):
+        # 在发送线程中才导入 requests
+        if not sessions:
+            import requests
+            sessions.append(requests.session())
+        resp = sessions[0].post(url, data={'text': title, 'desp': body}, timeout=timeout)
+        resp.raise_for_status()
+        data = resp.json()
+        # 旧版接口返回 errno，新版返回 code，0 表示成功
+        code = data.get('errno', data.get('code', 0))
+        if code != 0:
+            raise PushError("push failed, resp: %s" % data)
+        logger.info("push succeeded, resp: %s" % data)
+
+    return send
+
+
+class Outbox(object):
+    """
+    持久化的通知发件箱
+    :param path: sqlite 文件路径
+    :param send: send(title, body) 函数，失败时抛出异常
+    :param retry_interval/max_retry_interval: 第 n 次失败后等待 min(retry_interval * 2 ** (n - 1), max_retry_interval) 秒重试
+    :param max_attempts: 最多发送次数，超过后丢弃消息
+    """
+
+    def __init__(self, path, send, retry_interval=config.OUTBOX_RETRY_INTERVAL,
+                 max_retry_interval=config.OUTBOX_MAX_RETRY_INTERVAL, max_attempts=config.OUTBOX_MAX_ATTEMPTS):
+        self.path = path
+        self.send = send
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.max_attempts = max_attempts
+        self.pushes = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._thread = threading.Thread(target=self._run, name="OutboxSender", daemon=True)
+        self._thread.start()
+
+    def put(self, title, body):
+        """
+        写入待发送消息，不等待发送
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT INTO messages (title, body, created, next_try) VALUES (?, ?, ?, ?)",
+                               (title, body, now, now))
+        self._wakeup.set()
+
+    def pending(self):
+        """
+        待发送的消息数量
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def _due(self):
+        """
+        有消息到了发送时间时，连同在等待重试的消息一起取出
+        :return: (待发送的消息, 没有消息到发送时间时最近的发送时间)
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT id, title, body, attempts, next_try FROM messages ORDER BY id").fetchall()
+        if not rows:
+            return [], None
+        next_try = min(row[4] for row in rows)
+        if next_try > now:
+            return [], next_try
+        return rows, None
+
+    @staticmethod
+    def coalesce(rows):
+        """
+        多条消息合并为一次推送
+        """
+        if len(rows) == 1:
+            return rows[0][1], rows[0][2]
+        title = "%s 等%s条通知" % (rows[0][1], len(rows))
+        body = "\n\n---\n\n".join("### %s\n\n%s" % (row[1], row[2]) for row in rows)
+        return title, body
+
+    def _deliver(self, rows):
+        ids = [row[0] for row in rows]
+        marks = ','.join('?' * len(ids))
+        try:
+            self.send(*self.coalesce(rows))
+        except Exception as e:
+            # 每条消息按各自的发送次数退避，新消息不继承一起发送的旧消息的次数
+            now = time.time()
+            dropped, retries = [], []
+            for row in rows:
+                attempts = row[3] + 1
+                if attempts >= self.max_attempts:
+                    dropped.append(row[0])
+                else:
+                    delay = min(self.retry_interval * 2 ** (attempts - 1), self.max_retry_interval)
+                    retries.append((attempts, now + delay, row[0]))
+            logger.warning("push %s messages failed, retry %s, drop %s, err: %s"
+                           % (len(rows), len(retries), len(dropped), e))
+            with self._lock:
+                if dropped:
+                    logger.error("drop %s messages after %s attempts" % (len(dropped), self.max_attempts))
+                    self._conn.execute("DELETE FROM messages WHERE id IN (%s)" % ','.join('?' * len(dropped)),
+                                       dropped)
+                self._conn.executemany("UPDATE messages SET attempts = ?, next_try = ? WHERE id = ?", retries)
+            return
+
+        self.pushes += 1
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE id IN (%s)" % marks, ids)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                rows, next_try = self._due()
+                if rows:
+                    self._deliver(rows)
+                    continue
+                timeout = None if next_try is None else max(0.0, next_try - time.time())
+            except Exception as e:
+                # 数据库被锁、损坏或磁盘已满时不退出发送线程，等待后重试
+                logger.exception("outbox sender failed, retry in %.1fs, err: %s" % (self.retry_interval, e))
+                timeout = self.retry_interval
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def flush(self, timeout):
+        """
+        等待队列中的消息发送完，最多等待 timeout 秒，进程退出前调用
+        :return: bool 是否已全部发送
+        """
+        deadline = time.time() + timeout
+        self._wakeup.set()
+        while self.pending():
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=1):
+        """
+        停止发送线程，正在发送的推送最多等待 timeout 秒，未发送的消息保留在队列中
+        """
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            with self._lock:
+                self._conn.close()
@@ -0,0 +1,213 @@
+# -*- encoding: utf-8 -*-
+"""
+耗时统计
+用 span 上下文管理器或 timed 装饰器标记关键步骤，记录每次执行的耗时，一次运行结束后汇总为报告:
+- 按步骤统计次数、总耗时、平均和最大耗时(包含嵌套的子步骤)
+- 按 account 标签统计每个账户各步骤的耗时
+- 最慢的若干次执行(不含有子步骤的外层步骤)
+用法:
+    with span('trade.account', account=name):
+        ...
+
+    @timed('spider.get_today_data')
+    def get_today_data(self): ...
+"""
+
+import os
+import json
+import time
+import functools
+import threading
+from collections import deque, namedtuple
+
+import config
+
+# leaf: 没有嵌套子步骤
+Span = namedtuple('Span', ['name', 'start', 'duration', 'tags', 'leaf'])
+
+_EMPTY_TAGS = {}
+
+
+class _SpanContext(object):
+    __slots__ = ('recorder', 'name', 'tags', 'parent', 'start', 'leaf')
+
+    def __init__(self, recorder, name, tags):
+        self.recorder = recorder
+        self.name = name
+        self.tags = tags
+        self.parent = None
+        self.leaf = True
+
+    def tag(self, **tags):
+        """
+        补充标签，尚未结束的子步骤也会带上这些标签
+        """
+        self.tags = dict(self.tags, **tags)
+
+    def resolved_tags(self):
+        if self.parent is None:
+            return self.tags
+        parent_tags = self.parent.resolved_tags()
+        return dict(parent_tags, **self.tags) if self.tags else parent_tags
+
+    def __enter__(self):
+        stack = self.recorder._stack()
+        if stack:
+            self.parent = stack[-1]
+            self.parent.leaf = False
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        self.recorder._stack().pop()
+        # 结束时才合并外层标签，外层在子步骤执行期间补充的标签也会生效
+        self.recorder.spans.append(Span(self.name, self.start, duration, self.resolved_tags(), self.leaf))
+        self.parent = None
+        return False
+
+
+class _NullSpan(object):
+    def tag(self, **tags):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class PerfRecorder(object):
+    """
+    记录一次运行中各步骤的耗时
+    :param enabled: 为 False 时 span 不做任何记录
+    :param max_spans: 最多保留最近的执行次数，报告只统计保留的部分
+    """
+
+    def __init__(self, enabled=True, max_spans=config.PERF_MAX_SPANS):
+        self.enabled = enabled
+        self.spans = deque(maxlen=max_spans)
+        self.started = time.time()
+        self._started_at = time.perf_counter()
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def reset(self):
+        """
+        开始新的一次运行
+        """
+        self.spans = deque(maxlen=self.spans.maxlen)
+        self.started = time.time()
+        self._started_at = time.perf_counter()
+
+    def span(self, name, **tags):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _SpanContext(self, name, tags or _EMPTY_TAGS)
+
+    def report(self, slowest=config.PERF_SLOWEST):
+        """
+        汇总本次运行的耗时
+        :param slowest: 列出最慢的执行次数
+        :return: dict
+        """
+        spans = list(self.spans)
+        stages = {}
+        accounts = {}
+        for s in spans:
+            stat = stages.setdefault(s.name, {'name': s.name, 'count': 0, 'total': 0.0, 'max': 0.0, 'leaf': True})
+            stat['count'] += 1
+            stat['leaf'] = stat['leaf'] and s.leaf
+            stat['total'] += s.duration
+            stat['max'] = max(stat['max'], s.duration)
+
+            account = s.tags.get('account')
+            if account is not None:
+                account_stages = accounts.setdefault(str(account), {})
+                account_stages[s.name] = account_stages.get(s.name, 0.0) + s.duration
+
+        for stat in stages.values():
+            stat['mean'] = stat['total'] / stat['count']
+        return {
+            'started': self.started,
+            'elapsed': time.perf_counter() - self._started_at,
+            'stages': sorted(stages.values(), key=lambda stat: stat['total'], reverse=True),
+            'accounts': accounts,
+            # 只列出没有子步骤的执行，外层步骤的耗时已体现在 stages 中
+            'slowest': [{'name': s.name, 'duration': s.duration, 'tags': s.tags}
+                        for s in sorted((s for s in spans if s.leaf), key=lambda s: s.duration,
+                                        reverse=True)[:slowest]],
+        }
+
+
+recorder = PerfRecorder(config.PERF_ENABLED)
+
+
+def span(name, **tags):
+    """
+    记录一个步骤的耗时，嵌套的 span 继承外层的标签
+    """
+    return recorder.span(name, **tags)
+
+
+def timed(name=None):
+    """
+    记录函数耗时的装饰器，默认使用函数的限定名
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def format_report(report):
+    """
+    格式化为多行文本，用于日志
+    """
+    lines = ["perf report: elapsed %.2fs" % report['elapsed']]
+    for stat in report['stages']:
+        lines.append("  %-28s count=%-4s total=%8.3fs mean=%8.3fs max=%8.3fs" % (
+            stat['name'], stat['count'], stat['total'], stat['mean'], stat['max']))
+    for account, stages in report['accounts'].items():
+        lines.append("  account %s: %s" % (account, ', '.join(
+            '%s=%.2fs' % (name, seconds) for name, seconds in sorted(stages.items(), key=lambda x: -x[1]))))
+    for s in report['slowest']:
+        lines.append("  slowest %-20s %.3fs %s" % (s['name'], s['duration'], s['tags'] or ''))
+    return '\n'.join(lines)
+
+
+def summary(report, top=3):
+    """
+    一行摘要，用于推送消息，列出总耗时最多的几个最内层步骤
+    """
+    leaves = [stat for stat in report['stages'] if stat['leaf']] or report['stages']
+    stages = ', '.join('%s %.1fs' % (stat['name'], stat['total']) for stat in leaves[:top])
+    return "耗时 %.1fs (%s)" % (report['elapsed'], stages)
+
+
+def export_history(report, path=config.PERF_HISTORY_PATH, label=''):
+    """
+    把本次运行的汇总追加到历史文件(每行一条 JSON)，用于分析耗时趋势
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    record = dict(report, label=label, time=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(report['started'])))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
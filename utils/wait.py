@@ -0,0 +1,34 @@
+# -*- encoding: utf-8 -*-
+
+import time
+
+import config
+from utils.log import get_logger
+
+logger = get_logger('wait')
+
+
+def wait_until(condition, timeout=config.WAIT_TIMEOUT, interval=config.WAIT_INTERVAL,
+               max_interval=config.WAIT_MAX_INTERVAL, backoff=1.5):
+    """
+    轮询等待条件成立，代替固定时长的 sleep
+    轮询间隔从 interval 开始按 backoff 倍数增长，最长 max_interval，超过 timeout 后不再等待
+    :param condition: 无参函数，返回真值表示条件成立，抛出异常视为不成立(控件尚未就绪)
+    :return: 条件成立时返回 condition 的返回值，超时返回最后一次的返回值
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            ret = condition()
+        except Exception as e:
+            logger.debug("wait condition raise: %s" % e)
+            ret = None
+
+        if ret:
+            return ret
+
+        remain = deadline - time.perf_counter()
+        if remain <= 0:
+            return ret
+        time.sleep(min(interval, remain))
+        interval = min(interval * backoff, max_interval)
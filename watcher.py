@@ -0,0 +1,295 @@
+# -*- encoding: utf-8 -*-
+"""
+集思录盘中监控
+按自适应的间隔轮询可转债和封基列表，只在有意义的变化时触发回调:
+- 交易时段按北京时间计算，与 main.py 定时任务的 Asia/Shanghai 时区一致，不依赖主机的本地时区
+- 交易时段内每 WATCH_TRADING_INTERVAL 秒轮询，开盘/收盘前后、关注的转债临近强赎日时缩短为 WATCH_EVENT_INTERVAL 秒
+- 非交易时段不轮询，等待到下一个交易时段开始(最多等待 WATCH_IDLE_INTERVAL 秒后重新计算)
+- 每次拉取与上一次快照增量比对，检测 进入/掉出前 k 名、溢价率/折价率越过阈值、公告强赎
+- 统计轮询次数、网络请求数、缓存命中、下载字节数、CPU 时间，用于评估一整天的开销
+"""
+
+import time
+import datetime
+import threading
+from collections import namedtuple
+
+import config
+from utils.log import get_logger
+
+logger = get_logger('watch')
+
+# kind: enter_top/leave_top/premium_below/discount_above/redeem
+WatchEvent = namedtuple('WatchEvent', ['kind', 'code', 'name', 'message'])
+
+# 中国没有夏令时，Asia/Shanghai 固定为 UTC+8
+SHANGHAI = datetime.timezone(datetime.timedelta(hours=8), 'Asia/Shanghai')
+
+
+def shanghai_now():
+    """
+    当前北京时间(带时区)
+    """
+    return datetime.datetime.now(SHANGHAI)
+
+
+def _local(now):
+    # 带时区的时间转换为北京时间，不带时区的视为北京时间
+    return now.astimezone(SHANGHAI) if now.tzinfo is not None else now
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _session_bounds(day, sessions, tzinfo=None):
+    for start, end in sessions:
+        yield (datetime.datetime.combine(day, datetime.datetime.strptime(start, '%H:%M').time(), tzinfo),
+               datetime.datetime.combine(day, datetime.datetime.strptime(end, '%H:%M').time(), tzinfo))
+
+
+def current_session(now, sessions=config.WATCH_SESSIONS):
+    """
+    :return: now 所在交易时段的 (开始, 结束)，不在交易时段返回 None
+    """
+    now = _local(now)
+    if now.weekday() >= 5:
+        return None
+    for start, end in _session_bounds(now.date(), sessions, now.tzinfo):
+        if start <= now < end:
+            return start, end
+    return None
+
+
+def next_session_start(now, sessions=config.WATCH_SESSIONS):
+    """
+    下一个交易时段的开始时间，不考虑节假日
+    """
+    now = _local(now)
+    day = now.date()
+    while True:
+        if day.weekday() < 5:
+            for start, _ in _session_bounds(day, sessions, now.tzinfo):
+                if start > now:
+                    return start
+        day += datetime.timedelta(days=1)
+
+
+def poll_interval(now, urgent=False, sessions=config.WATCH_SESSIONS):
+    """
+    距离下一次轮询的秒数
+    :param urgent: 关注的转债临近强赎等事件
+    :return: (秒数, 是否在交易时段)
+    """
+    now = _local(now)
+    session = current_session(now, sessions)
+    if session is None:
+        wait = (next_session_start(now, sessions) - now).total_seconds()
+        return max(1.0, min(wait, config.WATCH_IDLE_INTERVAL)), False
+
+    start, end = session
+    edge = datetime.timedelta(minutes=config.WATCH_EDGE_MINUTES)
+    if urgent or now - start < edge or end - now < edge:
+        interval = config.WATCH_EVENT_INTERVAL
+    else:
+        interval = config.WATCH_TRADING_INTERVAL
+    # 不跨过收盘时间，收盘后转为等待下一个交易时段
+    return max(1.0, min(interval, (end - now).total_seconds())), True
+
+
+def rank_crossings(before, after, before_rows, after_rows, name_field, topk):
+    """
+    前 topk 名的进出
+    :param before/after: 更新前后前 topk 名的代码列表
+    :param before_rows/after_rows: 更新前后的 {代码: 行}
+    """
+    events = []
+    before_set, after_set = set(before), set(after)
+    for code in after:
+        if code not in before_set:
+            name = after_rows[code].get(name_field)
+            events.append(WatchEvent('enter_top', code, name, "%s %s 进入前%s名" % (code, name, topk)))
+    for code in before:
+        if code not in after_set:
+            name = (after_rows.get(code) or before_rows[code]).get(name_field)
+            events.append(WatchEvent('leave_top', code, name, "%s %s 掉出前%s名" % (code, name, topk)))
+    return events
+
+
+def threshold_crossings(delta, rows, field, threshold, below, kind, name_field, label):
+    """
+    字段越过阈值，新增的行直接与阈值比较
+    :param rows: 更新后的 {代码: 行}
+    :param below: True 表示从阈值以上降到阈值以下时触发，False 相反
+    """
+    def beyond(value):
+        value = _float(value)
+        return value is not None and (value < threshold if below else value > threshold)
+
+    events = []
+    candidates = [(code, None, row.get(field)) for code, row in delta.added.items()]
+    for code, diff in delta.changed.items():
+        if field in diff:
+            candidates.append((code,) + diff[field])
+    for code, old, new in candidates:
+        if beyond(new) and not beyond(old):
+            name = rows[code].get(name_field)
+            events.append(WatchEvent(kind, code, name, "%s %s %s %s" % (code, name, label, new)))
+    return events
+
+
+class JisiluWatcher(object):
+    """
+    集思录盘中监控
+    :param jsl: Jisilu，复用其 session 和快照
+    :param clock: 返回当前 datetime 的函数，默认为北京时间，不带时区的 datetime 视为北京时间
+    :param sleep: sleep(秒数) 函数，默认等待 stop()
+    """
+
+    def __init__(self, jsl, topk=config.WATCH_TOPK, fund_topk=config.WATCH_FUND_TOPK,
+                 premium_threshold=config.WATCH_PREMIUM_THRESHOLD,
+                 discount_threshold=config.WATCH_DISCOUNT_THRESHOLD, watchlist=(),
+                 clock=shanghai_now, sleep=None):
+        self.jsl = jsl
+        self.topk = topk
+        self.fund_topk = fund_topk
+        self.premium_threshold = premium_threshold
+        self.discount_threshold = discount_threshold
+        self.watchlist = set(watchlist)
+        self.clock = clock
+        self.callbacks = []
+        self.stats = {'polls': 0, 'failures': 0, 'requests': 0, 'cache_hits': 0, 'bytes': 0, 'cpu': 0.0,
+                      'events': 0}
+        self._stop = threading.Event()
+        self._sleep = sleep or self._stop.wait
+        # 已建立基准的数据类别: bonds/funds
+        self._primed = set()
+        session = getattr(jsl, 'session', None)
+        if session is not None:
+            session.hooks.setdefault('response', []).append(self._count_response)
+
+    def _count_response(self, resp, *args, **kwargs):
+        if getattr(resp, 'from_cache', False):
+            self.stats['cache_hits'] += 1
+        else:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += len(resp.content)
+        return resp
+
+    def subscribe(self, callback):
+        """
+        :param callback: callback(events)，只在有事件时调用
+        """
+        self.callbacks.append(callback)
+
+    def urgent(self, now):
+        """
+        前 topk 名或关注列表中的转债在今天到 WATCH_EVENT_DAYS 天内强赎，已经过了强赎日的不算
+        """
+        store = self.jsl.bond_snapshot
+        codes = self.watchlist | {row['bond_id'] for row in store.ranked(self.topk)}
+        now = _local(now)
+        today = now.strftime('%Y-%m-%d')
+        horizon = (now + datetime.timedelta(days=config.WATCH_EVENT_DAYS)).strftime('%Y-%m-%d')
+        for code in codes:
+            redeem_dt = store.rows.get(code, {}).get('redeem_dt')
+            if redeem_dt and today <= str(redeem_dt)[:10] <= horizon:
+                return True
+        return False
+
+    def _poll_bonds(self):
+        store = self.jsl.bond_snapshot
+        before = [row['bond_id'] for row in store.ranked(self.topk)]
+        before_rows = store.rows
+        delta = self.jsl.update_convert_bonds()
+        if 'bonds' not in self._primed:
+            self._primed.add('bonds')
+            return []
+        if not delta:
+            return []
+
+        after = [row['bond_id'] for row in store.ranked(self.topk)]
+        events = rank_crossings(before, after, before_rows, store.rows, 'bond_nm', self.topk)
+        events += threshold_crossings(delta, store.rows, 'premium_rt', self.premium_threshold,
+                                      True, 'premium_below', 'bond_nm', '溢价率低于阈值:')
+        for code, diff in delta.changed.items():
+            if 'redeem_dt' in diff and diff['redeem_dt'][1] and not diff['redeem_dt'][0]:
+                name = store.rows[code].get('bond_nm')
+                events.append(WatchEvent('redeem', code, name, "%s %s 公告强赎: %s" % (
+                    code, name, diff['redeem_dt'][1])))
+        return events
+
+    def _poll_funds(self):
+        store = self.jsl.fund_snapshot
+        before = [row['fund_id'] for row in store.ranked(self.fund_topk)]
+        before_rows = store.rows
+        delta = self.jsl.update_closed_funds()
+        if 'funds' not in self._primed:
+            self._primed.add('funds')
+            return []
+        if not delta:
+            return []
+
+        after = [row['fund_id'] for row in store.ranked(self.fund_topk)]
+        events = rank_crossings(before, after, before_rows, store.rows, 'fund_nm', self.fund_topk)
+        events += threshold_crossings(delta, store.rows, 'discount_rt', self.discount_threshold,
+                                      False, 'discount_above', 'fund_nm', '折价率高于阈值:')
+        return events
+
+    def poll(self):
+        """
+        拉取一次可转债和封基数据，返回检测到的事件，每类数据第一次拉取成功只建立基准不产生事件
+        可转债和封基分别拉取，一类失败时不影响另一类已经检测到的事件
+        """
+        cpu = time.process_time()
+        events = []
+        for name, func in (('bonds', self._poll_bonds), ('funds', self._poll_funds)):
+            try:
+                events += func()
+            except Exception as e:
+                self.stats['failures'] += 1
+                logger.warning("watch poll %s failed, err: %s" % (name, e))
+
+        self.stats['polls'] += 1
+        self.stats['events'] += len(events)
+        self.stats['cpu'] += time.process_time() - cpu
+        return events
+
+    def _fire(self, events):
+        for callback in self.callbacks:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.exception("watch callback failed, err: %s" % e)
+
+    def run(self, max_polls=None):
+        """
+        阻塞运行直到 stop() 或达到 max_polls 次轮询
+        """
+        while not self._stop.is_set():
+            now = self.clock()
+            interval, trading = poll_interval(now, 'bonds' in self._primed and self.urgent(now))
+            if trading:
+                try:
+                    events = self.poll()
+                except Exception as e:
+                    logger.warning("watch poll failed, err: %s" % e)
+                    events = []
+                if events:
+                    logger.info("watch events: %s" % [event.message for event in events])
+                    self._fire(events)
+                if max_polls is not None and self.stats['polls'] >= max_polls:
+                    return
+            self._sleep(interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def format_stats(self):
+        stats = self.stats
+        return "polls=%s failures=%s requests=%s cache_hits=%s bytes=%s cpu=%.2fs events=%s" % (
+            stats['polls'], stats['failures'], stats['requests'], stats['cache_hits'], stats['bytes'], stats['cpu'],
+            stats['events'])
@@ -1,7 +1,10 @@
 # coding:utf-8
 
+import config
 from ths_trader import THSTrader
 from jisilu import Jisilu
+from reconcile import PositionReconciler, closed_fund_rank_index
+from rebalance import plan_rebalance, execute_rebalance, format_orders
 
 """
 银河证券交易客户端
@@ -10,9 +13,10 @@ from jisilu import Jisilu
 
 class YHTrader(THSTrader):
 
-    def __init__(self, exe_path):
-        super().__init__(exe_path)
+    def __init__(self, exe_path, driver=None):
+        super().__init__(exe_path, driver)
         self.jsl = Jisilu()
+        self.reconciler = PositionReconciler()
 
     def get_closed_funds(self):
         """
@@ -35,47 +39,45 @@ class YHTrader(THSTrader):
 
         return ', '.join(res)
 
-    def compare_closed_fund_position(self):
+    def reconcile_closed_funds(self):
         """
-        比较持仓数据
+        封基持仓对账：导出一次持仓、拉取一次封基数据，得到每个持仓的排名、市值、仓位和排名变化
+        :return: reconcile.Reconciliation
         """
-        data = self.get_closed_funds()
-        funds = {}
-        for item in data:
-            try:
-                discount_rt = float(item['discount_rt'])
-                left_year = float(item['left_year'])
-
-                funds[item['fund_id']] = {
-                    'fund_id': item['fund_id'],
-                    'fund_nm': item['fund_nm'],
-                    'discount_rt': discount_rt,
-                    'left_year': left_year,
-                    'maturity_dt': item['maturity_dt'],
-                    'discount_factor': (discount_rt - 1.5) / left_year
-                }
-            except ValueError:
-                pass
-
-        funds_arr = sorted(funds.values(), key=lambda x: x['discount_factor'], reverse=True)
-        for i in range(len(funds_arr)):
-            id = funds_arr[i]['fund_id']
-            funds[id]['rank'] = i
-
+        index = closed_fund_rank_index(self.get_closed_funds())
         positions = self.get_position()
-        for position in positions:
-            id = position['证券代码']
-
-            if not id in funds:
-                continue
+        return self.reconciler.reconcile(index, positions)
 
-            name = position['证券名称']
-            amount = position['股份余额']
-            price = position['参考市价']
-            money = position['参考市值']
-
-            item = funds[id]
-            print(self.format_closed_fund(item))
+    def compare_closed_fund_position(self, topk=10):
+        """
+        比较持仓数据
+        :param topk: 同时列出掉出前 topk 名的持仓和前 topk 名中未持有的封基
+        :return: reconcile.Reconciliation
+        """
+        table = self.reconcile_closed_funds()
+        for item in table.matched():
+            print("%s, 持仓: %s, 市值: %.2f, 仓位: %.2f%%, 排名变化: %s" % (
+                self.format_closed_fund(item), item['amount'], item['market_value'], item['weight'] * 100,
+                item['rank_drift']))
+
+        print("前%s名以外的持仓: %s" % (topk, ', '.join(
+            "%s(%s)" % (row['code'], row['rank']) for row in table.outside_top(topk))))
+        print("前%s名中未持有: %s" % (topk, ', '.join(
+            "%s(%s)" % (row['fund_id'], row['rank']) for row in table.missing_top(topk))))
+        return table
+
+    def rebalance_closed_funds(self, topk=config.REBALANCE_TOPK, cash=0.0, dry_run=True):
+        """
+        封基轮动：调仓到折价因子排名前 topk 的等权组合，只提交必要的委托
+        :param cash: 可用于买入的现金
+        :param dry_run: 只计算委托，不提交
+        :return: (委托列表, 委托结果)
+        """
+        orders = plan_rebalance(self.reconcile_closed_funds(), topk, cash)
+        print(format_orders(orders) or "无需调仓")
+        if dry_run or not orders:
+            return orders, []
+        return orders, execute_rebalance(self, orders, cash)
 
 
 if __name__ == '__main__':